@@ -6,19 +6,39 @@ import shutil
 import subprocess
 import json
 import re
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from PIL import Image
-import tempfile
+
+from apk_builder.tool_daemon import run_apktool
+from apk_builder.template_cache import get_template_cache
+from apk_builder.string_resources import index_app_name_files, set_app_names
+from apk_builder.workspace import get_workspace_budget
+from apk_builder.zipalign import align_apk
+from common.tracing import tracer
 
 
 class APKBuilder:
 
+  # jarsigner only knows -directsign (no signing-time attribute) since JDK 16
+  directsign_supported = True
+
+  # app_name resource files per template, when there is no template cache
+  _app_name_files = {}
+
   def __init__(self, base_version='base_1'):
     self.base_version = base_version
     # Create unique temp directory for this build to avoid concurrency issues
-    self.work_dir = Path(tempfile.mkdtemp(prefix='apk_build_'))
+    # (on tmpfs when BUILD_RAM_WORKSPACE is set and the memory budget allows)
+    self.work_dir, self.workspace = get_workspace_budget().allocate()
+    self._workspace_released = False
     self.decompiled_dir = None
     self.output_apk = None
+    # Seconds spent in each build stage, filled in by build()
+    self.stage_timings = {}
+    # Files edited inside decompiled_dir (untouched ones may be cache hard links)
+    self.modified_files = set()
 
     # Load config
     with open('apk_builder/config.json', 'r') as f:
@@ -36,45 +56,91 @@ class APKBuilder:
                                    self.keystore_config['store_pass'])
     self.key_pass = os.getenv('KEY_PASS', self.keystore_config['key_pass'])
 
+  @contextmanager
+  def _stage(self, name):
+    """Record how long a build stage takes"""
+    started = time.monotonic()
+    try:
+      with tracer.span(f'build.{name}'):
+        yield
+    finally:
+      self.stage_timings[name] = round(time.monotonic() - started, 3)
+
   def cleanup(self):
     """Clean up temporary files - removes entire unique work directory"""
     if self.work_dir and self.work_dir.exists():
       shutil.rmtree(self.work_dir, ignore_errors=True)
+    if not self._workspace_released:
+      self._workspace_released = True
+      get_workspace_budget().release(self.workspace, self.work_dir)
+
+  def _reset_work_dir(self):
+    """Empty the work directory, keeping its workspace reservation"""
+    shutil.rmtree(self.work_dir, ignore_errors=True)
+    self.work_dir.mkdir(parents=True, exist_ok=True)
+
+  def _writable(self, path):
+    """Detach a file from the template cache before it is edited"""
+    path = Path(path)
+    if path.exists() and path.stat().st_nlink > 1:
+      tmp = path.with_name(path.name + '.tmp')
+      shutil.copy2(path, tmp)
+      os.replace(tmp, path)
+    self.modified_files.add(path)
+    return path
 
   def decompile(self):
     """Decompile base APK using apktool"""
     base_apk = self.base_config['apk_path']
     self.decompiled_dir = self.work_dir / 'decompiled'
+    self.modified_files = set()
 
-    # Decompile APK (cross-platform)
-    cmd = ['apktool', 'd', str(base_apk), '-o', str(self.decompiled_dir), '-f']
+    # Check out the cached decompiled template instead of decompiling again
+    template_cache = get_template_cache()
+    if template_cache:
+      template_cache.checkout(self.base_version, base_apk, self.decompiled_dir)
+      return True
 
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    # Decompile APK (cross-platform, via the warm apktool daemon when enabled)
+    result = run_apktool(['d', str(base_apk), '-o', str(self.decompiled_dir), '-f'])
     if result.returncode != 0:
       raise Exception(f"Decompile failed: {result.stderr}")
 
     return True
 
-  def modify_app_name(self, new_name):
-    """Modify app name in strings.xml"""
-    if not self.decompiled_dir:
-      raise Exception("APK not decompiled yet")
-
-    strings_path = self.decompiled_dir / 'res' / 'values' / 'strings.xml'
-
-    if not strings_path.exists():
-      raise Exception(f"strings.xml not found at {strings_path}")
+  def _template_app_name_files(self):
+    """Resource files of the template that define app_name (indexed once per template)"""
+    base_apk = self.base_config['apk_path']
+    template_cache = get_template_cache()
+    if template_cache:
+      return template_cache.app_name_files(self.base_version, base_apk)
 
-    with open(strings_path, 'r', encoding='utf-8') as f:
-      content = f.read()
+    stat = os.stat(base_apk)
+    key = (self.base_version, os.path.abspath(base_apk), stat.st_size, stat.st_mtime_ns)
+    if key not in APKBuilder._app_name_files:
+      APKBuilder._app_name_files[key] = index_app_name_files(self.decompiled_dir)
+    return APKBuilder._app_name_files[key]
 
-    # Replace app_name value
-    content = re.sub(r'(<string name="app_name">).*?(</string>)',
-                     rf'\1{new_name}\2', content)
+  def modify_app_name(self, new_name, localized_names=None):
+    """
+        Set the app name in every strings file that defines it, adding
+        files for requested locales the template doesn't translate
+        
+        Args:
+            new_name: Default app name
+            localized_names: Optional {locale: app name} (normalized, e.g.
+                             'fr', 'pt-rBR'); other locales get new_name
+        """
+    if not self.decompiled_dir:
+      raise Exception("APK not decompiled yet")
 
-    with open(strings_path, 'w', encoding='utf-8') as f:
-      f.write(content)
+    files = self._template_app_name_files()
+    if not any(os.path.dirname(path) == 'res/values' for path in files):
+      raise Exception(f"app_name not found in {self.decompiled_dir / 'res' / 'values'}")
 
+    # Rewritten files are replaced, which also detaches them from the template cache
+    changed = set_app_names(self.decompiled_dir, files, new_name, localized_names)
+    self.modified_files.update(changed)
     return True
 
   def modify_url(self, new_url):
@@ -102,7 +168,7 @@ class APKBuilder:
 
     content = re.sub(url_pattern, replace_url, content)
 
-    with open(main_activity_path, 'w', encoding='utf-8') as f:
+    with open(self._writable(main_activity_path), 'w', encoding='utf-8') as f:
       f.write(content)
 
     return True
@@ -124,6 +190,12 @@ class APKBuilder:
         'xxxhdpi': 192
     }
 
+    # Slim templates only carry some densities; don't add the others back
+    kept_densities = self.base_config.get('densities')
+    if kept_densities and any(density in icon_sizes for density in kept_densities):
+      icon_sizes = {density: size for density, size in icon_sizes.items()
+                    if density in kept_densities}
+
     # Open source icon
     try:
       source_icon = Image.open(icon_path)
@@ -141,7 +213,7 @@ class APKBuilder:
 
       # Save as ic_launcher.png
       icon_output = mipmap_dir / 'ic_launcher.png'
-      resized_icon.save(icon_output, 'PNG')
+      resized_icon.save(self._writable(icon_output), 'PNG')
 
     return True
 
@@ -150,39 +222,77 @@ class APKBuilder:
     self.output_apk = self.work_dir / output_name
 
     # Build APK
-    cmd = ['apktool', 'b', str(self.decompiled_dir), '-o', str(self.output_apk)]
-
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = run_apktool(['b', str(self.decompiled_dir), '-o', str(self.output_apk)])
     if result.returncode != 0:
       raise Exception(f"Recompile failed: {result.stderr}")
 
+    # Keep dex files of untouched smali folders for the next build
+    template_cache = get_template_cache()
+    if template_cache:
+      try:
+        template_cache.store_intermediates(self.base_version,
+                                           self.base_config['apk_path'],
+                                           self.decompiled_dir,
+                                           self.modified_files)
+      except Exception as e:
+        print(f"Could not cache build intermediates: {e}")
+
     return True
 
-  def sign(self, output_name='signed.apk'):
+  def sign(self, output_name='signed-unaligned.apk'):
     """Sign APK using jarsigner (compatible with all Java versions)"""
     if not self.output_apk:
       raise Exception("No APK to sign")
 
     signed_apk = self.work_dir / output_name
 
-    # First, create a copy for signing
-    shutil.copy(str(self.output_apk), str(signed_apk))
-
-    # Use jarsigner (comes with Java, always available)
-    cmd = (f'jarsigner -verbose -sigalg SHA256withRSA -digestalg SHA-256 '
-           f'-keystore "{self.keystore_path}" '
-           f'-storepass {self.keystore_pass} '
-           f'-keypass {self.key_pass} '
-           f'"{signed_apk}" {self.keystore_alias}')
-
-    result = subprocess.run(cmd, capture_output=True, text=True, shell=True)
+    # Use jarsigner (comes with Java, always available); -signedjar writes
+    # the signed copy directly instead of copying first and signing in place.
+    # -directsign leaves out the signing time so the signature is reproducible.
+    def jarsigner_cmd(directsign):
+      return (f'jarsigner -verbose -sigalg SHA256withRSA -digestalg SHA-256 '
+              f'{"-directsign " if directsign else ""}'
+              f'-keystore "{self.keystore_path}" '
+              f'-storepass {self.keystore_pass} '
+              f'-keypass {self.key_pass} '
+              f'-signedjar "{signed_apk}" '
+              f'"{self.output_apk}" {self.keystore_alias}')
+
+    def run_jarsigner(directsign):
+      with tracer.span('subprocess.jarsigner', directsign=directsign) as span:
+        result = subprocess.run(jarsigner_cmd(directsign), capture_output=True, text=True, shell=True)
+        span.set_attribute('returncode', result.returncode)
+        return result
+
+    result = run_jarsigner(APKBuilder.directsign_supported)
+    if result.returncode != 0 and APKBuilder.directsign_supported \
+        and '-directsign' in result.stdout + result.stderr:
+      print("jarsigner has no -directsign (JDK < 16); signatures won't be reproducible")
+      APKBuilder.directsign_supported = False
+      result = run_jarsigner(False)
     if result.returncode != 0:
       raise Exception(f"Signing failed: {result.stderr}")
 
     self.output_apk = signed_apk
     return True
 
-  def build(self, app_name, url, icon_path=None):
+  def align(self, output_name='signed.apk'):
+    """Apply the store/deflate policy and zipalign the signed APK"""
+    if not self.output_apk:
+      raise Exception("No APK to align")
+
+    aligned_apk = self.work_dir / output_name
+
+    # Must run after jarsigner, which rewrites the archive without padding.
+    # The v1 signature covers entry contents, so changing compression is safe.
+    stats = align_apk(str(self.output_apk), str(aligned_apk))
+    print(f"   Aligned: {stats['stored']} stored, {stats['deflated']} deflated, "
+          f"{stats['recompressed']} recompressed")
+
+    self.output_apk = aligned_apk
+    return True
+
+  def build(self, app_name, url, icon_path=None, app_names=None):
     """
         Complete build process
         
@@ -190,43 +300,60 @@ class APKBuilder:
             app_name: New app name
             url: Website URL
             icon_path: Path to custom icon (optional)
+            app_names: App name per locale, e.g. {'fr': 'Mon App'} (optional)
         
         Returns:
             Path to signed APK
         """
+    with tracer.span('apk_build', base_version=self.base_version, workspace=self.workspace):
+      return self._build(app_name, url, icon_path, app_names)
+
+  def _build(self, app_name, url, icon_path, app_names=None):
     try:
       print("Starting APK build process...")
 
       # 1. Cleanup
-      print("1. Cleaning up workspace...")
-      self.cleanup()
+      print(f"1. Cleaning up workspace ({self.workspace}: {self.work_dir})...")
+      self._reset_work_dir()
 
       # 2. Decompile
       print("2. Decompiling base APK...")
-      self.decompile()
+      with self._stage('decompile'):
+        self.decompile()
 
       # 3. Modify app name
-      print(f"3. Setting app name to: {app_name}")
-      self.modify_app_name(app_name)
+      print(f"3. Setting app name to: {app_name}" +
+            (f" ({len(app_names)} localized)" if app_names else ""))
+      with self._stage('app_name'):
+        self.modify_app_name(app_name, app_names)
 
       # 4. Modify URL
       print(f"4. Setting URL to: {url}")
-      self.modify_url(url)
+      with self._stage('url'):
+        self.modify_url(url)
 
       # 5. Modify icon (if provided)
       if icon_path:
         print("5. Replacing app icon...")
-        self.modify_icon(icon_path)
+        with self._stage('icon'):
+          self.modify_icon(icon_path)
       else:
         print("5. Skipping icon replacement (not provided)")
 
       # 6. Recompile
       print("6. Recompiling APK...")
-      self.recompile()
+      with self._stage('recompile'):
+        self.recompile()
 
       # 7. Sign
       print("7. Signing APK with jarsigner...")
-      self.sign()
+      with self._stage('sign'):
+        self.sign()
+
+      # 8. Align
+      print("8. Aligning APK...")
+      with self._stage('align'):
+        self.align()
 
       print(f"✓ APK build complete: {self.output_apk}")
       return str(self.output_apk)
@@ -237,7 +364,7 @@ class APKBuilder:
 
 
 # Convenience function
-def build_apk(app_name, url, icon_path=None, base_version='base_1'):
+def build_apk(app_name, url, icon_path=None, base_version='base_1', app_names=None):
   """Build custom APK with given parameters"""
   builder = APKBuilder(base_version=base_version)
-  return builder.build(app_name, url, icon_path)
+  return builder.build(app_name, url, icon_path, app_names)
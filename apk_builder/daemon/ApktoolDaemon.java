@@ -0,0 +1,123 @@
+import java.io.BufferedReader;
+import java.io.ByteArrayOutputStream;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.nio.charset.StandardCharsets;
+import java.security.Permission;
+
+/**
+ * Long-lived apktool host: keeps apktool's classes loaded and JIT-warm
+ * between builds. Started by apk_builder/tool_daemon.py with apktool.jar on
+ * the classpath (java -cp apktool.jar ApktoolDaemon.java).
+ *
+ * apktool's CLI calls System.exit on its error paths, which would take the
+ * daemon down with it; a security manager turns those calls into the
+ * command's exit code instead (needs -Djava.security.manager=allow on Java
+ * 18+). Where that is no longer supported the daemon refuses to start and
+ * the builder uses plain subprocesses.
+ *
+ * Protocol (one request per connection, loopback only):
+ *   request:  "<argc>\n" followed by one argument per line
+ *   response: "<exit code> <stdout bytes> <stderr bytes>\n" then stdout, stderr
+ */
+public class ApktoolDaemon {
+    /** Thrown instead of exiting the JVM when apktool calls System.exit */
+    static final class ExitTrapped extends SecurityException {
+        final int status;
+
+        ExitTrapped(int status) {
+            super("apktool called System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    /** Status of the last System.exit call made by the running command */
+    static volatile Integer exitStatus = null;
+
+    @SuppressWarnings("removal")
+    static boolean installExitTrap() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+
+                @Override
+                public void checkExit(int status) {
+                    exitStatus = status;
+                    throw new ExitTrapped(status);
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            return false;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        if (!installExitTrap()) {
+            System.out.println("UNSUPPORTED cannot trap System.exit on this JVM");
+            System.out.flush();
+            return;
+        }
+        ServerSocket server = new ServerSocket(0, 1, InetAddress.getLoopbackAddress());
+        PrintStream realOut = System.out;
+        PrintStream realErr = System.err;
+        realOut.println("READY " + server.getLocalPort());
+        realOut.flush();
+
+        while (true) {
+            try (Socket socket = server.accept()) {
+                BufferedReader in = new BufferedReader(
+                    new InputStreamReader(socket.getInputStream(), StandardCharsets.UTF_8));
+                int argc = Integer.parseInt(in.readLine().trim());
+                String[] toolArgs = new String[argc];
+                for (int i = 0; i < argc; i++) {
+                    toolArgs[i] = in.readLine();
+                }
+
+                ByteArrayOutputStream out = new ByteArrayOutputStream();
+                ByteArrayOutputStream err = new ByteArrayOutputStream();
+                int code = 0;
+                exitStatus = null;
+                System.setOut(new PrintStream(out, true, "UTF-8"));
+                System.setErr(new PrintStream(err, true, "UTF-8"));
+                try {
+                    brut.apktool.Main.main(toolArgs);
+                } catch (ExitTrapped e) {
+                    // Reported through exitStatus below
+                } catch (Throwable t) {
+                    t.printStackTrace(System.err);
+                    code = 1;
+                } finally {
+                    if (exitStatus != null) {
+                        code = exitStatus;
+                    }
+                    System.out.flush();
+                    System.err.flush();
+                    System.setOut(realOut);
+                    System.setErr(realErr);
+                }
+
+                byte[] outBytes = out.toByteArray();
+                byte[] errBytes = err.toByteArray();
+                OutputStream response = socket.getOutputStream();
+                response.write((code + " " + outBytes.length + " " + errBytes.length + "\n")
+                    .getBytes(StandardCharsets.UTF_8));
+                response.write(outBytes);
+                response.write(errBytes);
+                response.flush();
+            } catch (Exception e) {
+                e.printStackTrace(realErr);
+            }
+        }
+    }
+}
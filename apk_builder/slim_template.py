@@ -0,0 +1,312 @@
+"""
+Template slimming
+Produces a "slim" variant of a base template: resource directories for
+locales and densities outside an allowlist are dropped, and file resources
+(drawables, layouts, animations, ...) that nothing references are removed.
+The slim APK is written next to the original and registered in config.json
+as a base version of its own, so decompile, recompile and downloads all get
+smaller for builds that use it.
+
+Usage (from the project root):
+    python -m apk_builder.slim_template base_1 --name base_1_slim \
+        --locales en,es,pt-rBR --densities xhdpi,xxhdpi,xxxhdpi --prefer
+"""
+import os
+import re
+import json
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+from apk_builder.tool_daemon import run_apktool
+
+CONFIG_PATH = 'apk_builder/config.json'
+
+DENSITY_RE = re.compile(r'^(?:l|m|tv|h|xh|xxh|xxxh|\d+)dpi$')
+# Always kept: they apply to every density
+DENSITY_INDEPENDENT = ('nodpi', 'anydpi')
+# Two/three letter qualifiers that are not languages
+NON_LOCALE_QUALIFIERS = ('car', 'hdr')
+
+# File-based resource types that are safe to drop when unreferenced
+# (raw, xml and font resources are often looked up by name at runtime)
+PRUNABLE_TYPES = ('drawable', 'mipmap', 'layout', 'anim', 'animator',
+                  'interpolator', 'color', 'menu')
+
+XML_REFERENCE_RE = re.compile(r'@\+?(\w+)/([\w.]+)')
+SMALI_FIELD_RE = re.compile(r'R\$(\w+);->(\w+):I')
+SMALI_ID_RE = re.compile(r'0x7f[0-9a-f]{6}\b')
+SMALI_STRING_RE = re.compile(r'const-string(?:/jumbo)? [vp]\d+, "(\w+)"')
+PUBLIC_RE = re.compile(r'<public type="(\w+)" name="([^"]+)" id="(0x[0-9a-f]+)" />')
+VALUE_DEFINITION_RE = re.compile(r'<(\w+)(?: type="(\w+)")? name="([^"]+)"')
+
+
+def parse_qualifiers(dirname):
+    """Split 'drawable-en-rGB-xhdpi' into ('drawable', locale, density, other qualifiers)"""
+    parts = dirname.split('-')
+    res_type, qualifiers = parts[0], parts[1:]
+    locale = density = None
+    rest = []
+    i = 0
+    while i < len(qualifiers):
+        token = qualifiers[i]
+        if locale is None and token.startswith('b+'):
+            locale = token[2:].split('+')[0]
+        elif locale is None and re.match(r'^[a-z]{2,3}$', token) and token not in NON_LOCALE_QUALIFIERS:
+            locale = token
+            if i + 1 < len(qualifiers) and re.match(r'^r[A-Z]{2}$', qualifiers[i + 1]):
+                locale = f'{token}-{qualifiers[i + 1]}'
+                i += 1
+        elif density is None and DENSITY_RE.match(token):
+            density = token
+        else:
+            rest.append(token)
+        i += 1
+    return res_type, locale, density, rest
+
+
+def resource_name(filename):
+    """'abc_btn.9.png' -> 'abc_btn'"""
+    return filename.split('.', 1)[0]
+
+
+def _definitions(res_dir):
+    """(type, name) pairs a resource directory defines"""
+    res_type = res_dir.name.split('-')[0]
+    if res_type != 'values':
+        return {(res_type, resource_name(path.name)) for path in res_dir.iterdir()}
+    defined = set()
+    for path in res_dir.glob('*.xml'):
+        if path.name == 'public.xml':
+            continue
+        for tag, item_type, name in VALUE_DEFINITION_RE.findall(path.read_text(encoding='utf-8')):
+            defined.add((item_type or ('array' if tag.endswith('array') else tag), name))
+    return defined
+
+
+class TemplateSlimmer:
+    def __init__(self, decompiled_dir, locales, densities):
+        self.decompiled_dir = Path(decompiled_dir)
+        self.res_dir = self.decompiled_dir / 'res'
+        self.locales = set(locales)
+        self.densities = set(densities)
+        self.removed_files = 0
+        self.removed_bytes = 0
+
+    def _remove(self, path):
+        if path.is_dir():
+            for child in path.rglob('*'):
+                if child.is_file():
+                    self.removed_files += 1
+                    self.removed_bytes += child.stat().st_size
+            shutil.rmtree(path)
+        else:
+            self.removed_files += 1
+            self.removed_bytes += path.stat().st_size
+            path.unlink()
+
+    def _locale_allowed(self, locale):
+        return locale is None or locale in self.locales or locale.split('-')[0] in self.locales
+
+    def _density_allowed(self, density):
+        return density is None or density in DENSITY_INDEPENDENT or density in self.densities
+
+    def drop_qualifiers(self):
+        """Remove locale/density directories, never the last definition of a resource"""
+        dropped, kept = [], []
+        for res_dir in sorted(self.res_dir.iterdir()):
+            if not res_dir.is_dir():
+                continue
+            _, locale, density, _ = parse_qualifiers(res_dir.name)
+            if self._locale_allowed(locale) and self._density_allowed(density):
+                kept.append(res_dir)
+            else:
+                dropped.append(res_dir)
+
+        kept_definitions = set()
+        for res_dir in kept:
+            kept_definitions |= _definitions(res_dir)
+
+        # Highest densities first, so a resource that only exists outside the
+        # allowlist keeps its sharpest copy
+        def density_rank(res_dir):
+            density = parse_qualifiers(res_dir.name)[2] or ''
+            return -len(density)
+
+        for res_dir in sorted(dropped, key=density_rank):
+            orphans = _definitions(res_dir) - kept_definitions
+            if not orphans:
+                self._remove(res_dir)
+                continue
+            if res_dir.name.startswith('values'):
+                kept_definitions |= _definitions(res_dir)
+                continue
+            for path in list(res_dir.iterdir()):
+                key = (res_dir.name.split('-')[0], resource_name(path.name))
+                if key in orphans:
+                    kept_definitions.add(key)
+                else:
+                    self._remove(path)
+
+    def _public_ids(self):
+        public = self.res_dir / 'values' / 'public.xml'
+        if not public.exists():
+            return {}
+        return {res_id: (res_type, name)
+                for res_type, name, res_id in PUBLIC_RE.findall(public.read_text(encoding='utf-8'))}
+
+    def _smali_references(self, public_ids):
+        referenced, names = set(), set()
+        for smali in self.decompiled_dir.glob('smali*/**/*.smali'):
+            # R classes declare every resource; only real uses count
+            if smali.name == 'R.smali' or smali.name.startswith('R$'):
+                continue
+            text = smali.read_text(encoding='utf-8', errors='replace')
+            referenced.update(SMALI_FIELD_RE.findall(text))
+            referenced.update(public_ids[res_id] for res_id in SMALI_ID_RE.findall(text)
+                              if res_id in public_ids)
+            names.update(SMALI_STRING_RE.findall(text))
+        return referenced, names
+
+    def prune_unreferenced(self):
+        """Remove prunable file resources not reachable from code, manifest or values"""
+        public_ids = self._public_ids()
+        referenced, names = self._smali_references(public_ids)
+
+        candidates = {}
+        roots = [self.decompiled_dir / 'AndroidManifest.xml']
+        for res_dir in self.res_dir.iterdir():
+            if not res_dir.is_dir():
+                continue
+            res_type = res_dir.name.split('-')[0]
+            for path in res_dir.iterdir():
+                if res_type in PRUNABLE_TYPES:
+                    candidates.setdefault((res_type, resource_name(path.name)), []).append(path)
+                elif path.suffix == '.xml':
+                    roots.append(path)
+
+        # Resources named in code (getIdentifier lookups) count as used
+        referenced.update(key for key in candidates if key[1] in names)
+
+        # Walk references from the roots through the XML of kept resources
+        pending = list(roots)
+        for key in referenced:
+            pending.extend(candidates.get(key, []))
+        while pending:
+            path = pending.pop()
+            if path.suffix != '.xml':
+                continue
+            for key in XML_REFERENCE_RE.findall(path.read_text(encoding='utf-8', errors='replace')):
+                if key in candidates and key not in referenced:
+                    referenced.add(key)
+                    pending.extend(candidates[key])
+
+        removed = set()
+        for key, paths in candidates.items():
+            if key not in referenced:
+                for path in paths:
+                    self._remove(path)
+                removed.add(key)
+        return removed
+
+    def rewrite_public_xml(self):
+        """Drop public.xml entries whose resource no longer exists (aapt rejects them)"""
+        public = self.res_dir / 'values' / 'public.xml'
+        if not public.exists():
+            return
+        defined = set()
+        for res_dir in self.res_dir.iterdir():
+            if res_dir.is_dir():
+                defined |= _definitions(res_dir)
+        # ids, attrs and styleables may be declared implicitly (@+id, declare-styleable)
+        implicit = ('id', 'attr', 'style', 'styleable')
+
+        lines = public.read_text(encoding='utf-8').splitlines(keepends=True)
+        kept = [line for line in lines
+                if not (match := PUBLIC_RE.search(line))
+                or match.group(1) in implicit
+                or (match.group(1), match.group(2)) in defined]
+        public.write_text(''.join(kept), encoding='utf-8')
+
+    def slim(self, prune=True):
+        self.drop_qualifiers()
+        if prune:
+            self.prune_unreferenced()
+        self.rewrite_public_xml()
+        return {'removed_files': self.removed_files, 'removed_bytes': self.removed_bytes}
+
+
+def register_variant(base_version, name, apk_path, locales, densities, prefer,
+                     config_path=CONFIG_PATH):
+    """Add the slim template to config.json as a selectable base version"""
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    variant = dict(config['base_versions'][base_version])
+    variant.update({
+        'apk_path': apk_path,
+        'variant_of': base_version,
+        'locales': sorted(locales),
+        'densities': sorted(densities),
+    })
+    if prefer:
+        # Only one preferred variant per base version
+        for other in config['base_versions'].values():
+            if other.get('variant_of') == base_version:
+                other.pop('preferred', None)
+        variant['preferred'] = True
+    config['base_versions'][name] = variant
+
+    tmp_path = f'{config_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(config, f, indent=2)
+        f.write('\n')
+    os.replace(tmp_path, config_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build a slim variant of a base template')
+    parser.add_argument('base_version', help='Base version to slim, e.g. base_1')
+    parser.add_argument('--name', help='Variant name (default: <base_version>_slim)')
+    parser.add_argument('--locales', default='en',
+                        help='Comma-separated locales to keep, e.g. en,es,pt-rBR')
+    parser.add_argument('--densities', default='xhdpi,xxhdpi,xxxhdpi',
+                        help='Comma-separated densities to keep')
+    parser.add_argument('--keep-unreferenced', action='store_true',
+                        help='Only drop locales/densities, keep unreferenced resources')
+    parser.add_argument('--prefer', action='store_true',
+                        help='Use this variant instead of the base version for new builds')
+    args = parser.parse_args(argv)
+
+    with open(CONFIG_PATH, 'r') as f:
+        config = json.load(f)
+    base_config = config['base_versions'][args.base_version]
+    name = args.name or f'{args.base_version}_slim'
+    locales = [value.strip() for value in args.locales.split(',') if value.strip()]
+    densities = [value.strip() for value in args.densities.split(',') if value.strip()]
+    apk_path = str(Path(base_config['apk_path']).with_name(f'{name}.apk'))
+
+    work_dir = Path(tempfile.mkdtemp(prefix='apk_slim_'))
+    try:
+        decompiled = work_dir / 'decompiled'
+        result = run_apktool(['d', base_config['apk_path'], '-o', str(decompiled), '-f'])
+        if result.returncode != 0:
+            raise SystemExit(f"Decompile failed: {result.stderr}")
+
+        stats = TemplateSlimmer(decompiled, locales, densities).slim(prune=not args.keep_unreferenced)
+        print(f"Removed {stats['removed_files']} files ({stats['removed_bytes'] / 1024:.0f} KB)")
+
+        result = run_apktool(['b', str(decompiled), '-o', apk_path])
+        if result.returncode != 0:
+            raise SystemExit(f"Recompile failed: {result.stderr}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    register_variant(args.base_version, name, apk_path, locales, densities, args.prefer)
+    print(f"Registered {name} ({apk_path}, "
+          f"{os.path.getsize(apk_path) / 1024:.0f} KB) in {CONFIG_PATH}")
+
+
+if __name__ == '__main__':
+    main()
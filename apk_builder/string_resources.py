@@ -0,0 +1,179 @@
+"""
+App name resources
+A template defines app_name in res/values/strings.xml and, when it ships
+translations, overrides it in values-<locale>/ strings files. Searching
+every values directory for it on each build would read dozens of files, so
+the files that define app_name are indexed once per template (in the
+template cache, or in memory without it) and builds only open those.
+
+Each indexed file is streamed line by line into a temp file next to it and
+swapped in with os.replace only when its app_name changed; untouched files,
+including hard links into the template cache, are left alone. Files are
+rewritten in parallel.
+
+App names per locale use Android qualifiers or BCP 47 style keys:
+    {"fr": "Mon App", "pt-BR": "Meu App", "zh-rTW": "我的應用"}
+A strings file gets the name for its locale, then for its language, then
+the default app name. Locales the template has no translation for get a new
+res/values-<locale>/ file defining just app_name.
+"""
+import os
+import re
+import json
+import uuid
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape
+
+from apk_builder.slim_template import parse_qualifiers
+
+APP_NAME_OPEN = '<string name="app_name"'
+APP_NAME_RE = re.compile(r'(<string name="app_name"[^>]*>)(.*?)(</string>)', re.DOTALL)
+LOCALE_RE = re.compile(r'^([a-z]{2,3})(?:[-_]r?([a-z]{2}))?$', re.IGNORECASE)
+
+# Parallel rewrites are I/O bound; a template has at most a few dozen files
+MAX_WORKERS = 8
+
+
+def normalize_locale(locale):
+    """'pt-BR', 'pt_BR' or 'pt-rBR' -> 'pt-rBR' (raises ValueError otherwise)"""
+    match = LOCALE_RE.match(locale.strip()) if isinstance(locale, str) else None
+    if not match:
+        raise ValueError(f'invalid locale {locale!r} (expected e.g. "fr" or "pt-BR")')
+    language, region = match.groups()
+    return f'{language.lower()}-r{region.upper()}' if region else language.lower()
+
+
+def parse_app_names(raw):
+    """
+    Parse a JSON object of locale -> app name
+
+    Returns:
+        {normalized locale: name}; empty for an empty string
+
+    Raises ValueError if it isn't such an object.
+    """
+    if not raw:
+        return {}
+    app_names = json.loads(raw)
+    if not isinstance(app_names, dict):
+        raise ValueError('expected a JSON object mapping locales to app names')
+    normalized = {}
+    for locale, name in app_names.items():
+        if not isinstance(name, str) or not name.strip():
+            raise ValueError(f'app name for {locale!r} must be a non-empty string')
+        normalized[normalize_locale(locale)] = name.strip()
+    return normalized
+
+
+def escape_string_resource(value):
+    """Escape text for the body of an Android <string> resource"""
+    value = value.replace('\\', '\\\\').replace('"', '\\"').replace("'", "\\'").replace('\n', '\\n')
+    value = escape(value)
+    # A leading @ or ? would make it a resource reference
+    return '\\' + value if value.startswith(('@', '?')) else value
+
+
+def index_app_name_files(decompiled_dir):
+    """Paths (relative to decompiled_dir) of values*/ XML files that define app_name"""
+    decompiled_dir = Path(decompiled_dir)
+    found = []
+    for values_dir in sorted((decompiled_dir / 'res').glob('values*')):
+        if not values_dir.is_dir():
+            continue
+        for path in sorted(values_dir.glob('*.xml')):
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                if any(APP_NAME_OPEN in line for line in f):
+                    found.append(path.relative_to(decompiled_dir).as_posix())
+    return found
+
+
+def name_for(relative_path, app_name, localized_names):
+    """App name for one strings file: its locale's, its language's, or the default"""
+    _, locale, _, _ = parse_qualifiers(Path(relative_path).parent.name)
+    if locale:
+        for candidate in (locale, locale.split('-')[0]):
+            if candidate in localized_names:
+                return localized_names[candidate]
+    return app_name
+
+
+def _rewrite(path, value):
+    """Stream path into a temp file with app_name set to value; True if it changed"""
+    tmp = path.with_name(f'{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    changed = False
+    try:
+        with open(path, 'r', encoding='utf-8', newline='') as src, \
+                open(tmp, 'w', encoding='utf-8', newline='') as dst:
+            pending = None
+            for line in src:
+                if pending is None and APP_NAME_OPEN not in line:
+                    dst.write(line)
+                    continue
+                # Collect the element if it spans several lines
+                pending = (pending or '') + line
+                if '</string>' not in pending[pending.index(APP_NAME_OPEN):]:
+                    continue
+                rewritten = APP_NAME_RE.sub(lambda m: m.group(1) + value + m.group(3), pending)
+                changed = changed or rewritten != pending
+                dst.write(rewritten)
+                pending = None
+            if pending is not None:
+                dst.write(pending)
+        if changed:
+            os.replace(tmp, path)
+        return changed
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _add_locale(decompiled_dir, locale, value):
+    """Define app_name for a locale the template doesn't translate; returns the new file"""
+    values_dir = decompiled_dir / 'res' / f'values-{locale}'
+    values_dir.mkdir(parents=True, exist_ok=True)
+    # Never overwrite a resource file the directory already has
+    path = values_dir / 'strings.xml'
+    suffix = 0
+    while path.exists():
+        suffix += 1
+        path = values_dir / f"app_name{'_%d' % suffix if suffix > 1 else ''}.xml"
+    tmp = path.with_name(f'{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<resources>\n'
+                f'    <string name="app_name">{value}</string>\n</resources>\n')
+    os.replace(tmp, path)
+    return path
+
+
+def set_app_names(decompiled_dir, files, app_name, localized_names=None):
+    """
+    Set app_name in the indexed strings files, adding files for locales the
+    template has no translation for
+
+    Args:
+        decompiled_dir: The build's decompiled tree
+        files: Indexed paths relative to decompiled_dir (index_app_name_files)
+        app_name: Default app name
+        localized_names: Optional {normalized locale: app name}
+
+    Returns:
+        Paths of the files that changed or were added
+    """
+    decompiled_dir = Path(decompiled_dir)
+    localized_names = localized_names or {}
+    edits = [(decompiled_dir / relative,
+              escape_string_resource(name_for(relative, app_name, localized_names)))
+             for relative in files]
+    if len(edits) <= 1:
+        changed = [_rewrite(*edit) for edit in edits]
+    else:
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(edits))) as pool:
+            changed = list(pool.map(lambda edit: _rewrite(*edit), edits))
+    changed_paths = [path for (path, _), was_changed in zip(edits, changed) if was_changed]
+
+    translated = {Path(relative).parent.name for relative in files}
+    for locale, name in sorted(localized_names.items()):
+        if f'values-{locale}' not in translated:
+            changed_paths.append(_add_locale(decompiled_dir, locale, escape_string_resource(name)))
+    return changed_paths
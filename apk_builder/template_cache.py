@@ -0,0 +1,244 @@
+"""
+Template Build Cache
+Every build of a template used to decompile the same base APK and re-smali
+the same untouched dex files. The cache keeps one decompiled copy of each
+template (keyed by the APK's content hash) together with the apktool build/
+intermediates of smali folders that builds never edit.
+
+A build checks out a private copy whose untouched files are hard links to
+the cache and keep their original timestamps; files a build edits (or apktool
+may rewrite) are always copied, so no build can change the cached template.
+Because timestamps are kept, so `apktool b` sees the cached classesN.dex files as up to date
+and only re-smalis the folder holding the edited MainActivity. Resources are
+still compiled and linked by aapt as usual.
+
+Next to each template the cache keeps an index of the resource files that
+define app_name (see string_resources), so builds don't search for them.
+"""
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+from apk_builder.tool_daemon import run_apktool
+from apk_builder.string_resources import index_app_name_files
+
+# apktool writes its intermediates here, relative to the decompiled dir
+BUILD_DIRNAME = 'build'
+APP_NAME_INDEX = 'app_name_index.json'
+
+# Files builds edit or apktool may rewrite; checked out as copies, never links
+EDITABLE_TOP_LEVEL = ('AndroidManifest.xml', 'apktool.yml')
+EDITABLE_NAMES = ('MainActivity.smali', 'ic_launcher.png', 'strings.xml')
+
+
+def dex_source_folder(dex_name):
+    """Smali folder a dex is built from: classes.dex -> smali, classes3.dex -> smali_classes3"""
+    stem = dex_name[:-len('.dex')]
+    return 'smali' if stem == 'classes' else f'smali_{stem}'
+
+
+def _link_or_copy(src, dst):
+    """Hard link an unchanged template file, copying when links aren't possible"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def is_editable(relative_path, app_name_files=()):
+    """Whether a build may write to this template file (relative to the decompiled tree)"""
+    parts = Path(relative_path).parts
+    if len(parts) == 1 and parts[0] in EDITABLE_TOP_LEVEL:
+        return True
+    return parts[-1] in EDITABLE_NAMES or Path(relative_path).as_posix() in app_name_files
+
+
+class TemplateCache:
+    def __init__(self, root='apk_builder/cache'):
+        self.root = Path(root)
+        self._lock = threading.Lock()
+        self._hashes = {}
+
+    def _template_hash(self, apk_path) -> str:
+        """Content hash of a template APK, memoized on size and mtime"""
+        stat = os.stat(apk_path)
+        memo_key = (os.path.abspath(apk_path), stat.st_size, stat.st_mtime_ns)
+        digest = self._hashes.get(memo_key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(apk_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    sha.update(chunk)
+            digest = self._hashes[memo_key] = sha.hexdigest()
+        return digest
+
+    def template_dir(self, base_version, apk_path) -> Path:
+        return self.root / f'{base_version}-{self._template_hash(apk_path)[:16]}'
+
+    @contextmanager
+    def _locked(self, template_dir):
+        """Serialize cache writers across threads and processes"""
+        template_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            with open(template_dir / '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def ensure_template(self, base_version, apk_path) -> Path:
+        """
+        Decompile a template once and keep the result
+
+        Returns:
+            Path to the cached decompiled tree
+        """
+        template_dir = self.template_dir(base_version, apk_path)
+        decompiled = template_dir / 'decompiled'
+        if decompiled.exists():
+            return decompiled
+
+        with self._locked(template_dir):
+            if decompiled.exists():
+                return decompiled
+            print(f"Caching decompiled template {base_version} in {template_dir}")
+            tmp = template_dir / f'decompiled.{uuid.uuid4().hex[:8]}.tmp'
+            try:
+                result = run_apktool(['d', str(apk_path), '-o', str(tmp), '-f'])
+                if result.returncode != 0:
+                    raise Exception(f"Decompile failed: {result.stderr}")
+                os.replace(tmp, decompiled)
+            finally:
+                shutil.rmtree(tmp, ignore_errors=True)
+        return decompiled
+
+    def app_name_files(self, base_version, apk_path):
+        """
+        Resource files of a template that define app_name, indexed on first use
+
+        Returns:
+            Paths relative to the decompiled tree
+        """
+        decompiled = self.ensure_template(base_version, apk_path)
+        index_path = decompiled.parent / APP_NAME_INDEX
+        try:
+            with open(index_path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        files = index_app_name_files(decompiled)
+        tmp = index_path.with_name(f'{APP_NAME_INDEX}.{uuid.uuid4().hex[:8]}.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(files, f)
+        os.replace(tmp, index_path)
+        return files
+
+    def checkout(self, base_version, apk_path, dest):
+        """
+        Materialize a private, writable copy of the decompiled template
+
+        Files a build may edit (see is_editable, plus the indexed app_name
+        resource files) are copied; everything else is hard linked where
+        possible. The cached build/ directory is always copied because
+        apktool writes into it.
+        """
+        decompiled = self.ensure_template(base_version, apk_path)
+        editable = set(self.app_name_files(base_version, apk_path))
+
+        def skip_build_dir(directory, names):
+            # Only the top-level build/ holds apktool intermediates
+            return [BUILD_DIRNAME] if Path(directory) == decompiled else []
+
+        def copy_file(src, dst):
+            if is_editable(os.path.relpath(src, decompiled), editable):
+                return shutil.copy2(src, dst)
+            return _link_or_copy(src, dst)
+
+        shutil.copytree(decompiled, dest, copy_function=copy_file, ignore=skip_build_dir)
+        cached_build = decompiled / BUILD_DIRNAME
+        if cached_build.exists():
+            shutil.copytree(cached_build, Path(dest) / BUILD_DIRNAME)
+
+    def warm(self, base_version, apk_path):
+        """
+        Decompile and index a template and build its dex intermediates before the first build
+
+        Returns:
+            True if intermediates were built, False if they were already cached
+        """
+        decompiled = self.ensure_template(base_version, apk_path)
+        self.app_name_files(base_version, apk_path)
+        if (decompiled / BUILD_DIRNAME / 'apk').exists():
+            return False
+
+        work_dir = Path(tempfile.mkdtemp(prefix='apk_warm_'))
+        try:
+            checkout = work_dir / 'decompiled'
+            self.checkout(base_version, apk_path, checkout)
+            result = run_apktool(['b', str(checkout), '-o', str(work_dir / 'warm.apk')])
+            if result.returncode != 0:
+                raise Exception(f"Recompile failed: {result.stderr}")
+            self.store_intermediates(base_version, apk_path, checkout, set())
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        return True
+
+    def store_intermediates(self, base_version, apk_path, decompiled_dir, modified_files):
+        """
+        Keep dex files built from smali folders this build didn't touch
+
+        Args:
+            decompiled_dir: the build's decompiled tree, after `apktool b`
+            modified_files: paths the build edited inside decompiled_dir
+        """
+        build_apk_dir = Path(decompiled_dir) / BUILD_DIRNAME / 'apk'
+        if not build_apk_dir.exists():
+            return
+
+        touched = {Path(path).relative_to(decompiled_dir).parts[0] for path in modified_files}
+        cached_apk_dir = self.ensure_template(base_version, apk_path) / BUILD_DIRNAME / 'apk'
+
+        for dex in build_apk_dir.glob('*.dex'):
+            if dex_source_folder(dex.name) in touched or (cached_apk_dir / dex.name).exists():
+                continue
+            cached_apk_dir.mkdir(parents=True, exist_ok=True)
+            tmp = cached_apk_dir / f'{dex.name}.{uuid.uuid4().hex[:8]}.tmp'
+            try:
+                # copy2 keeps the dex newer than its smali sources
+                shutil.copy2(dex, tmp)
+                os.replace(tmp, cached_apk_dir / dex.name)
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_template_cache():
+    """Process-wide cache, or None when APK_TEMPLATE_CACHE is disabled"""
+    global _cache
+    if os.environ.get('APK_TEMPLATE_CACHE', '1').lower() in ('0', 'false', 'no'):
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = TemplateCache(os.environ.get('APK_TEMPLATE_CACHE_DIR', 'apk_builder/cache'))
+        return _cache
@@ -0,0 +1,231 @@
+"""
+Persistent apktool daemon
+Every `apktool d` / `apktool b` normally pays for a fresh JVM (startup, class
+loading, JIT warm-up). With APKTOOL_DAEMON=1 the builder sends apktool
+commands over a loopback socket to long-lived JVMs (daemon/ApktoolDaemon.java)
+that keep apktool loaded and warm. Daemons are restarted if they die, recycled
+after a number of requests to keep memory in check, and any failure to reach
+one falls back to a plain subprocess call.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from common.tracing import tracer
+
+DAEMON_SOURCE = Path(__file__).parent / 'daemon' / 'ApktoolDaemon.java'
+
+
+class DaemonUnavailable(Exception):
+    """The daemon could not run the request; the caller should fall back"""
+
+
+def find_apktool_jar():
+    """apktool.jar from APKTOOL_JAR, or next to the apktool wrapper script on PATH"""
+    jar = os.environ.get('APKTOOL_JAR')
+    if jar:
+        return jar if os.path.exists(jar) else None
+    wrapper = shutil.which('apktool')
+    if wrapper:
+        candidate = Path(wrapper).resolve().parent / 'apktool.jar'
+        if candidate.exists():
+            return str(candidate)
+    return None
+
+
+class ApktoolDaemon:
+    def __init__(self, jar_path, recycle_after=50, start_timeout=120):
+        self.jar_path = jar_path
+        self.recycle_after = recycle_after
+        self.start_timeout = start_timeout
+        self.process = None
+        self.port = None
+        self.requests = 0
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """Launch the JVM and wait for it to report its port"""
+        java_opts = os.environ.get('APKTOOL_DAEMON_JAVA_OPTS', '-Xmx1g').split()
+        # The daemon traps apktool's System.exit calls with a security manager
+        cmd = ['java', '-Djava.security.manager=allow'] + java_opts + \
+            ['-cp', self.jar_path, str(DAEMON_SOURCE)]
+        self.process = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True)
+        self.requests = 0
+
+        ready = {}
+        reader = threading.Thread(
+            target=lambda: ready.setdefault('line', self.process.stdout.readline()),
+            daemon=True)
+        reader.start()
+        reader.join(self.start_timeout)
+        line = ready.get('line', '')
+        if not line.startswith('READY '):
+            self.stop()
+            raise DaemonUnavailable(f'apktool daemon failed to start: {line.strip()!r}')
+        self.port = int(line.split()[1])
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+        self.port = None
+
+    def run(self, args):
+        """
+        Run one apktool command in the daemon
+
+        Returns:
+            CompletedProcess with returncode, stdout and stderr
+        """
+        if self.requests >= self.recycle_after:
+            self.stop()
+        if not self.alive():
+            self.start()
+
+        payload = f'{len(args)}\n' + ''.join(f'{arg}\n' for arg in args)
+        try:
+            with socket.create_connection(('127.0.0.1', self.port)) as conn:
+                conn.sendall(payload.encode('utf-8'))
+                reader = conn.makefile('rb')
+                header = reader.readline().decode('utf-8').split()
+                if len(header) != 3:
+                    raise DaemonUnavailable('apktool daemon closed the connection')
+                code, out_len, err_len = (int(value) for value in header)
+                stdout = reader.read(out_len).decode('utf-8', errors='replace')
+                stderr = reader.read(err_len).decode('utf-8', errors='replace')
+        except OSError as e:
+            raise DaemonUnavailable(f'apktool daemon unreachable: {e}')
+        finally:
+            self.requests += 1
+
+        return subprocess.CompletedProcess(['apktool'] + list(args), code, stdout, stderr)
+
+
+class ApktoolDaemonPool:
+    """A few supervised daemons; a build that finds none free uses a subprocess"""
+
+    def __init__(self, size=1, recycle_after=50, retry_delay=300):
+        self.size = max(1, size)
+        self.recycle_after = recycle_after
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._idle = []
+        self._created = 0
+        self._disabled_until = 0.0
+
+    def _acquire(self):
+        with self._lock:
+            if time.time() < self._disabled_until:
+                return None
+            if self._idle:
+                return self._idle.pop()
+            if self._created < self.size:
+                jar = find_apktool_jar()
+                if not jar:
+                    self._disabled_until = time.time() + self.retry_delay
+                    return None
+                self._created += 1
+                return ApktoolDaemon(jar, recycle_after=self.recycle_after)
+            return None
+
+    def _release(self, daemon, healthy):
+        with self._lock:
+            if healthy:
+                self._idle.append(daemon)
+            else:
+                daemon.stop()
+                self._created -= 1
+
+    def run(self, args):
+        daemon = self._acquire()
+        if daemon is None:
+            raise DaemonUnavailable('no apktool daemon available')
+        try:
+            result = daemon.run(args)
+        except DaemonUnavailable:
+            self._release(daemon, healthy=False)
+            with self._lock:
+                # Don't retry a broken setup on every build
+                if not daemon.requests:
+                    self._disabled_until = time.time() + self.retry_delay
+            raise
+        self._release(daemon, healthy=daemon.alive())
+        return result
+
+    def warm(self):
+        """Start every daemon now rather than on the first builds; returns how many run"""
+        daemons = []
+        try:
+            while True:
+                daemon = self._acquire()
+                if daemon is None:
+                    break
+                daemons.append(daemon)
+                if not daemon.alive():
+                    daemon.start()
+        except DaemonUnavailable:
+            self._release(daemons.pop(), healthy=False)
+            raise
+        finally:
+            for daemon in daemons:
+                self._release(daemon, healthy=daemon.alive())
+        return len(daemons)
+
+    def shutdown(self):
+        with self._lock:
+            for daemon in self._idle:
+                daemon.stop()
+            self._idle = []
+            self._created = 0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_daemon_pool():
+    """Process-wide pool, or None when APKTOOL_DAEMON is not enabled"""
+    global _pool
+    if os.environ.get('APKTOOL_DAEMON', '').lower() not in ('1', 'true', 'yes'):
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ApktoolDaemonPool(
+                size=int(os.environ.get('APKTOOL_DAEMONS', '1')),
+                recycle_after=int(os.environ.get('APKTOOL_DAEMON_RECYCLE_AFTER', '50'))
+            )
+        return _pool
+
+
+def run_apktool(args):
+    """
+    Run an apktool command, through a warm daemon when enabled and available
+
+    Args:
+        args: apktool arguments, e.g. ['d', 'base.apk', '-o', 'out', '-f']
+
+    Returns:
+        CompletedProcess with returncode, stdout and stderr
+    """
+    with tracer.span('subprocess.apktool', command=args[0] if args else '') as span:
+        pool = get_daemon_pool()
+        if pool is not None:
+            try:
+                result = pool.run(args)
+                span.set_attribute('via', 'daemon')
+                span.set_attribute('returncode', result.returncode)
+                return result
+            except DaemonUnavailable as e:
+                print(f"apktool daemon unavailable, using subprocess: {e}")
+        result = subprocess.run(['apktool'] + list(args), capture_output=True, text=True)
+        span.set_attribute('via', 'subprocess')
+        span.set_attribute('returncode', result.returncode)
+        return result
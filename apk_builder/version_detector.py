@@ -32,6 +32,10 @@ class VersionDetector:
         
         # Try exact match first
         for version_name, version_config in base_versions.items():
+            # Slim variants are chosen through their base version
+            if version_config.get('variant_of'):
+                continue
+
             version_customizations = set(version_config['customizations'])
             provided_set = set(provided_customizations)
             
@@ -42,10 +46,18 @@ class VersionDetector:
             
             # Check if provided customizations match this version
             if provided_set.issubset(version_customizations):
-                return version_name
+                return self.preferred_variant(version_name)
         
         # If no exact match, return base_1 as default
-        return 'base_1'
+        return self.preferred_variant('base_1')
+    
+    def preferred_variant(self, version_name):
+        """The slim variant marked preferred for a base version, if its APK exists"""
+        for variant_name, variant_config in self.config['base_versions'].items():
+            if variant_config.get('variant_of') == version_name and variant_config.get('preferred') \
+                    and os.path.exists(variant_config['apk_path']):
+                return variant_name
+        return version_name
     
     def get_base_config(self, version_name):
         """Get configuration for a specific base version"""
@@ -0,0 +1,136 @@
+"""
+Build Workspaces
+Decompiling and recompiling churns through ~90 MB and ~8,000 small files per
+build. With BUILD_RAM_WORKSPACE set to a tmpfs mount (e.g. /dev/shm), builds
+get their work_dir there while a memory budget allows it; any build that
+doesn't fit (budget spent or tmpfs nearly full) uses a disk temp dir as
+before. The kind of workspace is recorded with each job's stage timings so
+the two modes can be compared.
+
+Reservations live in a small SQLite file on the tmpfs itself, so every
+process (gunicorn workers, build workers) sharing the mount draws from one
+budget. Reservations of processes that died, or whose work_dir is gone, are
+dropped on the next allocation.
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from contextlib import closing
+from pathlib import Path
+
+RAM = 'ram'
+DISK = 'disk'
+
+RESERVATIONS_FILE = '.apk_build_reservations.sqlite3'
+
+
+def _pid_alive(pid) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkspaceBudget:
+    def __init__(self, root=None, budget_mb=None, reserve_mb=None):
+        self.root = root if root is not None else os.environ.get('BUILD_RAM_WORKSPACE', '')
+        # Total RAM all processes sharing the tmpfs may hold in build workspaces
+        self.budget = int(budget_mb if budget_mb is not None else
+                          os.environ.get('BUILD_RAM_BUDGET_MB', '512')) * 1024 * 1024
+        # What one build is assumed to need (decompiled tree + build/ + APKs)
+        self.reserve = int(reserve_mb if reserve_mb is not None else
+                           os.environ.get('BUILD_RAM_WORKSPACE_MB', '256')) * 1024 * 1024
+
+    def enabled(self) -> bool:
+        return bool(self.root) and os.path.isdir(self.root)
+
+    def _connect(self):
+        conn = sqlite3.connect(os.path.join(self.root, RESERVATIONS_FILE), timeout=30,
+                               isolation_level=None)
+        conn.execute('CREATE TABLE IF NOT EXISTS reservations ('
+                     ' work_dir TEXT PRIMARY KEY,'
+                     ' pid INTEGER NOT NULL,'
+                     ' bytes INTEGER NOT NULL)')
+        return conn
+
+    def _prune(self, conn):
+        """Drop reservations whose process died or whose work_dir was removed"""
+        rows = conn.execute('SELECT work_dir, pid FROM reservations').fetchall()
+        conn.executemany('DELETE FROM reservations WHERE work_dir = ?',
+                         [(work_dir,) for work_dir, pid in rows
+                          if not _pid_alive(pid) or not os.path.isdir(work_dir)])
+
+    def _try_allocate(self):
+        """A RAM work_dir with its reservation recorded, or None if it doesn't fit"""
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._prune(conn)
+                in_use = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM reservations').fetchone()[0]
+                # The tmpfs may also hold files that aren't builds; don't fill it up
+                if in_use + self.reserve > self.budget or \
+                        shutil.disk_usage(self.root).free < self.reserve:
+                    conn.execute('ROLLBACK')
+                    return None
+                work_dir = tempfile.mkdtemp(prefix='apk_build_', dir=self.root)
+                conn.execute('INSERT INTO reservations VALUES (?, ?, ?)',
+                             (work_dir, os.getpid(), self.reserve))
+                conn.execute('COMMIT')
+                return Path(work_dir)
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+
+    def allocate(self):
+        """
+        Create a work directory, in RAM when the budget allows
+
+        Returns:
+            (Path, kind) where kind is 'ram' or 'disk'
+        """
+        if self.enabled():
+            try:
+                work_dir = self._try_allocate()
+                if work_dir is not None:
+                    return work_dir, RAM
+            except (OSError, sqlite3.Error) as e:
+                print(f"RAM workspace unavailable, using disk: {e}")
+        return Path(tempfile.mkdtemp(prefix='apk_build_')), DISK
+
+    def release(self, kind, work_dir):
+        """Return a RAM workspace's share of the budget"""
+        if kind != RAM:
+            return
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute('DELETE FROM reservations WHERE work_dir = ?', (str(work_dir),))
+        except sqlite3.Error as e:
+            # The next allocation prunes it once work_dir is gone
+            print(f"Could not release RAM workspace reservation: {e}")
+
+    def stats(self):
+        reserved = 0
+        if self.enabled():
+            with closing(self._connect()) as conn:
+                reserved = conn.execute('SELECT COALESCE(SUM(bytes), 0) FROM reservations').fetchone()[0]
+        return {'root': self.root or None, 'budget_bytes': self.budget,
+                'reserved_bytes': reserved}
+
+
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def get_workspace_budget():
+    """Process-wide workspace budget (disk-only unless BUILD_RAM_WORKSPACE is set)"""
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = WorkspaceBudget()
+        return _budget
@@ -0,0 +1,207 @@
+"""
+APK alignment
+A streaming zipalign equivalent. Entries are rewritten in one pass with a
+per-extension compression policy: resources.arsc, images and native
+libraries are stored (Android maps them directly and they don't compress
+further), everything else is deflated. Stored entries are aligned to 4
+bytes, native libraries to the 4 KiB page size, using the same alignment
+extra field as Android's zipalign. Entries whose compression doesn't change
+are copied as raw bytes without being inflated.
+
+The output is canonical: entries are sorted by name and carry a fixed
+timestamp (SOURCE_DATE_EPOCH, or 2008-01-01) and fixed attributes, so the
+same input entries always produce the same bytes.
+"""
+import os
+import time
+import struct
+import zipfile
+import zlib
+
+# Extensions kept uncompressed in the output APK
+STORED_EXTENSIONS = (
+    '.arsc', '.so',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp',
+    '.mp3', '.ogg', '.m4a', '.mp4', '.webm', '.wav',
+    '.zip', '.gz', '.jar', '.apk'
+)
+
+ALIGNMENT = 4
+PAGE_ALIGNMENT = 4096
+DEFLATE_LEVEL = 6
+COPY_CHUNK = 1024 * 1024
+
+# Extra field Android's zipalign uses for padding: id, size, alignment, zeros
+ALIGNMENT_EXTRA_ID = 0xD935
+
+# 2008-01-01 00:00:00, the timestamp Android's own reproducible builds use
+DEFAULT_DATE_TIME = (2008, 1, 1, 0, 0, 0)
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_OF_CENTRAL_DIR = struct.Struct('<IHHHHIIH')
+
+
+def compression_for(name) -> int:
+    """ZIP_STORED or ZIP_DEFLATED for an entry, by extension"""
+    if name.endswith('/') or name.lower().endswith(STORED_EXTENSIONS):
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+
+def alignment_for(name) -> int:
+    return PAGE_ALIGNMENT if name.endswith('.so') else ALIGNMENT
+
+
+def fixed_date_time():
+    """Entry timestamp for canonical archives"""
+    epoch = os.environ.get('SOURCE_DATE_EPOCH')
+    if epoch:
+        # ZIP timestamps can't go below 1980
+        return max(time.gmtime(int(epoch))[:6], (1980, 1, 1, 0, 0, 0))
+    return DEFAULT_DATE_TIME
+
+
+def _dos_date_time(date_time):
+    dos_time = date_time[3] << 11 | date_time[4] << 5 | date_time[5] // 2
+    dos_date = (date_time[0] - 1980) << 9 | date_time[1] << 5 | date_time[2]
+    return dos_time, dos_date
+
+
+def _alignment_extra(data_offset_without_extra, alignment) -> bytes:
+    """Smallest alignment extra field that puts the entry's data on a boundary"""
+    padding = (-(data_offset_without_extra + 6)) % alignment
+    return struct.pack('<HHH', ALIGNMENT_EXTRA_ID, 2 + padding, alignment) + b'\0' * padding
+
+
+def _raw_data_offset(src_file, info) -> int:
+    """Offset of an entry's (compressed) data in the source archive"""
+    src_file.seek(info.header_offset)
+    header = LOCAL_HEADER.unpack(src_file.read(LOCAL_HEADER.size))
+    name_len, extra_len = header[9], header[10]
+    return info.header_offset + LOCAL_HEADER.size + name_len + extra_len
+
+
+def iter_raw(src_file, info):
+    """Yield an entry's data exactly as stored (still compressed if deflated)"""
+    src_file.seek(_raw_data_offset(src_file, info))
+    remaining = info.compress_size
+    while remaining:
+        chunk = src_file.read(min(COPY_CHUNK, remaining))
+        if not chunk:
+            raise ValueError('Truncated ZIP entry')
+        remaining -= len(chunk)
+        yield chunk
+
+
+def read_raw(src_file, info) -> bytes:
+    return b''.join(iter_raw(src_file, info))
+
+
+class CanonicalZipWriter:
+    """
+    Writes entries in the canonical layout: caller-supplied order, fixed
+    timestamp and attributes, no data descriptors, stored entries aligned
+    """
+
+    def __init__(self, out):
+        self.out = out
+        self.central = []
+        self.dos_time, self.dos_date = _dos_date_time(fixed_date_time())
+
+    def write_entry(self, name, method, crc, file_size, chunks, compressed_size=None):
+        """
+        Write one entry from already encoded data chunks
+
+        Args:
+            compressed_size: size of the data if known up front; otherwise the
+                local header is patched once the data is written
+        """
+        out = self.out
+        encoded_name = name.encode('utf-8')
+        flags = 0 if name.isascii() else 0x800
+
+        header_offset = out.tell()
+        extra = b''
+        if method == zipfile.ZIP_STORED:
+            extra = _alignment_extra(header_offset + LOCAL_HEADER.size + len(encoded_name),
+                                     alignment_for(name))
+
+        out.write(LOCAL_HEADER.pack(0x04034B50, 20, flags, method, self.dos_time, self.dos_date,
+                                    crc, compressed_size or 0, file_size,
+                                    len(encoded_name), len(extra)))
+        out.write(encoded_name)
+        out.write(extra)
+
+        data_start = out.tell()
+        for chunk in chunks:
+            out.write(chunk)
+        written = out.tell() - data_start
+        if compressed_size is None:
+            out.seek(header_offset + 18)
+            out.write(struct.pack('<I', written))
+            out.seek(0, os.SEEK_END)
+        elif written != compressed_size:
+            raise ValueError(f'Entry {name} has {written} bytes, expected {compressed_size}')
+
+        self.central.append(CENTRAL_HEADER.pack(
+            0x02014B50, 20, 20, flags, method, self.dos_time, self.dos_date,
+            crc, written, file_size, len(encoded_name), 0, 0, 0, 0,
+            0, header_offset) + encoded_name)
+
+        if out.tell() > 0xFFFFFFFF:
+            raise ValueError('APK too large to align (ZIP64 is not supported)')
+
+    def close(self):
+        """Write the central directory"""
+        central_offset = self.out.tell()
+        for record in self.central:
+            self.out.write(record)
+        self.out.write(END_OF_CENTRAL_DIR.pack(0x06054B50, 0, 0, len(self.central), len(self.central),
+                                               self.out.tell() - central_offset, central_offset, 0))
+
+
+def _deflate(entry):
+    compressor = zlib.compressobj(DEFLATE_LEVEL, zlib.DEFLATED, -15)
+    for chunk in iter(lambda: entry.read(COPY_CHUNK), b''):
+        yield compressor.compress(chunk)
+    yield compressor.flush()
+
+
+def align_apk(src_path, dest_path):
+    """
+    Rewrite an APK canonically, with the store/deflate policy and aligned stored entries
+
+    Args:
+        src_path: input APK (e.g. jarsigner's output)
+        dest_path: where to write the aligned APK
+
+    Returns:
+        dict with 'stored', 'deflated' and 'recompressed' entry counts
+    """
+    stats = {'stored': 0, 'deflated': 0, 'recompressed': 0}
+
+    with zipfile.ZipFile(src_path) as archive, open(src_path, 'rb') as src_file, \
+            open(dest_path, 'wb') as out:
+        writer = CanonicalZipWriter(out)
+        for info in sorted(archive.infolist(), key=lambda entry: entry.filename):
+            method = compression_for(info.filename)
+
+            if method == info.compress_type:
+                writer.write_entry(info.filename, method, info.CRC, info.file_size,
+                                   iter_raw(src_file, info), info.compress_size)
+            else:
+                with archive.open(info) as entry:
+                    if method == zipfile.ZIP_STORED:
+                        chunks = iter(lambda: entry.read(COPY_CHUNK), b'')
+                        writer.write_entry(info.filename, method, info.CRC, info.file_size,
+                                           chunks, info.file_size)
+                    else:
+                        writer.write_entry(info.filename, method, info.CRC, info.file_size,
+                                           _deflate(entry))
+                stats['recompressed'] += 1
+
+            stats['stored' if method == zipfile.ZIP_STORED else 'deflated'] += 1
+        writer.close()
+
+    return stats
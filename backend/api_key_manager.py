@@ -2,23 +2,54 @@
 API Key Management System
 Handles generation, validation, and storage of API keys
 """
+import os
 import json
 import secrets
+import threading
 import hashlib
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 from typing import Optional, Dict, List
 
+try:
+    import fcntl
+except ImportError:  # Windows: thread lock only
+    fcntl = None
+
 class APIKeyManager:
     def __init__(self, db_path='db/api_keys.json'):
         self.db_path = Path(db_path)
+        # Request threads and every gunicorn worker (each its own process)
+        # read-modify-write the same file
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_file = None
         self._ensure_db_exists()
     
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the keys file across threads and processes"""
+        with self._lock:
+            self._lock_depth += 1
+            try:
+                if self._lock_depth == 1 and fcntl:
+                    if self._lock_file is None:
+                        self._lock_file = open(f'{self.db_path}.lock', 'a')
+                    fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                yield
+            finally:
+                if self._lock_depth == 1 and fcntl and self._lock_file:
+                    fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                self._lock_depth -= 1
+    
     def _ensure_db_exists(self):
         """Ensure the database file exists"""
         if not self.db_path.exists():
             self.db_path.parent.mkdir(parents=True, exist_ok=True)
-            self._save_data({'api_keys': []})
+            with self._locked():
+                if not self.db_path.exists():
+                    self._save_data({'api_keys': []})
     
     def _load_data(self) -> Dict:
         """Load API keys from file"""
@@ -29,9 +60,11 @@ class APIKeyManager:
             return {'api_keys': []}
     
     def _save_data(self, data: Dict):
-        """Save API keys to file"""
-        with open(self.db_path, 'w') as f:
+        """Save API keys to file atomically (readers never see a partial file)"""
+        tmp_path = self.db_path.with_name(f'{self.db_path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(tmp_path, 'w') as f:
             json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.db_path)
     
     def generate_api_key(self, name: str = "Unnamed API Key") -> Dict:
         """
@@ -60,13 +93,15 @@ class APIKeyManager:
             'created_at': datetime.now().isoformat(),
             'last_used': None,
             'request_count': 0,
-            'active': True
+            'active': True,
+            'priority_weight': 1.0
         }
         
         # Save to database
-        data = self._load_data()
-        data['api_keys'].append(api_key_record)
-        self._save_data(data)
+        with self._locked():
+            data = self._load_data()
+            data['api_keys'].append(api_key_record)
+            self._save_data(data)
         
         # Return the actual key (only time it's visible!)
         return {
@@ -93,15 +128,16 @@ class APIKeyManager:
         key_hash = hashlib.sha256(api_key.encode()).hexdigest()
         
         # Load and search for matching key
-        data = self._load_data()
-        for key_record in data['api_keys']:
-            if key_record['key_hash'] == key_hash and key_record['active']:
-                # Update last used time and request count
-                key_record['last_used'] = datetime.now().isoformat()
-                key_record['request_count'] += 1
-                self._save_data(data)
+        with self._locked():
+            data = self._load_data()
+            for key_record in data['api_keys']:
+                if key_record['key_hash'] == key_hash and key_record['active']:
+                    # Update last used time and request count
+                    key_record['last_used'] = datetime.now().isoformat()
+                    key_record['request_count'] += 1
+                    self._save_data(data)
                 
-                return key_record
+                    return key_record
         
         return None
     
@@ -119,21 +155,36 @@ class APIKeyManager:
     
     def revoke_api_key(self, key_id: str) -> bool:
         """Revoke an API key by key_id"""
-        data = self._load_data()
-        for key_record in data['api_keys']:
-            if key_record['key_id'] == key_id:
-                key_record['active'] = False
-                self._save_data(data)
-                return True
+        with self._locked():
+            data = self._load_data()
+            for key_record in data['api_keys']:
+                if key_record['key_id'] == key_id:
+                    key_record['active'] = False
+                    self._save_data(data)
+                    return True
+        return False
+    
+    def set_priority_weight(self, key_id: str, weight: float) -> bool:
+        """Set a key's share of build capacity under fair scheduling (default 1.0)"""
+        if not 0 < weight < float('inf'):
+            raise ValueError('Priority weight must be a positive number')
+        with self._locked():
+            data = self._load_data()
+            for key_record in data['api_keys']:
+                if key_record['key_id'] == key_id:
+                    key_record['priority_weight'] = float(weight)
+                    self._save_data(data)
+                    return True
         return False
     
     def delete_api_key(self, key_id: str) -> bool:
         """Permanently delete an API key by key_id"""
-        data = self._load_data()
-        original_count = len(data['api_keys'])
-        data['api_keys'] = [k for k in data['api_keys'] if k['key_id'] != key_id]
+        with self._locked():
+            data = self._load_data()
+            original_count = len(data['api_keys'])
+            data['api_keys'] = [k for k in data['api_keys'] if k['key_id'] != key_id]
         
-        if len(data['api_keys']) < original_count:
-            self._save_data(data)
-            return True
+            if len(data['api_keys']) < original_count:
+                self._save_data(data)
+                return True
         return False
@@ -1,28 +1,186 @@
 import os
 import sys
+import hmac
+import time
+import json
 import uuid
+import base64
 import shutil
-import threading
+from datetime import datetime
 from functools import wraps
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, Response, g, request, jsonify, send_file, send_from_directory
 from flask_cors import CORS
-from werkzeug.utils import secure_filename
-from backend.services.url_metadata import fetch_url_metadata
-from backend.services.android_generator import generate_android_project
-from backend.services.zipper import create_zip
+from backend.services.downloads import call_after_send, file_sha256, safe_download_name, send_artifact
+from backend.services.apk_delta import PATCH_MIMETYPE, PatchCache
 from backend.api_key_manager import APIKeyManager
-from backend.job_manager import JobManager
+from backend.job_manager import JOB_STATUSES, JobManager
+from backend.rate_limiter import RateLimiter
+from backend.storage_manager import StorageManager
+from backend.build_queue import BuildQueue, build_fingerprint, create_job_queue
+from backend.build_estimator import BuildEstimator
+from backend.artifact_store import create_artifact_store
+from common.tracing import trace_flask_app, tracer
+from backend.profiling import ProfileStore, start_stack_sampler
+from backend.lazy import ProcessLocal
+from backend.warmup import Warmup
+from backend.static_assets import StaticAssets
+from backend.webhooks import WebhookDispatcher, public_state, validate_callback_url
+from backend.worker import run_build_job
 
 from apk_builder.version_detector import VersionDetector
+from apk_builder.string_resources import parse_app_names
 
 app = Flask(__name__, static_folder='../frontend')
 CORS(app)
+# Span per request when TRACE_EXPORTER is set
+trace_flask_app(app)
+
+# Managers below are built on first use in each process (see backend/lazy.py),
+# so importing this module touches no files and starts no threads and
+# gunicorn --preload can fork workers from it safely
+api_key_manager = ProcessLocal(APIKeyManager)
+job_manager = ProcessLocal(lambda: JobManager(os.environ.get('JOB_DB_DIR', 'db')))
+
+# Per-key request rate and build quotas, persisted next to the API key records
+rate_limiter = ProcessLocal(RateLimiter)
+
+# Put GENERATED_DIR (and JOB_DB_DIR) on a shared volume to run build workers on other nodes
+GENERATED_DIR = os.environ.get('GENERATED_DIR', os.path.join(os.path.dirname(__file__), '..', 'generated'))
+
+def _create_artifact_store():
+    # Finished APKs are published here by whichever worker built them
+    os.makedirs(GENERATED_DIR, exist_ok=True)
+    return create_artifact_store(os.environ.get('ARTIFACT_STORE', GENERATED_DIR))
+
+artifact_store = ProcessLocal(_create_artifact_store)
+
+# Keeps generated/ under its byte budget from a low-priority background thread
+storage_manager = ProcessLocal(lambda: StorageManager(
+    artifact_store.root, job_manager(),
+    icon_dir=os.path.join(GENERATED_DIR, 'temp_icons'),
+    blob_store=artifact_store.blobs))
+
+# Deltas between successive builds of an app, generated in the background and
+# cached next to the APKs
+patch_cache = ProcessLocal(lambda: PatchCache(artifact_store(), job_manager()))
+
+# On-demand request/build profiles and the continuous stack sampler (PROFILE_SAMPLING_HZ)
+profile_store = ProcessLocal(ProfileStore)
+
+def run_local_build(job):
+    """Build queue handler for builds running inside the API process"""
+    run_build_job(job, job_manager(), artifact_store(), profile_store())
+
+# Durable queue: jobs survive restarts and interrupted builds are requeued.
+# BUILD_WORKERS=0 turns this into an API-only node fed by backend.worker processes.
+build_queue = ProcessLocal(lambda: BuildQueue(
+    create_job_queue(os.environ.get('BUILD_QUEUE', 'local'), job_manager()),
+    run_local_build
+))
+
+# Rolling build-duration model for ETAs and load shedding
+build_estimator = ProcessLocal(lambda: BuildEstimator(
+    job_manager(),
+    capacity=int(os.environ.get('BUILD_CAPACITY') or build_queue.workers or 1)
+))
+
+# Signed completion callbacks for builds submitted with a callback_url
+webhook_dispatcher = ProcessLocal(lambda: WebhookDispatcher(job_manager()))
+
+# Fingerprinted, precompressed frontend (built at image build time or on first use)
+static_assets = StaticAssets(app.static_folder)
+
+# Templates, apktool daemons, keystore and Pillow warmed in the background; see /readyz
+warmup = ProcessLocal(lambda: Warmup(job_manager(), build_queue.workers, static_assets=static_assets))
+
+def _start_background_services():
+    """Start this process's background threads; returns the stack sampler (or None)"""
+    warmup.start()
+    rate_limiter.start(job_manager())
+    storage_manager.start_reaper()
+    webhook_dispatcher.start()
+    patch_cache.start()
+    build_queue.start()
+    return start_stack_sampler(profile_store())
+
+# Started once per process: by the gunicorn post_worker_init hook
+# (gunicorn.conf.py), by __main__, or else by the first request
+background_services = ProcessLocal(_start_background_services)
+
+# Modules only some routes need, imported in the background by each gunicorn
+# worker once it is serving (gunicorn.conf.py) so their first use is warm
+HEAVY_MODULES = (
+    'backend.services.url_metadata',
+    'backend.services.android_generator',
+    'backend.services.zipper',
+    'apk_builder.builder',
+)
+
+def preload_heavy_modules():
+    import importlib
+    for module in HEAVY_MODULES:
+        importlib.import_module(module)
+
+@app.before_request
+def ensure_background_services():
+    # Liveness checks must stay cheap even on a process's first request
+    if request.path != '/healthz':
+        background_services()
+
+# Admin endpoints and profiling flags are off unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+def is_admin_request():
+    """True if the request carries the admin token (X-Admin-Token header)"""
+    token = request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def profiling_requested():
+    """Admin asked for a profile with X-Profile: 1 or ?profile=1"""
+    flag = request.headers.get('X-Profile') or request.args.get('profile')
+    return flag in ('1', 'true', 'yes') and is_admin_request()
+
+def require_admin(f):
+    """Decorator for admin-only endpoints (X-Admin-Token header)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not is_admin_request():
+            return jsonify({
+                'error': 'Admin token required',
+                'message': 'Provide the admin token via the X-Admin-Token header'
+            }), 403
+        return f(*args, **kwargs)
 
-api_key_manager = APIKeyManager()
-job_manager = JobManager()
+    return decorated_function
 
-GENERATED_DIR = os.path.join(os.path.dirname(__file__), '..', 'generated')
-os.makedirs(GENERATED_DIR, exist_ok=True)
+@app.before_request
+def start_request_profile():
+    if profiling_requested():
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError as e:
+            print(f"Request profiling skipped: {e}")
+            return
+        g.profiler = profiler
+        g.profile_started = time.monotonic()
+
+@app.after_request
+def save_request_profile(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        profile_id = profile_store.new_request_id()
+        try:
+            profile_store.save(profile_id, profiler, kind='request',
+                               method=request.method, path=request.path,
+                               status_code=response.status_code,
+                               duration_seconds=round(time.monotonic() - g.profile_started, 3))
+            response.headers['X-Profile-Id'] = profile_id
+        except Exception as e:
+            print(f"Could not save request profile: {e}")
+    return response
 
 def require_api_key(f):
     """
@@ -51,6 +209,11 @@ def require_api_key(f):
                 'message': 'The provided API key is not valid or has been revoked'
             }), 403
 
+        # Enforce the key's request rate
+        denied = rate_limiter.check_request(key_record)
+        if denied:
+            return retry_later_response(denied, 429)
+
         # Add key info to request context for logging
         request.api_key_info = key_record
 
@@ -58,9 +221,27 @@ def require_api_key(f):
 
     return decorated_function
 
+def retry_later_response(denied, status_code):
+    """429/503 response for a rate limit, quota or load shedding denial, with Retry-After"""
+    response = jsonify(denied)
+    response.status_code = status_code
+    response.headers['Retry-After'] = str(denied['retry_after'])
+    return response
+
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok'})
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: 200 once warm-up has finished and every component is warm, else 503"""
+    report = warmup.report()
+    return jsonify(report), 200 if report['ready'] else 503
+
 @app.route('/')
 def index():
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_assets.send('index.html')
 
 @app.route('/API_DOCUMENTATION.md')
 def serve_api_docs():
@@ -69,7 +250,7 @@ def serve_api_docs():
 
 @app.route('/<path:path>')
 def serve_static(path):
-    return send_from_directory(app.static_folder, path)
+    return static_assets.send(path)
 
 @app.route('/api/generate-key', methods=['POST'])
 def generate_api_key():
@@ -185,6 +366,11 @@ def generate_app():
 
         uploaded_icon = request.files.get('appIcon')
 
+        # requests, BeautifulSoup and Pillow are only needed here
+        from backend.services.url_metadata import fetch_url_metadata
+        from backend.services.android_generator import generate_android_project
+        from backend.services.zipper import create_zip
+
         metadata = fetch_url_metadata(url)
 
         if not app_name:
@@ -193,18 +379,13 @@ def generate_app():
         job_id = str(uuid.uuid4())
         project_dir = os.path.join(GENERATED_DIR, job_id)
 
+        # Blobs stored for this request are released once the response is sent
+        blobs = artifact_store.blobs
+        owner = f'request:{job_id}'
+
         custom_icon_path = None
         if uploaded_icon:
-            icon_dir = os.path.join(GENERATED_DIR, 'temp_icons')
-            os.makedirs(icon_dir, exist_ok=True)
-
-            safe_filename = secure_filename(uploaded_icon.filename) if uploaded_icon.filename else 'icon.png'
-            if not safe_filename or safe_filename == '':
-                ext = uploaded_icon.filename.rsplit('.', 1)[1].lower() if uploaded_icon.filename and '.' in uploaded_icon.filename else 'png'
-                safe_filename = f'icon.{ext}'
-
-            custom_icon_path = os.path.join(icon_dir, f'{job_id}_{safe_filename}')
-            uploaded_icon.save(custom_icon_path)
+            custom_icon_path = blobs.path(blobs.put_stream(uploaded_icon.stream, owner=owner))
 
         generate_android_project(
             project_dir=project_dir,
@@ -218,19 +399,20 @@ def generate_app():
             custom_icon_path=custom_icon_path
         )
 
-        zip_path = os.path.join(GENERATED_DIR, f'{job_id}.zip')
+        zip_path = project_dir + '.zip'
         create_zip(project_dir, zip_path)
+        zip_sha256 = blobs.put_file(zip_path, owner=owner)
 
         shutil.rmtree(project_dir, ignore_errors=True)
-        if custom_icon_path and os.path.exists(custom_icon_path):
-            os.remove(custom_icon_path)
+        os.remove(zip_path)
 
-        return send_file(
-            zip_path,
+        response = send_file(
+            blobs.path(zip_sha256),
             as_attachment=True,
             download_name=f'{metadata["package_name"]}.zip',
             mimetype='application/zip'
         )
+        return call_after_send(response, lambda: blobs.release_owner(owner))
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -238,6 +420,8 @@ def generate_app():
 @app.route('/api/cleanup/<job_id>')
 def cleanup(job_id):
     try:
+        artifact_store.blobs.release_owner(f'request:{job_id}')
+        # Zips written before the blob store
         zip_path = os.path.join(GENERATED_DIR, f'{job_id}.zip')
         if os.path.exists(zip_path):
             os.remove(zip_path)
@@ -245,69 +429,39 @@ def cleanup(job_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def build_apk_async(job_id, app_name, url, icon_path, base_version):
-    """Background function to build APK"""
-    from apk_builder.builder import APKBuilder
-    
-    try:
-        # Update status to processing
-        job_manager.set_processing(job_id, 'Starting APK build...')
-        
-        # Build APK
-        builder = APKBuilder(base_version=base_version)
-        
-        job_manager.set_progress(job_id, 20, 'Decompiling base APK...')
-        
-        apk_path = builder.build(
-            app_name=app_name,
-            url=url,
-            icon_path=icon_path
-        )
-        
-        job_manager.set_progress(job_id, 90, 'Finalizing APK...')
-        
-        # Copy APK to final location
-        final_apk_path = os.path.join(GENERATED_DIR, f'{job_id}.apk')
-        shutil.copy(apk_path, final_apk_path)
-        
-        # Update job as completed
-        job_manager.set_completed(job_id, final_apk_path)
-        
-        # Cleanup
-        builder.cleanup()
-        if icon_path and os.path.exists(icon_path):
-            try:
-                os.remove(icon_path)
-            except:
-                pass
-                
-    except Exception as e:
-        # Update job as failed
-        job_manager.set_failed(job_id, str(e))
-        print(f"Background APK Build Error for job {job_id}: {str(e)}")
-        import traceback
-        traceback.print_exc()
-
 @app.route('/api/v1/build-apk', methods=['POST'])
 @require_api_key
 def build_apk_api():
     """
     External API: Build custom APK with async job system
-    Accepts: app_name, url, optional icon
+    Accepts: app_name, url, optional icon, optional appNames (JSON object of
+    locale -> app name), optional callback_url (POSTed when the build
+    completes or fails)
     Returns: Job ID and download link immediately
     Requires: API key via X-API-Key header or api_key parameter
     """
+    admitted_job_id = None
+    job = None
     try:
         # Get form data
         url = request.form.get('url', '').strip()
         app_name = request.form.get('appName', '').strip()
         uploaded_icon = request.files.get('appIcon')
+        callback_url = request.form.get('callback_url', '').strip()
 
         # Validate required fields
         if not url:
             return jsonify({'error': 'URL is required'}), 400
         if not app_name:
             return jsonify({'error': 'App name is required'}), 400
+        try:
+            app_names = parse_app_names(request.form.get('appNames', '').strip())
+        except ValueError as e:
+            return jsonify({'error': f'Invalid appNames: {e}'}), 400
+        if callback_url:
+            callback_error = validate_callback_url(callback_url)
+            if callback_error:
+                return jsonify({'error': callback_error}), 400
 
         # Ensure URL has protocol
         if not url.startswith(('http://', 'https://')):
@@ -316,47 +470,86 @@ def build_apk_api():
         # Generate job ID
         job_id = str(uuid.uuid4())
         
-        # Save uploaded icon if provided
-        icon_path = None
+        # Store uploaded icon if provided (identical icons are stored once)
+        icon_sha256 = None
         if uploaded_icon:
-            icon_dir = os.path.join(GENERATED_DIR, 'temp_icons')
-            os.makedirs(icon_dir, exist_ok=True)
-
-            safe_filename = secure_filename(uploaded_icon.filename) if uploaded_icon.filename else 'icon.png'
-            if not safe_filename or safe_filename == '':
-                ext = uploaded_icon.filename.rsplit('.', 1)[1].lower() if uploaded_icon.filename and '.' in uploaded_icon.filename else 'png'
-                safe_filename = f'icon.{ext}'
-
-            icon_path = os.path.join(icon_dir, f'{job_id}_{safe_filename}')
-            uploaded_icon.save(icon_path)
+            icon_sha256 = artifact_store.blobs.put_stream(uploaded_icon.stream, owner=f'job:{job_id}')
 
         # Auto-detect base version
         user_inputs = {
             'app_name': app_name,
             'url': url,
-            'icon': icon_path
+            'icon': artifact_store.blobs.path(icon_sha256) if icon_sha256 else None
         }
         detector = VersionDetector()
         base_version = detector.detect_base_version(user_inputs)
         
-        # Create job in database
-        job_manager.create_job(job_id, app_name, url, has_icon=bool(uploaded_icon))
+        # Admins can profile the build itself (it then never joins another build)
+        profile_build = profiling_requested()
+        fingerprint = None if profile_build else build_fingerprint(base_version, app_name, url, icon_sha256, app_names)
+        
+        # A build that joins one already in flight adds no work: it is never
+        # shed and doesn't use the key's build quotas
+        key_id = request.api_key_info['key_id']
+        priority_weight = request.api_key_info.get('priority_weight', 1.0)
+        joins_build = job_manager.build_in_flight(fingerprint) is not None
+        
+        # Shed load when this key's queue is already too far behind, then
+        # admit the build against the key's quotas
+        overloaded = denied = None
+        if not joins_build:
+            overloaded = build_estimator.check_admission(key_id, priority_weight)
+            denied = None if overloaded else rate_limiter.acquire_build(request.api_key_info, job_id)
+        if overloaded or denied:
+            if icon_sha256:
+                artifact_store.blobs.release(icon_sha256, f'job:{job_id}')
+            return retry_later_response(overloaded or denied, 503 if overloaded else 429)
+        if not joins_build:
+            admitted_job_id = job_id
         
         # Get base URL for download link
         base_url = request.host_url.rstrip('/')
         download_url = f"{base_url}/api/v1/download/{job_id}"
         status_url = f"{base_url}/api/v1/status/{job_id}"
         
-        # Start building APK in background thread
-        build_thread = threading.Thread(
-            target=build_apk_async,
-            args=(job_id, app_name, url, icon_path, base_version),
-            daemon=True
+        # Create job in database with everything needed to rerun it after a restart.
+        # Identical builds already in flight are joined instead of started again.
+        job = job_manager.create_job(
+            job_id, app_name, url,
+            has_icon=bool(uploaded_icon),
+            inputs={
+                'app_name': app_name,
+                'url': url,
+                'icon_sha256': icon_sha256,
+                'app_names': app_names,
+                'base_version': base_version,
+                'profile': profile_build
+            },
+            fingerprint=fingerprint,
+            key_id=key_id,
+            priority_weight=priority_weight,
+            traceparent=tracer.current_traceparent(),
+            webhook={'url': callback_url, 'download_url': download_url,
+                     'status_url': status_url} if callback_url else None
         )
-        build_thread.start()
+        coalesced_with = job.get('leader_job_id')
+        
+        # The build in flight may have finished, or another one started, since the check
+        if coalesced_with and admitted_job_id:
+            rate_limiter.release_build(key_id, job_id, refund=True)
+        elif not coalesced_with and not admitted_job_id:
+            rate_limiter.acquire_build(request.api_key_info, job_id, force=True)
+        
+        if coalesced_with:
+            # The leader build holds its own reference to the icon
+            if icon_sha256:
+                artifact_store.blobs.release(icon_sha256, f'job:{job_id}')
+        else:
+            # Hand off to the build queue workers
+            build_queue.submit(job)
         
         # Return job info immediately
-        return jsonify({
+        response = {
             'success': True,
             'job_id': job_id,
             'download_url': download_url,
@@ -364,19 +557,128 @@ def build_apk_api():
             'message': 'APK build job created successfully. Use the download_url to get your APK.',
             'app_name': app_name,
             'url': url
-        }), 202
+        }
+        if app_names:
+            response['app_names'] = app_names
+        if coalesced_with:
+            response['coalesced_with'] = coalesced_with
+        if profile_build:
+            response['profile_id'] = f'job-{job_id}'
+        if callback_url:
+            # Verifies X-Webhook-Signature; the same for every build of this key
+            response['callback_url'] = callback_url
+            response['webhook_secret'] = webhook_dispatcher.secret_for(request.api_key_info['key_id'])
+        response.update(build_estimator.estimate_job(job) or {})
+        return jsonify(response), 202
 
     except Exception as e:
+        if admitted_job_id and not job:
+            rate_limiter.release_build(request.api_key_info['key_id'], admitted_job_id)
         print(f"API APK Build Error: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/queue', methods=['GET'])
+@require_api_key
+def get_queue_depth():
+    """
+    Build queue depth for the calling API key
+    Builds are scheduled fairly across API keys, so your wait depends mostly
+    on your own queued builds, not on the total
+    """
+    try:
+        depth = build_queue.depth_by_key()
+        key_id = request.api_key_info['key_id']
+        return jsonify({
+            'success': True,
+            'queue': {
+                'your_queued_builds': depth.get(key_id, 0),
+                'total_queued_builds': sum(depth.values()),
+                'active_tenants': len(depth),
+                'priority_weight': request.api_key_info.get('priority_weight', 1.0)
+            }
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Page size limits for /api/v1/jobs
+DEFAULT_JOB_PAGE_SIZE = 50
+MAX_JOB_PAGE_SIZE = 200
+
+def encode_job_cursor(position):
+    """Opaque cursor for a (created_at, job_id) listing position"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+def decode_job_cursor(cursor):
+    try:
+        created_at, job_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(created_at, str) or not isinstance(job_id, str):
+        raise ValueError('Invalid cursor')
+    return created_at, job_id
+
+def parse_job_time(name):
+    """?created_after= / ?created_before= as a job-store (local, naive) ISO timestamp"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ValueError(f'{name} must be an ISO 8601 timestamp')
+    if parsed.tzinfo:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.isoformat()
+
+@app.route('/api/v1/jobs', methods=['GET'])
+@require_api_key
+def list_jobs():
+    """
+    List the calling API key's jobs, newest first
+    Query: status (comma-separated), created_after, created_before (ISO 8601),
+    limit (default 50, max 200), cursor (next_cursor of the previous page)
+    """
+    try:
+        statuses = [status for status in request.args.get('status', '').split(',') if status]
+        unknown = [status for status in statuses if status not in JOB_STATUSES]
+        if unknown:
+            return jsonify({'error': f"Unknown status: {', '.join(unknown)}",
+                            'valid_statuses': list(JOB_STATUSES)}), 400
+        try:
+            limit = int(request.args.get('limit', DEFAULT_JOB_PAGE_SIZE))
+            created_after = parse_job_time('created_after')
+            created_before = parse_job_time('created_before')
+            after = decode_job_cursor(request.args['cursor']) if request.args.get('cursor') else None
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not 1 <= limit <= MAX_JOB_PAGE_SIZE:
+            return jsonify({'error': f'limit must be between 1 and {MAX_JOB_PAGE_SIZE}'}), 400
+
+        jobs, next_position = job_manager.list_jobs(
+            request.api_key_info['key_id'], statuses, created_after, created_before, after, limit)
+
+        base_url = request.host_url.rstrip('/')
+        for job in jobs:
+            job['coalesced_with'] = job.pop('leader_job_id')
+            job['status_url'] = f"{base_url}/api/v1/status/{job['job_id']}"
+            if job['status'] == 'completed':
+                job['download_url'] = f"{base_url}/api/v1/download/{job['job_id']}"
+        return jsonify({
+            'success': True,
+            'jobs': jobs,
+            'next_cursor': encode_job_cursor(next_position) if next_position else None
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/build-apk', methods=['POST'])
 def build_custom_apk():
     """
     Build custom APK with auto-detection of base version
-    Accepts: app_name, url, optional icon
+    Accepts: app_name, url, optional icon, optional appNames (JSON object of
+    locale -> app name)
     Returns: Signed APK file
     For frontend use (no API key required)
     """
@@ -391,6 +693,10 @@ def build_custom_apk():
             return jsonify({'error': 'URL is required'}), 400
         if not app_name:
             return jsonify({'error': 'App name is required'}), 400
+        try:
+            app_names = parse_app_names(request.form.get('appNames', '').strip())
+        except ValueError as e:
+            return jsonify({'error': f'Invalid appNames: {e}'}), 400
 
         # Ensure URL has protocol
         if not url.startswith(('http://', 'https://')):
@@ -403,19 +709,14 @@ def build_custom_apk():
             'icon': None
         }
 
-        # Save uploaded icon if provided
+        # Blobs stored for this request are released once the response is sent
+        blobs = artifact_store.blobs
+        owner = f'request:{uuid.uuid4()}'
+
+        # Store uploaded icon if provided
         icon_path = None
         if uploaded_icon:
-            icon_dir = os.path.join(GENERATED_DIR, 'temp_icons')
-            os.makedirs(icon_dir, exist_ok=True)
-
-            safe_filename = secure_filename(uploaded_icon.filename) if uploaded_icon.filename else 'icon.png'
-            if not safe_filename or safe_filename == '':
-                ext = uploaded_icon.filename.rsplit('.', 1)[1].lower() if uploaded_icon.filename and '.' in uploaded_icon.filename else 'png'
-                safe_filename = f'icon.{ext}'
-
-            icon_path = os.path.join(icon_dir, f'{uuid.uuid4()}_{safe_filename}')
-            uploaded_icon.save(icon_path)
+            icon_path = blobs.path(blobs.put_stream(uploaded_icon.stream, owner=owner))
             user_inputs['icon'] = icon_path
 
         # Auto-detect base version
@@ -435,17 +736,16 @@ def build_custom_apk():
             apk_path = builder.build(
                 app_name=app_name,
                 url=url,
-                icon_path=icon_path
+                icon_path=icon_path,
+                app_names=app_names
             )
 
-            # Copy APK to a temporary location before cleanup
-            final_apk_path = os.path.join(GENERATED_DIR, f'{uuid.uuid4()}.apk')
-            shutil.copy(apk_path, final_apk_path)
+            # Keep the APK in the blob store while it is sent
+            apk_sha256 = blobs.put_file(apk_path, owner=owner)
+            final_apk_path = blobs.path(apk_sha256)
 
             # Generate download filename
-            safe_app_name = "".join(c for c in app_name if c.isalnum() or c in (' ', '-', '_')).strip()
-            safe_app_name = safe_app_name.replace(' ', '_')
-            download_name = f"{safe_app_name}.apk"
+            download_name = safe_download_name(app_name)
 
             # Send APK file
             response = send_file(
@@ -456,33 +756,18 @@ def build_custom_apk():
             )
 
             # Schedule cleanup after sending
-            @response.call_on_close
             def cleanup_files():
                 # Cleanup builder's temp directory
                 builder.cleanup()
-                # Cleanup icon
-                if icon_path and os.path.exists(icon_path):
-                    try:
-                        os.remove(icon_path)
-                    except:
-                        pass
-                # Cleanup final APK
-                if os.path.exists(final_apk_path):
-                    try:
-                        os.remove(final_apk_path)
-                    except:
-                        pass
-
-            return response
+                # Release the icon and APK (collected by the storage reaper)
+                blobs.release_owner(owner)
+
+            return call_after_send(response, cleanup_files)
 
         except Exception as e:
             # Cleanup on error
             builder.cleanup()
-            if icon_path and os.path.exists(icon_path):
-                try:
-                    os.remove(icon_path)
-                except:
-                    pass
+            blobs.release_owner(owner)
             raise
 
     except Exception as e:
@@ -518,17 +803,65 @@ def get_job_status(job_id):
                 'message': job['message'],
                 'error': job.get('error'),
                 'created_at': job['created_at'],
-                'completed_at': job.get('completed_at')
+                'completed_at': job.get('completed_at'),
+                'apk_sha256': job.get('apk_sha256'),
+                'webhook': public_state(job.get('webhook')),
+                **(build_estimator.estimate_job(job) or {})
             }
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/v1/download/<job_id>', methods=['GET'])
+def send_patch(job, from_hash, apk_path, apk_sha256):
+    """
+    Send a delta from an earlier build of the same app to this one
+    202 with Retry-After while the patch is being generated
+    """
+    if from_hash == apk_sha256:
+        # The client already has this build
+        response = Response(status=304)
+        response.set_etag(apk_sha256)
+        return response
+    
+    # Only earlier builds of the same app whose APK is still stored qualify
+    base_known = job_manager.app_builds(job.get('key_id'), job['app_name'],
+                                        apk_sha256=from_hash, limit=1)
+    base_path = artifact_store.apk_path(from_hash) if base_known else None
+    if not base_path or patch_cache.failed(from_hash, apk_sha256):
+        return jsonify({
+            'success': False,
+            'error': 'Base APK not available' if not base_path else 'Patch not available',
+            'message': 'No patch can be made from that version. Download the full APK instead.'
+        }), 404
+    
+    storage_manager.touch(base_path)
+    patch_path = patch_cache.get(base_path, apk_path, from_hash, apk_sha256)
+    if not patch_path:
+        response = jsonify({
+            'success': False,
+            'status': 'generating',
+            'message': 'The patch is being prepared. Retry shortly or download the full APK.',
+            'retry_after': patch_cache.retry_after
+        })
+        response.status_code = 202
+        response.headers['Retry-After'] = str(patch_cache.retry_after)
+        return response
+    
+    storage_manager.touch(patch_path)
+    return send_artifact(
+        patch_path,
+        download_name=safe_download_name(job['app_name'], extension='apkpatch'),
+        etag=f'{from_hash}-{apk_sha256}',
+        mimetype=PATCH_MIMETYPE
+    )
+
+@app.route('/api/v1/download/<job_id>', methods=['GET', 'HEAD'])
 def download_apk(job_id):
     """
     Download APK or get status if not ready
     This endpoint checks job status and returns APK if ready, or status message if still processing
+    Completed APKs support Range, If-None-Match and HEAD via a strong content ETag
+    With ?from=<sha256 of an earlier build of the same app> a patch is sent instead
     """
     try:
         job = job_manager.get_job(job_id)
@@ -542,22 +875,27 @@ def download_apk(job_id):
         
         # Check job status
         if job['status'] == 'pending':
+            estimate = build_estimator.estimate_job(job) or {}
             return jsonify({
                 'success': False,
                 'status': 'pending',
                 'message': 'Your APK build is in queue. Please wait and try again in a few moments.',
                 'progress': job['progress'],
-                'job_id': job_id
+                'job_id': job_id,
+                **estimate
             }), 202
         
         elif job['status'] == 'processing':
+            estimate = build_estimator.estimate_job(job) or {}
+            minutes = max(1, round(estimate.get('estimated_completion_seconds', 0) / 60))
             return jsonify({
                 'success': False,
                 'status': 'processing',
                 'message': f"Your APK is being built... {job['message']}",
                 'progress': job['progress'],
                 'job_id': job_id,
-                'tip': 'APK building can take 10-20 minutes on free tier. Please be patient.'
+                'tip': f'Estimated time remaining: about {minutes} minute(s).',
+                **estimate
             }), 202
         
         elif job['status'] == 'failed':
@@ -569,27 +907,41 @@ def download_apk(job_id):
                 'job_id': job_id
             }), 500
         
+        elif job['status'] == 'expired':
+            return jsonify({
+                'success': False,
+                'status': 'expired',
+                'message': job.get('message', 'The APK has expired. Please build again.'),
+                'job_id': job_id
+            }), 410
+        
         elif job['status'] == 'completed':
             # APK is ready, send file
-            apk_path = job.get('apk_path')
+            apk_path = artifact_store.apk_path(job.get('apk_sha256'), job.get('apk_path'))
             
-            if not apk_path or not os.path.exists(apk_path):
+            if not apk_path:
                 return jsonify({
                     'success': False,
                     'error': 'APK file not found',
                     'message': 'The APK was built but the file is missing. Please try building again.'
                 }), 404
             
-            # Generate download filename
-            safe_app_name = "".join(c for c in job['app_name'] if c.isalnum() or c in (' ', '-', '_')).strip()
-            safe_app_name = safe_app_name.replace(' ', '_')
-            download_name = f"{safe_app_name}.apk"
+            # Jobs completed before hashes were recorded get one computed once
+            apk_sha256 = job.get('apk_sha256')
+            if not apk_sha256:
+                apk_sha256 = file_sha256(apk_path)
+                job_manager.update_job(job_id, apk_sha256=apk_sha256)
             
-            return send_file(
+            from_hash = request.args.get('from')
+            if from_hash:
+                return send_patch(job, from_hash, apk_path, apk_sha256)
+            
+            storage_manager.touch(apk_path)
+            return send_artifact(
                 apk_path,
-                as_attachment=True,
-                download_name=download_name,
-                mimetype='application/vnd.android.package-archive'
+                download_name=safe_download_name(job['app_name']),
+                etag=apk_sha256,
+                offload_path=artifact_store.relative_path(apk_path)
             )
         
         else:
@@ -605,9 +957,63 @@ def download_apk(job_id):
         traceback.print_exc()
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/admin/profiles', methods=['GET'])
+@require_admin
+def list_profiles():
+    """Stored request and build profiles, newest first"""
+    return jsonify({'success': True, 'profiles': profile_store.list()})
+
+@app.route('/api/v1/admin/profiles/<profile_id>', methods=['GET'])
+@require_admin
+def download_profile(profile_id):
+    """
+    A stored profile: pstats file (default, for snakeviz/pstats) or, with
+    ?format=text, a report sorted by ?sort= (default cumulative)
+    """
+    try:
+        path = profile_store.path_for(profile_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not os.path.exists(path):
+        return jsonify({
+            'success': False,
+            'error': 'Profile not found',
+            'message': 'Build profiles appear when the build finishes'
+        }), 404
+    if request.args.get('format') == 'text':
+        report = profile_store.render_text(profile_id, sort=request.args.get('sort', 'cumulative'))
+        return Response(report, mimetype='text/plain')
+    return send_file(path, as_attachment=True, download_name=f'{profile_id}.prof',
+                     mimetype='application/octet-stream')
+
+@app.route('/api/v1/admin/stacks', methods=['GET'])
+@require_admin
+def download_stacks():
+    """Continuous sampler stacks of all processes, folded (flamegraph.pl / speedscope input)"""
+    return Response(profile_store.merged_stacks(), mimetype='text/plain')
+
+@app.route('/api/v1/admin/keys/<key_id>/priority', methods=['PUT'])
+@require_admin
+def set_key_priority(key_id):
+    """
+    Set an API key's share of build capacity under fair scheduling
+    Body: {"priority_weight": 2.0}; applies to the key's builds from its next submission
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        weight = float(data['priority_weight'])
+        found = api_key_manager.set_priority_weight(key_id, weight)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': 'Invalid priority_weight',
+                        'message': str(e) if isinstance(e, ValueError) else 'Expected a positive number'}), 400
+    if not found:
+        return jsonify({'error': 'API key not found'}), 404
+    return jsonify({'success': True, 'key_id': key_id, 'priority_weight': weight})
+
 if __name__ == '__main__':
     # Get port from environment variable (Render provides $PORT)
     port = int(os.environ.get('PORT', 5000))
     # Disable debug in production
     debug = os.environ.get('FLASK_ENV') == 'development'
+    background_services()
     app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
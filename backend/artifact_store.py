@@ -0,0 +1,83 @@
+"""
+Artifact Store
+Where build workers publish signed APKs and where the API serves them from.
+The directory store works for a single node or, on a shared volume, for
+API and build nodes running on different machines.
+
+Build inputs and outputs (uploaded icons, signed APKs, project zips) go to
+its content-addressed blob store (<root>/blobs); loose files directly under
+the root are derived caches (delta patches) and artifacts from before the
+blob store.
+"""
+import os
+import shutil
+import uuid
+
+from backend.blob_store import BlobStore
+
+
+class DirectoryArtifactStore:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+        self.blobs = BlobStore(os.path.join(self.root, 'blobs'))
+
+    def path_for(self, name) -> str:
+        return os.path.join(self.root, name)
+
+    def put(self, name, source_path) -> str:
+        """
+        Publish a file under name, atomically (readers never see a partial copy)
+
+        Returns:
+            Path the artifact can be served from
+        """
+        dest = self.path_for(name)
+        tmp = f'{dest}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            shutil.copyfile(source_path, tmp)
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return dest
+
+    def exists(self, name) -> bool:
+        return os.path.exists(self.path_for(name))
+
+    def relative_path(self, path) -> str:
+        """Path of a stored file relative to the root (for proxy offload)"""
+        return os.path.relpath(path, self.root)
+
+    def apk_path(self, apk_sha256, legacy_path=None):
+        """
+        Where the APK with this hash is stored, or None if it's gone
+
+        Args:
+            apk_sha256: The APK's content hash (blob name)
+            legacy_path: apk_path of a job completed before the blob store
+        """
+        if apk_sha256 and self.blobs.exists(apk_sha256):
+            return self.blobs.path(apk_sha256)
+        for path in (legacy_path, apk_sha256 and self.path_for(f'{apk_sha256}.apk')):
+            if path and os.path.exists(path):
+                return path
+        return None
+
+    def delete(self, name) -> bool:
+        try:
+            os.remove(self.path_for(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def create_artifact_store(spec):
+    """
+    Build an artifact store from a spec string
+
+    Supported: a directory path, or dir:///absolute/path
+    """
+    if spec.startswith('dir://'):
+        spec = spec[len('dir://'):]
+    return DirectoryArtifactStore(spec)
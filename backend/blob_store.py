@@ -0,0 +1,262 @@
+"""
+Content-Addressed Blob Store
+Uploaded icons, signed APKs and project zips are stored once per distinct
+content, named by SHA-256 and sharded two levels deep so no directory grows
+past a few hundred entries even with millions of objects:
+
+    <root>/3f/2a/3f2a9c...e1
+
+Each blob has a set of named references (owners such as 'job:<job_id>'),
+kept with its size and reference count in <root>/blobs.sqlite3. Storing
+bytes that already exist only adds a reference. A blob with no references
+left is deleted by collect_garbage() after a grace period, so a blob being
+re-stored at the same moment is never lost.
+
+Writes go to <root>/tmp first and are renamed into place, so readers never
+see a partial blob. Adding or removing a blob file happens inside the index
+transaction that records it, which keeps the index and the files in step
+across threads and processes sharing the store.
+"""
+import os
+import re
+import time
+import uuid
+import hashlib
+import sqlite3
+from contextlib import closing
+from typing import Dict, Iterator, List, Optional
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.index_path = os.path.join(self.root, 'blobs.sqlite3')
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS blobs ('
+                ' sha256 TEXT PRIMARY KEY,'
+                ' size INTEGER NOT NULL,'
+                ' refcount INTEGER NOT NULL DEFAULT 0,'
+                ' created_at REAL NOT NULL,'
+                ' unreferenced_at REAL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS blob_refs ('
+                ' sha256 TEXT NOT NULL,'
+                ' owner TEXT NOT NULL,'
+                ' created_at REAL NOT NULL,'
+                ' PRIMARY KEY (sha256, owner))')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_blob_refs_owner ON blob_refs (owner)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced'
+                         ' ON blobs (unreferenced_at) WHERE refcount = 0')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.index_path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def path(self, sha256) -> str:
+        """Where a blob lives (whether or not it exists)"""
+        if not SHA256_PATTERN.match(sha256 or ''):
+            raise ValueError(f'Invalid blob hash: {sha256}')
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def relative_path(self, sha256) -> str:
+        return os.path.relpath(self.path(sha256), self.root)
+
+    def exists(self, sha256) -> bool:
+        try:
+            return os.path.exists(self.path(sha256))
+        except ValueError:
+            return False
+
+    def put_file(self, source_path, owner=None) -> str:
+        """Store a file's content; returns its SHA-256"""
+        with open(source_path, 'rb') as f:
+            return self.put_stream(f, owner)
+
+    def put_bytes(self, data, owner=None) -> str:
+        tmp = self._tmp_path()
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        return self._commit(tmp, hashlib.sha256(data).hexdigest(), len(data), owner)
+
+    def put_stream(self, stream, owner=None) -> str:
+        """
+        Store everything read from a binary stream
+
+        Args:
+            stream: File-like object (an open file or an uploaded file's stream)
+            owner: Reference to add for the caller (e.g. 'job:<job_id>'); without
+                   one the blob is garbage once the grace period has passed
+
+        Returns:
+            The content's SHA-256
+        """
+        digest = hashlib.sha256()
+        size = 0
+        tmp = self._tmp_path()
+        with open(tmp, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        return self._commit(tmp, digest.hexdigest(), size, owner)
+
+    def _tmp_path(self) -> str:
+        return os.path.join(self.tmp_dir, f'{os.getpid()}-{uuid.uuid4().hex}.tmp')
+
+    def _commit(self, tmp, sha256, size, owner):
+        path = self.path(sha256)
+        now = time.time()
+        try:
+            with closing(self._connect()) as conn:
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    conn.execute('INSERT OR IGNORE INTO blobs (sha256, size, created_at, unreferenced_at)'
+                                 ' VALUES (?, ?, ?, ?)', (sha256, size, now, now))
+                    # Stored again: restart an unreferenced blob's grace period
+                    conn.execute('UPDATE blobs SET unreferenced_at = ? WHERE sha256 = ? AND refcount = 0',
+                                 (now, sha256))
+                    if not os.path.exists(path):
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        os.replace(tmp, path)
+                    if owner:
+                        self._add_ref(conn, sha256, owner)
+                    conn.execute('COMMIT')
+                except BaseException:
+                    conn.execute('ROLLBACK')
+                    raise
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        return sha256
+
+    def _add_ref(self, conn, sha256, owner):
+        added = conn.execute('INSERT OR IGNORE INTO blob_refs (sha256, owner, created_at) VALUES (?, ?, ?)',
+                             (sha256, owner, time.time())).rowcount
+        if added:
+            conn.execute('UPDATE blobs SET refcount = refcount + 1, unreferenced_at = NULL'
+                         ' WHERE sha256 = ?', (sha256,))
+        return added
+
+    def add_ref(self, sha256, owner) -> bool:
+        """Reference an existing blob (idempotent); False if the blob isn't stored"""
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            known = conn.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            if known:
+                self._add_ref(conn, sha256, owner)
+            conn.execute('COMMIT')
+            return bool(known)
+
+    def release(self, sha256, owner) -> bool:
+        """Drop owner's reference (idempotent); True if one was dropped"""
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            removed = conn.execute('DELETE FROM blob_refs WHERE sha256 = ? AND owner = ?',
+                                   (sha256, owner)).rowcount
+            if removed:
+                conn.execute(
+                    'UPDATE blobs SET refcount = refcount - 1,'
+                    ' unreferenced_at = CASE WHEN refcount = 1 THEN ? END WHERE sha256 = ?',
+                    (time.time(), sha256))
+            conn.execute('COMMIT')
+            return bool(removed)
+
+    def release_owner(self, owner) -> int:
+        """Drop every reference held by owner; returns how many were dropped"""
+        with closing(self._connect()) as conn:
+            shas = [sha256 for sha256, in
+                    conn.execute('SELECT sha256 FROM blob_refs WHERE owner = ?', (owner,))]
+        return sum(self.release(sha256, owner) for sha256 in shas)
+
+    def refcount(self, sha256) -> int:
+        with closing(self._connect()) as conn:
+            row = conn.execute('SELECT refcount FROM blobs WHERE sha256 = ?', (sha256,)).fetchone()
+            return row[0] if row else 0
+
+    def refs(self, owner_prefix='') -> Iterator[tuple]:
+        """(sha256, owner, created_at) of references whose owner starts with owner_prefix"""
+        with closing(self._connect()) as conn:
+            yield from conn.execute(
+                'SELECT sha256, owner, created_at FROM blob_refs WHERE owner >= ? AND owner < ?',
+                (owner_prefix, owner_prefix + '\U0010ffff'))
+
+    def list(self) -> List[Dict]:
+        """Every stored blob: sha256, size, refcount"""
+        with closing(self._connect()) as conn:
+            return [{'sha256': sha256, 'size': size, 'refcount': refcount}
+                    for sha256, size, refcount in
+                    conn.execute('SELECT sha256, size, refcount FROM blobs')]
+
+    def total_bytes(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0]
+
+    def delete(self, sha256, owners=None) -> Optional[int]:
+        """
+        Remove a blob and all references to it
+
+        Args:
+            owners: Only delete if every current reference is one of these
+                    (checked in the deleting transaction), so a reference
+                    added since the caller looked keeps the blob
+
+        Returns:
+            Bytes freed, or None if a reference outside owners kept the blob
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if owners is not None:
+                held = {owner for owner, in conn.execute('SELECT owner FROM blob_refs WHERE sha256 = ?',
+                                                         (sha256,))}
+                if not held <= set(owners):
+                    conn.execute('ROLLBACK')
+                    return None
+            freed = self._delete(conn, sha256)
+            conn.execute('COMMIT')
+            return freed
+
+    def _delete(self, conn, sha256):
+        conn.execute('DELETE FROM blob_refs WHERE sha256 = ?', (sha256,))
+        conn.execute('DELETE FROM blobs WHERE sha256 = ?', (sha256,))
+        try:
+            path = self.path(sha256)
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def collect_garbage(self, grace_seconds) -> Dict:
+        """
+        Delete blobs that have had no references for grace_seconds, and temp
+        files left behind by writers that died
+
+        Returns:
+            Dict with the number of blobs deleted and bytes freed
+        """
+        cutoff = time.time() - grace_seconds
+        stats = {'deleted': 0, 'freed_bytes': 0}
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute('SELECT sha256 FROM blobs WHERE refcount = 0 AND unreferenced_at < ?',
+                                (cutoff,)).fetchall()
+            for sha256, in rows:
+                stats['freed_bytes'] += self._delete(conn, sha256)
+                stats['deleted'] += 1
+            conn.execute('COMMIT')
+
+        for entry in os.scandir(self.tmp_dir):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+        return stats
+
@@ -0,0 +1,193 @@
+"""
+Build Time Estimator
+Rolling model of build durations (from recorded stage timings) used to
+compute queue wait / ETA and to shed load when a key's queue is too far behind
+
+Waits follow the fair scheduler (build_queue.FairScheduler): a job waits
+for the jobs ahead of it in its own key's queue plus, meanwhile, each other
+active key's weighted share, not for every job submitted before it.
+"""
+import os
+import math
+import time
+import threading
+from datetime import datetime
+from statistics import median
+from typing import Dict, Optional
+
+
+class BuildEstimator:
+    def __init__(self, job_manager, capacity: Optional[int] = None,
+                 window: int = 50, refresh_interval: int = 60):
+        self.job_manager = job_manager
+        # Builds that can run at once across all workers (in-process and remote)
+        self.capacity = max(1, capacity if capacity is not None else
+                            int(os.environ.get('BUILD_CAPACITY', '1')))
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self.default_duration = float(os.environ.get('BUILD_DEFAULT_SECONDS', '600'))
+        # Reject new builds when the expected queue wait exceeds this (0 = never)
+        self.max_queue_wait = float(os.environ.get('MAX_QUEUE_WAIT_SECONDS', '3600'))
+        # Seconds a queue snapshot is reused, so status polls don't each reload the job store
+        self.snapshot_ttl = float(os.environ.get('BUILD_ESTIMATE_CACHE_SECONDS', '2'))
+
+        self._lock = threading.Lock()
+        self._durations = []
+        self._stage_medians: Dict[str, float] = {}
+        # The same, split by workspace kind ('ram' / 'disk') to compare I/O cost
+        self._workspace_stage_medians: Dict[str, Dict[str, float]] = {}
+        self._refreshed_at = 0.0
+        self._snapshot = None
+        self._snapshot_at = 0.0
+
+    def _refresh(self, jobs):
+        """Rebuild the rolling window from the most recent completed builds"""
+        finished = sorted((job for job in jobs.values()
+                           if job['status'] == 'completed' and job.get('stage_timings')
+                           and not job.get('leader_job_id')),
+                          key=lambda job: job.get('completed_at') or '')[-self.window:]
+        durations = [sum(job['stage_timings'].values()) for job in finished]
+        stages: Dict[str, list] = {}
+        by_workspace: Dict[str, Dict[str, list]] = {}
+        for job in finished:
+            workspace_stages = by_workspace.setdefault(job.get('workspace') or 'disk', {})
+            for stage, seconds in job['stage_timings'].items():
+                stages.setdefault(stage, []).append(seconds)
+                workspace_stages.setdefault(stage, []).append(seconds)
+
+        with self._lock:
+            self._durations = durations
+            self._stage_medians = {stage: median(values) for stage, values in stages.items()}
+            self._workspace_stage_medians = {
+                workspace: {stage: median(values) for stage, values in workspace_stages.items()}
+                for workspace, workspace_stages in by_workspace.items()
+            }
+            self._refreshed_at = time.time()
+
+    def _queue_snapshot(self) -> Dict:
+        """
+        Running builds and each key's queue, from one read of the job store
+        reused for snapshot_ttl seconds
+
+        Returns:
+            dict with 'processing' (jobs), 'queues' ({key_id: [job_id, ...]},
+            oldest first), 'positions' ({job_id: index in its key's queue})
+            and 'weights' ({key_id: priority weight})
+        """
+        now = time.time()
+        with self._lock:
+            if self._snapshot is not None and now - self._snapshot_at < self.snapshot_ttl:
+                return self._snapshot
+
+        jobs = self.job_manager.all_jobs()
+        if now - self._refreshed_at > self.refresh_interval:
+            self._refresh(jobs)
+        processing, queues, positions, weights = [], {}, {}, {}
+        for job in sorted(jobs.values(), key=lambda job: job['created_at']):
+            if job.get('leader_job_id'):
+                continue
+            if job['status'] == 'processing':
+                processing.append(job)
+            elif job['status'] == 'pending':
+                key = job.get('key_id') or ''
+                queue = queues.setdefault(key, [])
+                positions[job['job_id']] = len(queue)
+                queue.append(job['job_id'])
+                # As in FairScheduler, the newest job carries the key's current weight
+                weights[key] = float(job.get('priority_weight') or 1.0)
+
+        snapshot = {'processing': processing, 'queues': queues,
+                    'positions': positions, 'weights': weights}
+        with self._lock:
+            self._snapshot = snapshot
+            self._snapshot_at = now
+        return snapshot
+
+    def typical_duration(self) -> float:
+        """Median build time over the rolling window"""
+        with self._lock:
+            return median(self._durations) if self._durations else self.default_duration
+
+    def stage_medians(self, workspace: Optional[str] = None) -> Dict[str, float]:
+        """Median seconds per build stage, optionally only for 'ram' or 'disk' workspaces"""
+        with self._lock:
+            if workspace:
+                return dict(self._workspace_stage_medians.get(workspace, {}))
+            return dict(self._stage_medians)
+
+    def _elapsed(self, job) -> float:
+        started = job.get('started_at') or job['updated_at']
+        return max(0.0, time.time() - datetime.fromisoformat(started).timestamp())
+
+    def _queue_wait(self, snapshot, key_id, position, weight=1.0) -> float:
+        """
+        Seconds until a job starts that has `position` jobs ahead of it in its
+        key's queue: those jobs, plus up to (position + 1) weighted turns for
+        every other key with queued work, plus what's left of running builds
+        """
+        typical = self.typical_duration()
+        remaining = sum(max(0.0, typical - self._elapsed(job)) for job in snapshot['processing'])
+        weight = max(0.01, weight)
+        ahead = position
+        for other, queue in snapshot['queues'].items():
+            if other != key_id:
+                turns = math.ceil((position + 1) * max(0.01, snapshot['weights'][other]) / weight)
+                ahead += min(len(queue), turns)
+        return (remaining + ahead * typical) / self.capacity
+
+    def _estimate(self, wait) -> Dict:
+        return {
+            'estimated_wait_seconds': int(wait),
+            'estimated_completion_seconds': int(wait + self.typical_duration())
+        }
+
+    def estimate_new(self, key_id=None, weight=1.0) -> Dict:
+        """ETA for a build the key would submit now (at the back of its own queue)"""
+        snapshot = self._queue_snapshot()
+        key_id = key_id or ''
+        position = len(snapshot['queues'].get(key_id, []))
+        return self._estimate(self._queue_wait(snapshot, key_id, position, weight))
+
+    def estimate_job(self, job) -> Optional[Dict]:
+        """ETA for an existing job, None once it has finished"""
+        if job.get('leader_job_id'):
+            leader = self.job_manager.get_job(job['leader_job_id'])
+            return self.estimate_job(leader) if leader else None
+        if job['status'] == 'pending':
+            snapshot = self._queue_snapshot()
+            key_id = job.get('key_id') or ''
+            # Jobs newer than the snapshot are at the back of their key's queue
+            position = snapshot['positions'].get(job['job_id'], len(snapshot['queues'].get(key_id, [])))
+            weight = float(job.get('priority_weight') or 1.0)
+            return self._estimate(self._queue_wait(snapshot, key_id, position, weight))
+        if job['status'] == 'processing':
+            return {
+                'estimated_wait_seconds': 0,
+                'estimated_completion_seconds': int(max(0.0, self.typical_duration() - self._elapsed(job)))
+            }
+        return None
+
+    def check_admission(self, key_id=None, weight=1.0) -> Optional[Dict]:
+        """
+        Shed load for a key whose new build would wait too long
+
+        The wait is the key's own: its backlog and its share against the other
+        active keys, so one tenant's backlog doesn't get everyone else shed.
+        Callers skip this for builds that join one already in flight.
+
+        Returns:
+            None if the build may be accepted, otherwise a dict with 'error',
+            'message', 'retry_after' and 'estimated_wait_seconds'
+        """
+        if not self.max_queue_wait:
+            return None
+        estimate = self.estimate_new(key_id, weight)
+        wait = estimate['estimated_wait_seconds']
+        if wait <= self.max_queue_wait:
+            return None
+        return {
+            'error': 'Build queue is full',
+            'message': f'Your builds are queued about {wait // 60} minutes deep. Please retry later.',
+            'retry_after': max(30, int(wait - self.max_queue_wait)),
+            'estimated_wait_seconds': wait
+        }
@@ -0,0 +1,462 @@
+"""
+Durable Build Queue
+Pending jobs are persisted (with their build inputs), so a restart loses
+nothing: workers pull jobs by leasing them, keep the lease alive with
+heartbeats, and stale leases from dead processes are requeued.
+
+Queue backends:
+- JobStoreQueue: the job store itself is the queue (single node, default)
+- SQLiteJobQueue: a SQLite file shared by API nodes and standalone build
+  workers (python -m backend.worker)
+
+Both hand out work through a FairScheduler (deficit round-robin across API
+keys) rather than strictly oldest first.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import hashlib
+import threading
+from contextlib import closing
+from datetime import datetime
+from typing import Callable, Dict, Optional, Set
+
+
+def build_fingerprint(base_version, app_name, url, icon_sha256=None, app_names=None) -> str:
+    """Identity of a build's inputs, used to coalesce identical in-flight builds"""
+    identity = {
+        'base_version': base_version,
+        'app_name': app_name,
+        'url': url,
+        'icon_sha256': icon_sha256
+    }
+    if app_names:
+        identity['app_names'] = app_names
+    return hashlib.sha256(json.dumps(identity, sort_keys=True).encode()).hexdigest()
+
+
+def process_owner_id() -> str:
+    """Lease owner for this process: host, pid and a per-boot token"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+class FairScheduler:
+    """
+    Deficit round-robin across API keys.
+    Each key with pending work is visited in turn and earns its priority
+    weight in credit per visit; one job costs one credit. A tenant with 200
+    queued builds therefore gets its weighted share, not the whole queue.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ring = []
+        self._deficit: Dict[str, float] = {}
+        self._pos = 0
+
+    def select(self, pending):
+        """
+        Pick the next job to run
+
+        Args:
+            pending: Pending entries (dicts with job_id, key_id, priority_weight), oldest first
+
+        Returns:
+            The chosen entry
+        """
+        by_key: Dict[str, list] = {}
+        for entry in pending:
+            by_key.setdefault(entry.get('key_id') or '', []).append(entry)
+
+        with self._lock:
+            # Keys without pending work drop out and lose their credit
+            self._ring = [key for key in self._ring if key in by_key]
+            for key in list(self._deficit):
+                if key not in by_key:
+                    del self._deficit[key]
+            for key in by_key:
+                if key not in self._deficit:
+                    self._deficit[key] = 0.0
+                    self._ring.append(key)
+
+            while True:
+                self._pos %= len(self._ring)
+                key = self._ring[self._pos]
+                if self._deficit[key] < 1:
+                    # Newest job carries the key's current weight
+                    weight = max(0.01, float(by_key[key][-1].get('priority_weight') or 1.0))
+                    self._deficit[key] += weight
+                    if self._deficit[key] < 1:
+                        self._pos += 1
+                        continue
+                self._deficit[key] -= 1
+                if self._deficit[key] < 1:
+                    self._pos += 1
+                return by_key[key][0]
+
+
+def queue_depth_by_key(pending):
+    """Pending job count per API key"""
+    depth: Dict[str, int] = {}
+    for entry in pending:
+        key = entry.get('key_id') or ''
+        depth[key] = depth.get(key, 0) + 1
+    return depth
+
+
+class JobStoreQueue:
+    """Queue backed directly by the JobManager's pending job records"""
+
+    def __init__(self, job_manager, scheduler=None):
+        self.job_manager = job_manager
+        self.scheduler = scheduler or FairScheduler()
+
+    def enqueue(self, job):
+        # The pending job record already is the queue entry
+        pass
+
+    def reconcile(self):
+        # Nothing can be missing: the job store is the queue
+        return []
+
+    def claim(self, owner):
+        return self.job_manager.claim_next_job(owner, select=self.scheduler.select)
+
+    def pending(self):
+        """Queued jobs (job_id, key_id, priority_weight), oldest first"""
+        return sorted(({'job_id': job['job_id'],
+                        'key_id': job.get('key_id'),
+                        'priority_weight': job.get('priority_weight', 1.0),
+                        'created_at': job['created_at']}
+                       for job in self.job_manager.iter_jobs(('pending',))
+                       if job.get('inputs') and not job.get('leader_job_id')),
+                      key=lambda entry: entry['created_at'])
+
+    def heartbeat(self, job_ids, owner):
+        return self.job_manager.heartbeat(job_ids, owner)
+
+    def done(self, job_id, owner):
+        pass
+
+    def requeue_stale(self, lease_seconds, max_attempts, is_owner_dead=None):
+        return self.job_manager.requeue_stale_jobs(
+            lease_seconds, max_attempts, is_owner_dead=is_owner_dead)
+
+
+class SQLiteJobQueue:
+    """
+    Queue in a SQLite file so several processes/nodes can pull from it.
+    Job records (status, progress, inputs) stay in the JobManager.
+    """
+
+    def __init__(self, path, job_manager, scheduler=None):
+        self.path = path
+        self.job_manager = job_manager
+        self.scheduler = scheduler or FairScheduler()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS build_queue ('
+                ' job_id TEXT PRIMARY KEY,'
+                ' state TEXT NOT NULL,'
+                ' owner TEXT,'
+                ' attempts INTEGER NOT NULL DEFAULT 0,'
+                ' enqueued_at REAL NOT NULL,'
+                ' heartbeat_at REAL,'
+                ' key_id TEXT,'
+                ' priority_weight REAL NOT NULL DEFAULT 1.0)')
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(build_queue)')}
+            if 'key_id' not in columns:
+                conn.execute('ALTER TABLE build_queue ADD COLUMN key_id TEXT')
+                conn.execute('ALTER TABLE build_queue ADD COLUMN'
+                             ' priority_weight REAL NOT NULL DEFAULT 1.0')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_build_queue_state'
+                         ' ON build_queue (state, enqueued_at)')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def enqueue(self, job):
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'INSERT OR IGNORE INTO build_queue'
+                ' (job_id, state, attempts, enqueued_at, key_id, priority_weight)'
+                ' VALUES (?, ?, ?, ?, ?, ?)',
+                (job['job_id'], 'pending', job.get('attempts', 0), time.time(),
+                 job.get('key_id'), job.get('priority_weight', 1.0)))
+
+    def reconcile(self):
+        """
+        Enqueue pending jobs that have no queue entry, e.g. after a crash
+        between creating the job and enqueueing it
+
+        Returns:
+            job_ids enqueued
+        """
+        with closing(self._connect()) as conn:
+            queued = {job_id for job_id, in conn.execute('SELECT job_id FROM build_queue')}
+        missing = [job for job in self.job_manager.iter_jobs(('pending',))
+                   if job['job_id'] not in queued and job.get('inputs')
+                   and not job.get('leader_job_id')]
+        for job in sorted(missing, key=lambda job: job['created_at']):
+            self.enqueue(job)
+        return [job['job_id'] for job in missing]
+
+    def pending(self):
+        """Queued jobs (job_id, key_id, priority_weight), oldest first"""
+        with closing(self._connect()) as conn:
+            return self._pending(conn)
+
+    def _pending(self, conn):
+        rows = conn.execute(
+            "SELECT job_id, key_id, priority_weight, attempts FROM build_queue"
+            " WHERE state = 'pending' ORDER BY enqueued_at").fetchall()
+        return [{'job_id': job_id, 'key_id': key_id,
+                 'priority_weight': weight, 'attempts': attempts}
+                for job_id, key_id, weight, attempts in rows]
+
+    def claim(self, owner):
+        conn = self._connect()
+        try:
+            while True:
+                conn.execute('BEGIN IMMEDIATE')
+                pending = self._pending(conn)
+                if not pending:
+                    conn.execute('COMMIT')
+                    return None
+                entry = self.scheduler.select(pending)
+                job_id, attempts = entry['job_id'], entry['attempts']
+                conn.execute(
+                    "UPDATE build_queue SET state = 'processing', owner = ?,"
+                    ' attempts = ?, heartbeat_at = ? WHERE job_id = ?',
+                    (owner, attempts + 1, time.time(), job_id))
+                conn.execute('COMMIT')
+
+                job = self.job_manager.update_job(
+                    job_id,
+                    expect_status=('pending',),
+                    status='processing',
+                    message='Build started...',
+                    attempts=attempts + 1,
+                    lease_owner=owner,
+                    started_at=datetime.now().isoformat()
+                )
+                if job and job.get('inputs'):
+                    return job
+                # Record purged or not rebuildable: drop the entry and keep looking
+                conn.execute('DELETE FROM build_queue WHERE job_id = ?', (job_id,))
+                if job:
+                    self.job_manager.set_failed(job_id, 'Build inputs are missing')
+        finally:
+            conn.close()
+
+    def heartbeat(self, job_ids, owner):
+        job_ids = list(job_ids)
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                'UPDATE build_queue SET heartbeat_at = ? WHERE owner = ? AND job_id IN (%s)'
+                % ','.join('?' * len(job_ids)),
+                [time.time(), owner] + job_ids)
+            return cursor.rowcount
+
+    def done(self, job_id, owner):
+        with closing(self._connect()) as conn:
+            conn.execute('DELETE FROM build_queue WHERE job_id = ? AND owner = ?',
+                         (job_id, owner))
+
+    def requeue_stale(self, lease_seconds, max_attempts, is_owner_dead=None):
+        """
+        Requeue (or fail) entries whose lease expired or whose owner is gone
+
+        Job records are only changed while they are still processing under
+        the entry's lease, so a build that completed before its worker died
+        (and never called done) is left completed and its entry is dropped.
+        """
+        cutoff = time.time() - lease_seconds
+        requeued, failed = [], []
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            rows = conn.execute(
+                "SELECT job_id, owner, attempts, heartbeat_at FROM build_queue"
+                " WHERE state = 'processing'").fetchall()
+            for job_id, owner, attempts, heartbeat_at in rows:
+                stale = (heartbeat_at or 0) < cutoff
+                if not stale and not (owner and is_owner_dead and is_owner_dead(owner)):
+                    continue
+                lease = (owner, attempts)
+                if attempts >= max_attempts:
+                    job = self.job_manager.set_failed(
+                        job_id, f'Build was interrupted {max_attempts} time(s) and will not be retried',
+                        lease=lease)
+                else:
+                    job = self.job_manager.update_job(
+                        job_id, lease=lease, status='pending', progress=0, lease_owner=None,
+                        message='Build interrupted, requeued')
+                if job and job['status'] == 'pending':
+                    conn.execute(
+                        "UPDATE build_queue SET state = 'pending', owner = NULL,"
+                        ' heartbeat_at = NULL WHERE job_id = ?', (job_id,))
+                    requeued.append(job_id)
+                else:
+                    # Failed now, or already finished under that lease
+                    conn.execute('DELETE FROM build_queue WHERE job_id = ?', (job_id,))
+                    if job:
+                        failed.append(job_id)
+            conn.execute('COMMIT')
+        finally:
+            conn.close()
+        return requeued, failed
+
+
+def create_job_queue(spec, job_manager):
+    """
+    Build a queue backend from a spec string
+
+    Supported: "local" (job store) or sqlite:///path/to/queue.sqlite3
+    """
+    if not spec or spec == 'local':
+        return JobStoreQueue(job_manager)
+    if spec.startswith('sqlite://'):
+        return SQLiteJobQueue(spec[len('sqlite://'):], job_manager)
+    raise ValueError(f'Unknown build queue backend: {spec}')
+
+
+class BuildQueue:
+    def __init__(self, queue, handler: Callable[[Dict], None],
+                 workers: Optional[int] = None,
+                 lease_seconds: Optional[int] = None,
+                 max_attempts: Optional[int] = None,
+                 poll_interval: float = 5.0):
+        self.queue = queue
+        self.handler = handler
+        self.workers = workers if workers is not None else \
+            int(os.environ.get('BUILD_WORKERS', '1'))
+        self.lease_seconds = lease_seconds if lease_seconds is not None else \
+            int(os.environ.get('BUILD_LEASE_SECONDS', '120'))
+        self.max_attempts = max_attempts if max_attempts is not None else \
+            int(os.environ.get('BUILD_MAX_ATTEMPTS', '3'))
+        self.poll_interval = poll_interval
+
+        self.owner = process_owner_id()
+        self._active: Set[str] = set()
+        self._active_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def is_owner_dead(self, owner) -> bool:
+        """True for owners on this host whose process is gone or was replaced"""
+        try:
+            host, pid, token = owner.rsplit(':', 2)
+            pid = int(pid)
+        except ValueError:
+            return False
+        if host != socket.gethostname() or owner == self.owner:
+            return False
+        if pid == os.getpid():
+            # Same pid, different boot token: a previous incarnation (containers reuse pids)
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except (PermissionError, OSError):
+            return False
+        return False
+
+    def recover(self):
+        """Requeue jobs orphaned by a crash or restart"""
+        requeued, failed = self.queue.requeue_stale(
+            self.lease_seconds, self.max_attempts, is_owner_dead=self.is_owner_dead)
+        for job_id in requeued:
+            print(f"Build queue: requeued interrupted job {job_id}")
+        for job_id in failed:
+            print(f"Build queue: gave up on interrupted job {job_id}")
+        if requeued:
+            self.notify()
+        return requeued, failed
+
+    def submit(self, job):
+        """Queue a job that was just stored as pending and wake a worker"""
+        self.queue.enqueue(job)
+        self.notify()
+
+    def notify(self):
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def depth_by_key(self):
+        """Pending job count per API key"""
+        return queue_depth_by_key(self.queue.pending())
+
+    def active_jobs(self):
+        with self._active_lock:
+            return set(self._active)
+
+    def _worker_loop(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.claim(self.owner)
+            except Exception as e:
+                print(f"Build queue: claim failed: {e}")
+                job = None
+
+            if not job:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            with self._active_lock:
+                self._active.add(job['job_id'])
+            try:
+                self.handler(job)
+            except Exception as e:
+                print(f"Build queue: handler error for job {job['job_id']}: {e}")
+            finally:
+                with self._active_lock:
+                    self._active.discard(job['job_id'])
+                self.queue.done(job['job_id'], self.owner)
+
+    def _lease_loop(self):
+        # Heartbeats well inside the lease; recovery of other owners' jobs on the same cadence
+        interval = max(1.0, self.lease_seconds / 3)
+        while not self._stop.wait(interval):
+            try:
+                active = self.active_jobs()
+                if active:
+                    self.queue.heartbeat(active, self.owner)
+                self.recover()
+            except Exception as e:
+                print(f"Build queue: lease maintenance failed: {e}")
+
+    def start(self):
+        """
+        Enqueue pending jobs the queue lost, recover interrupted jobs, then
+        start workers and the lease thread.
+        With workers=0 (API-only node) just the lease/recovery thread runs.
+        """
+        if self._threads:
+            return
+        self._stop.clear()
+        for job_id in self.queue.reconcile():
+            print(f"Build queue: enqueued pending job {job_id} missing from the queue")
+        self.recover()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker_loop,
+                                      name=f'build-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        lease_thread = threading.Thread(target=self._lease_loop,
+                                        name='build-lease', daemon=True)
+        lease_thread.start()
+        self._threads.append(lease_thread)
+
+    def stop(self):
+        self._stop.set()
+        self.notify()
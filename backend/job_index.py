@@ -0,0 +1,195 @@
+"""
+Job Listing Index
+build_jobs.json stays the source of truth; this SQLite file next to it holds
+one row per job (key_id, created_at, status, normalized app name, APK hash
+and a small summary) with indexes on (key_id, created_at), status and
+(key_id, app name) for builds with an APK, so listing a key's jobs or an
+app's earlier builds reads a page of rows instead of parsing the whole job
+store.
+
+JobManager updates the index inside its file lock whenever it saves the job
+store, with only the jobs that changed. The index records which version of
+build_jobs.json it reflects (inode, mtime and size); if that doesn't match,
+for example after a crash between the two writes or a store written by an
+older version, it is rebuilt from the job store.
+"""
+import os
+import json
+import sqlite3
+from contextlib import closing
+
+# Job fields returned by listings
+SUMMARY_FIELDS = ('job_id', 'app_name', 'url', 'status', 'progress', 'message', 'error',
+                  'created_at', 'updated_at', 'completed_at', 'apk_sha256', 'leader_job_id')
+# Bumped when the table layout changes; an index with another schema is rebuilt
+SCHEMA_VERSION = '2'
+
+
+def app_key(app_name):
+    """Same normalization as apk_delta.app_identity (SQLite's lower() is ASCII-only)"""
+    return app_name.strip().lower() if app_name else app_name
+
+
+def store_version(path):
+    """Identity of the current version of a file written by os.replace"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return f'{st.st_ino}:{st.st_mtime_ns}:{st.st_size}'
+
+
+class JobIndex:
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS job_index_meta ('
+                         ' name TEXT PRIMARY KEY, value TEXT)')
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT value FROM job_index_meta WHERE name = 'schema'").fetchone()
+            if not row or row[0] != SCHEMA_VERSION:
+                # The index is derived data: drop an older layout and let the
+                # next use rebuild it from the job store
+                conn.execute('DROP TABLE IF EXISTS job_index')
+                conn.execute("DELETE FROM job_index_meta WHERE name = 'store_version'")
+                conn.execute("INSERT OR REPLACE INTO job_index_meta (name, value) VALUES ('schema', ?)",
+                             (SCHEMA_VERSION,))
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS job_index ('
+                ' job_id TEXT PRIMARY KEY,'
+                ' key_id TEXT,'
+                ' created_at TEXT NOT NULL,'
+                ' status TEXT NOT NULL,'
+                ' app_key TEXT,'
+                ' apk_sha256 TEXT,'
+                ' summary TEXT NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_index_key_created'
+                         ' ON job_index (key_id, created_at, job_id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_index_status'
+                         ' ON job_index (status)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_job_index_app'
+                         ' ON job_index (key_id, app_key, created_at, job_id)'
+                         ' WHERE apk_sha256 IS NOT NULL')
+            conn.execute('COMMIT')
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    @staticmethod
+    def _row(job):
+        summary = {field: job.get(field) for field in SUMMARY_FIELDS}
+        return (job['job_id'], job.get('key_id'), job['created_at'], job['status'],
+                app_key(job.get('app_name')), job.get('apk_sha256'), json.dumps(summary))
+
+    def _version(self, conn):
+        row = conn.execute("SELECT value FROM job_index_meta WHERE name = 'store_version'").fetchone()
+        return row[0] if row else None
+
+    def _set_version(self, conn, version):
+        conn.execute("INSERT OR REPLACE INTO job_index_meta (name, value) VALUES ('store_version', ?)",
+                     (version,))
+
+    def is_current(self, version) -> bool:
+        """True if the index reflects this version of the job store"""
+        with closing(self._connect()) as conn:
+            return version is not None and self._version(conn) == version
+
+    def rebuild(self, jobs, version):
+        """Replace the whole index with jobs (a job store dict)"""
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM job_index')
+            conn.executemany('INSERT INTO job_index VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (self._row(job) for job in jobs.values()))
+            self._set_version(conn, version)
+            conn.execute('COMMIT')
+
+    def apply(self, jobs, changed, removed, base_version, version):
+        """
+        Apply one job store write
+
+        Args:
+            jobs: The job store as written
+            changed: job_ids created or modified by the write
+            removed: job_ids the write deleted
+            base_version: Store version the write started from
+            version: Store version after the write
+
+        Falls back to a rebuild if the index wasn't at base_version.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if self._version(conn) != base_version:
+                conn.execute('ROLLBACK')
+                self.rebuild(jobs, version)
+                return
+            conn.executemany('INSERT OR REPLACE INTO job_index VALUES (?, ?, ?, ?, ?, ?, ?)',
+                             (self._row(jobs[job_id]) for job_id in changed))
+            conn.executemany('DELETE FROM job_index WHERE job_id = ?',
+                             ((job_id,) for job_id in removed))
+            self._set_version(conn, version)
+            conn.execute('COMMIT')
+
+    def query(self, key_id, statuses=None, created_after=None, created_before=None,
+              after=None, limit=50):
+        """
+        A key's jobs, newest first
+
+        Args:
+            key_id: API key whose jobs to list
+            statuses: Only these statuses (default: all)
+            created_after / created_before: ISO timestamps bounding created_at
+                                            (inclusive / exclusive)
+            after: (created_at, job_id) of the last job of the previous page
+            limit: Page size
+
+        Returns:
+            Job summaries
+        """
+        clauses, params = ['key_id = ?'], [key_id]
+        if statuses:
+            clauses.append('status IN (%s)' % ','.join('?' * len(statuses)))
+            params.extend(statuses)
+        if created_after:
+            clauses.append('created_at >= ?')
+            params.append(created_after)
+        if created_before:
+            clauses.append('created_at < ?')
+            params.append(created_before)
+        if after:
+            clauses.append('(created_at, job_id) < (?, ?)')
+            params.extend(after)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT summary FROM job_index WHERE %s'
+                ' ORDER BY created_at DESC, job_id DESC LIMIT ?' % ' AND '.join(clauses),
+                params + [limit]).fetchall()
+        return [json.loads(summary) for summary, in rows]
+
+    def app_builds(self, key_id, app_name, apk_sha256=None, limit=20):
+        """
+        Builds of one app (same key, app name compared case-insensitively)
+        that produced an APK, newest first
+
+        Args:
+            key_id: API key of the app (None for jobs submitted without one)
+            app_name: App name
+            apk_sha256: Only builds of this APK
+            limit: Maximum number of builds
+
+        Returns:
+            Job summaries
+        """
+        clauses = ['key_id IS ?', 'app_key = ?', 'apk_sha256 IS NOT NULL']
+        params = [key_id, app_key(app_name)]
+        if apk_sha256:
+            clauses.append('apk_sha256 = ?')
+            params.append(apk_sha256)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                'SELECT summary FROM job_index WHERE %s'
+                ' ORDER BY created_at DESC, job_id DESC LIMIT ?' % ' AND '.join(clauses),
+                params + [limit]).fetchall()
+        return [json.loads(summary) for summary, in rows]
@@ -1,119 +1,548 @@
 import os
 import json
 import time
+from contextlib import contextmanager
 from datetime import datetime
-from threading import Thread
+from threading import RLock, get_ident
+
+from backend.job_index import JobIndex, store_version
+from common.tracing import tracer
+
+try:
+    import fcntl
+except ImportError:  # Windows: thread lock only
+    fcntl = None
+
+# Build state a leader shares with the jobs coalesced into it
+SHARED_BUILD_FIELDS = ('status', 'progress', 'message', 'error',
+                       'apk_path', 'apk_sha256', 'completed_at')
+
+# Statuses a job never leaves on its own
+FINISHED_STATUSES = ('completed', 'failed', 'expired')
+
+# Finished statuses that trigger the job's completion webhook
+WEBHOOK_STATUSES = ('completed', 'failed')
+
+JOB_STATUSES = ('pending', 'processing') + FINISHED_STATUSES
 
 class JobManager:
     def __init__(self, db_dir='db'):
         self.db_dir = db_dir
         self.jobs_file = os.path.join(db_dir, 'build_jobs.json')
         os.makedirs(db_dir, exist_ok=True)
+        # Build threads, the storage reaper and standalone build workers
+        # (other processes sharing db_dir) update jobs concurrently
+        self._lock = RLock()
+        self._lock_depth = 0
+        self._lock_owner = None
+        self._lock_file = None
+        self._listeners = []
+        # Store version and updated_at per job as last loaded under the lock,
+        # so a save knows which jobs it changed
+        self._loaded = None
+        # Per-key listing index (build_jobs.index.sqlite3)
+        self.index = JobIndex(os.path.join(db_dir, 'build_jobs.index.sqlite3'))
         
         # Initialize jobs file if doesn't exist
         if not os.path.exists(self.jobs_file):
-            self._save_jobs({})
+            with self._locked():
+                self._save_jobs({})
+    
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the jobs file across threads and processes"""
+        with tracer.child_span('job_store.lock_wait'):
+            self._lock.acquire()
+        try:
+            self._lock_depth += 1
+            self._lock_owner = get_ident()
+            try:
+                if self._lock_depth == 1 and fcntl:
+                    if self._lock_file is None:
+                        self._lock_file = open(f'{self.jobs_file}.lock', 'a')
+                    with tracer.child_span('job_store.file_lock_wait'):
+                        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+                yield
+            finally:
+                if self._lock_depth == 1:
+                    if fcntl and self._lock_file:
+                        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+                    self._lock_owner = None
+                    self._loaded = None
+                self._lock_depth -= 1
+        finally:
+            self._lock.release()
+    
+    def add_listener(self, callback):
+        """
+        Register callback(job), called in this process once per job when it
+        first reaches a finished status (not when e.g. a completed job expires)
+        """
+        self._listeners.append(callback)
+    
+    def _notify_finished(self, jobs, before):
+        """Fire listeners for jobs that moved from an active status into a finished one"""
+        finished = [dict(jobs[job_id]) for job_id, status in before.items()
+                    if job_id in jobs and status not in FINISHED_STATUSES
+                    and jobs[job_id]['status'] in FINISHED_STATUSES]
+        for job in finished:
+            for callback in self._listeners:
+                try:
+                    callback(job)
+                except Exception as e:
+                    print(f"Job listener error for job {job['job_id']}: {e}")
+    
+    def _statuses(self, jobs, job):
+        """Current status of a job and its followers"""
+        job_ids = [job['job_id']] + list(job.get('followers') or [])
+        return {job_id: jobs[job_id]['status'] for job_id in job_ids if job_id in jobs}
     
     def _load_jobs(self):
         """Load jobs from JSON file"""
-        try:
-            with open(self.jobs_file, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
+        with tracer.child_span('job_store.load'):
+            version = store_version(self.jobs_file)
+            try:
+                with open(self.jobs_file, 'r') as f:
+                    jobs = json.load(f)
+            except:
+                return {}
+            if self._lock_owner == get_ident():
+                self._loaded = (version, {job_id: job.get('updated_at') for job_id, job in jobs.items()})
+            return jobs
     
     def _save_jobs(self, jobs):
-        """Save jobs to JSON file"""
-        with open(self.jobs_file, 'w') as f:
-            json.dump(jobs, f, indent=2)
+        """Save jobs to JSON file (atomically, so readers never see a partial file)"""
+        with tracer.child_span('job_store.save', jobs=len(jobs)):
+            tmp_file = f'{self.jobs_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(jobs, f, indent=2)
+            os.replace(tmp_file, self.jobs_file)
+        self._update_index(jobs)
     
-    def create_job(self, job_id, app_name, url, has_icon=False):
-        """Create a new build job"""
-        jobs = self._load_jobs()
+    def _update_index(self, jobs):
+        """Bring the listing index up to date with a save (jobs changed since the last load)"""
+        loaded, self._loaded = self._loaded, None
+        version = store_version(self.jobs_file)
+        try:
+            with tracer.child_span('job_store.index'):
+                if loaded is None:
+                    self.index.rebuild(jobs, version)
+                    return
+                base_version, updated = loaded
+                changed = [job_id for job_id, job in jobs.items()
+                           if job_id not in updated or updated[job_id] != job.get('updated_at')]
+                removed = [job_id for job_id in updated if job_id not in jobs]
+                self.index.apply(jobs, changed, removed, base_version, version)
+        except Exception as e:
+            # The index is rebuilt on its next use
+            print(f"Job index update failed: {e}")
+    
+    def list_jobs(self, key_id, statuses=None, created_after=None, created_before=None,
+                  after=None, limit=50):
+        """
+        Page through an API key's jobs, newest first
         
-        jobs[job_id] = {
-            'job_id': job_id,
-            'app_name': app_name,
-            'url': url,
-            'has_icon': has_icon,
-            'status': 'pending',
-            'progress': 0,
-            'message': 'Job created, waiting to start...',
-            'apk_path': None,
-            'error': None,
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat(),
-            'completed_at': None
-        }
-        
-        self._save_jobs(jobs)
-        return jobs[job_id]
+        Args:
+            key_id: API key whose jobs to list
+            statuses: Only jobs in these statuses
+            created_after / created_before: ISO timestamps bounding created_at
+                                            (inclusive / exclusive)
+            after: (created_at, job_id) of the last job of the previous page
+            limit: Page size
+        
+        Returns:
+            Tuple of (job summaries, (created_at, job_id) to continue after or None)
+        """
+        self._ensure_index()
+        jobs = self.index.query(key_id, statuses, created_after, created_before, after, limit + 1)
+        if len(jobs) <= limit:
+            return jobs, None
+        last = jobs[limit - 1]
+        return jobs[:limit], (last['created_at'], last['job_id'])
+    
+    def app_builds(self, key_id, app_name, apk_sha256=None, limit=20):
+        """
+        Summaries of earlier builds of an app (see apk_delta.app_identity) that
+        produced an APK, newest first; optionally only those of one APK hash
+        """
+        self._ensure_index()
+        return self.index.app_builds(key_id, app_name, apk_sha256, limit)
+    
+    def _ensure_index(self):
+        """Rebuild the listing index if it doesn't reflect the current job store"""
+        if not self.index.is_current(store_version(self.jobs_file)):
+            with self._locked():
+                jobs = self._load_jobs()
+                self._loaded = None
+                version = store_version(self.jobs_file)
+                if not self.index.is_current(version):
+                    self.index.rebuild(jobs, version)
+    
+    def create_job(self, job_id, app_name, url, has_icon=False, inputs=None, fingerprint=None,
+                   key_id=None, priority_weight=1.0, traceparent=None, webhook=None):
+        """
+        Create a new build job
+        
+        key_id links the job to the API key that submitted it; priority_weight
+        is that key's share of build capacity under fair scheduling
+        
+        inputs holds everything needed to (re)run the build after a restart:
+        app_name, url, icon_sha256 (uploaded icon in the blob store),
+        app_names (per-locale names) and base_version
+        
+        If fingerprint matches a build that is still pending or processing, the
+        new job is attached to it (leader_job_id) instead of being queued, and
+        completes from the leader's result
+        
+        traceparent (W3C) lets the worker that runs the build continue the
+        submitting request's trace
+        
+        webhook ({'url', 'download_url', 'status_url'}) is POSTed to when the
+        job completes or fails; its delivery state is kept on the job
+        """
+        with self._locked():
+            jobs = self._load_jobs()
+            
+            leader = self._leader_for(jobs, fingerprint)
+            
+            jobs[job_id] = {
+                'job_id': job_id,
+                'key_id': key_id,
+                'priority_weight': priority_weight,
+                'app_name': app_name,
+                'url': url,
+                'has_icon': has_icon,
+                'status': 'pending',
+                'progress': 0,
+                'message': 'Job created, waiting to start...',
+                'apk_path': None,
+                'error': None,
+                'created_at': datetime.now().isoformat(),
+                'updated_at': datetime.now().isoformat(),
+                'completed_at': None,
+                'inputs': inputs,
+                'attempts': 0,
+                'lease_owner': None,
+                'heartbeat_at': None,
+                'fingerprint': fingerprint,
+                'leader_job_id': None,
+                'followers': [],
+                'traceparent': traceparent,
+                'webhook': dict(webhook, status='waiting', attempts=0) if webhook else None
+            }
+            
+            if leader:
+                leader.setdefault('followers', []).append(job_id)
+                jobs[job_id].update(
+                    leader_job_id=leader['job_id'],
+                    status=leader['status'],
+                    progress=leader['progress'],
+                    message=leader['message']
+                )
+            
+            self._save_jobs(jobs)
+            return jobs[job_id]
+    
+    @staticmethod
+    def _leader_for(jobs, fingerprint):
+        """The pending or processing build a job with this fingerprint would join"""
+        if not fingerprint:
+            return None
+        return next((job for job in jobs.values()
+                     if job.get('fingerprint') == fingerprint
+                     and job['status'] in ('pending', 'processing')
+                     and not job.get('leader_job_id')), None)
+    
+    def build_in_flight(self, fingerprint):
+        """The build a new job with this fingerprint would join right now, or None"""
+        return self._leader_for(self._load_jobs(), fingerprint)
     
     def get_job(self, job_id):
         """Get job details"""
         jobs = self._load_jobs()
         return jobs.get(job_id)
     
-    def update_job(self, job_id, **updates):
-        """Update job details"""
-        jobs = self._load_jobs()
+    def all_jobs(self):
+        """Every job by job_id, from one consistent read of the store"""
+        return self._load_jobs()
+    
+    def iter_jobs(self, statuses=None):
+        """Jobs in the given statuses (default: all), from one consistent read"""
+        for job in self._load_jobs().values():
+            if statuses is None or job['status'] in statuses:
+                yield job
+    
+    @staticmethod
+    def lease_of(job):
+        """
+        The lease a claimed job runs under: (lease_owner, attempts). The
+        attempt number tells apart runs of one owner after a requeue.
+        """
+        return (job.get('lease_owner'), job.get('attempts'))
+    
+    def update_job(self, job_id, lease=None, expect_status=None, **updates):
+        """
+        Update job details (status updates also apply to attached followers)
         
-        if job_id in jobs:
+        With lease (see lease_of), only update a job that is still processing
+        under that lease; with expect_status, only a job in one of those
+        statuses. Returns None if the job was not updated.
+        """
+        with self._locked():
+            jobs = self._load_jobs()
+            
+            if job_id not in jobs:
+                return None
+            if lease is not None and (jobs[job_id]['status'] != 'processing'
+                                      or self.lease_of(jobs[job_id]) != tuple(lease)):
+                return None
+            if expect_status is not None and jobs[job_id]['status'] not in expect_status:
+                return None
+            before = self._statuses(jobs, jobs[job_id])
             jobs[job_id].update(updates)
             jobs[job_id]['updated_at'] = datetime.now().isoformat()
+            self._propagate_to_followers(jobs, jobs[job_id], updates)
             self._save_jobs(jobs)
-            return jobs[job_id]
-        return None
+        
+        self._notify_finished(jobs, before)
+        return jobs[job_id]
+    
+    def _propagate_to_followers(self, jobs, leader, updates):
+        """Mirror a leader's build state onto the jobs coalesced into it"""
+        shared = {key: value for key, value in updates.items() if key in SHARED_BUILD_FIELDS}
+        if not shared:
+            return
+        for follower_id in leader.get('followers') or []:
+            follower = jobs.get(follower_id)
+            if follower and follower['status'] in ('pending', 'processing'):
+                follower.update(shared)
+                follower['updated_at'] = leader['updated_at']
+    
+    def claim_next_job(self, owner, select=None):
+        """
+        Atomically take a pending job and lease it to owner
+        
+        Args:
+            owner: Lease owner id
+            select: Optional callable(pending jobs, oldest first) -> job to run;
+                    defaults to the oldest job
+        
+        Returns:
+            The claimed job, or None if nothing is runnable
+        """
+        with self._locked():
+            jobs = self._load_jobs()
+            pending = sorted((job for job in jobs.values()
+                              if job['status'] == 'pending' and job.get('inputs')
+                              and not job.get('leader_job_id')),
+                             key=lambda j: j['created_at'])
+            if not pending:
+                return None
+            
+            job = select(pending) if select else pending[0]
+            now = datetime.now().isoformat()
+            job.update(
+                status='processing',
+                message='Build started...',
+                attempts=job.get('attempts', 0) + 1,
+                lease_owner=owner,
+                heartbeat_at=now,
+                started_at=now,
+                updated_at=now
+            )
+            self._save_jobs(jobs)
+            return job
     
-    def set_processing(self, job_id, message='Processing...'):
+    def heartbeat(self, job_ids, owner):
+        """Renew the lease on jobs still owned by owner"""
+        with self._locked():
+            jobs = self._load_jobs()
+            now = datetime.now().isoformat()
+            renewed = 0
+            for job_id in job_ids:
+                job = jobs.get(job_id)
+                if job and job['status'] == 'processing' and job.get('lease_owner') == owner:
+                    job['heartbeat_at'] = now
+                    renewed += 1
+            if renewed:
+                self._save_jobs(jobs)
+            return renewed
+    
+    def requeue_stale_jobs(self, lease_seconds, max_attempts, is_owner_dead=None):
+        """
+        Requeue processing jobs whose lease expired or whose owner is gone
+        
+        Args:
+            lease_seconds: Heartbeat age after which a lease is considered lost
+            max_attempts: Jobs that already ran this many times are failed instead
+            is_owner_dead: Optional callable(owner) for instant detection of
+                           owners known to be dead (e.g. a previous process)
+        
+        Returns:
+            Tuple of (requeued job_ids, failed job_ids)
+        """
+        with self._locked():
+            jobs = self._load_jobs()
+            cutoff = time.time() - lease_seconds
+            now = datetime.now().isoformat()
+            requeued, failed = [], []
+            before = {job_id: job['status'] for job_id, job in jobs.items()}
+            
+            for job_id, job in jobs.items():
+                if job['status'] == 'pending' and not job.get('inputs'):
+                    # Created before inputs were persisted, cannot be rebuilt
+                    job.update(status='failed', message='Build failed',
+                               error='Build was interrupted and cannot be resumed',
+                               updated_at=now, completed_at=now)
+                    failed.append(job_id)
+                    continue
+                if job['status'] != 'processing' or job.get('leader_job_id'):
+                    continue
+                
+                owner = job.get('lease_owner')
+                beat = job.get('heartbeat_at') or job['updated_at']
+                stale = datetime.fromisoformat(beat).timestamp() < cutoff
+                if not stale and not (owner and is_owner_dead and is_owner_dead(owner)):
+                    continue
+                
+                if not job.get('inputs') or job.get('attempts', 0) >= max_attempts:
+                    updates = dict(status='failed', message='Build failed',
+                                   error=f"Build was interrupted {job.get('attempts', 0)} time(s) and will not be retried",
+                                   completed_at=now)
+                    failed.append(job_id)
+                else:
+                    updates = dict(status='pending', progress=0,
+                                   message=f"Build interrupted, requeued (attempt {job.get('attempts', 0) + 1} of {max_attempts})")
+                    requeued.append(job_id)
+                job.update(updates, lease_owner=None, heartbeat_at=None, updated_at=now)
+                self._propagate_to_followers(jobs, job, updates)
+            
+            if requeued or failed:
+                self._save_jobs(jobs)
+        
+        self._notify_finished(jobs, before)
+        return requeued, failed
+    
+    def set_processing(self, job_id, message='Processing...', lease=None):
         """Set job status to processing"""
         return self.update_job(
             job_id,
+            lease=lease,
             status='processing',
             message=message,
             progress=10
         )
     
-    def set_progress(self, job_id, progress, message):
+    def set_progress(self, job_id, progress, message, lease=None):
         """Update job progress"""
         return self.update_job(
             job_id,
+            lease=lease,
             progress=progress,
             message=message
         )
     
-    def set_completed(self, job_id, apk_path):
-        """Set job as completed"""
+    def set_completed(self, job_id, apk_sha256, stage_timings=None, workspace=None, lease=None):
+        """
+        Set job as completed
+        
+        The APK is referenced by apk_sha256, its blob in the artifact store
+        (apk_path is only set on jobs completed before the blob store)
+        stage_timings: seconds per build stage, workspace: 'ram' or 'disk'
+        lease: only complete the job if this run still holds it (see update_job)
+        """
         return self.update_job(
             job_id,
+            lease=lease,
             status='completed',
             progress=100,
             message='APK build completed successfully!',
-            apk_path=apk_path,
+            apk_sha256=apk_sha256,
+            stage_timings=stage_timings,
+            workspace=workspace,
             completed_at=datetime.now().isoformat()
         )
     
-    def set_failed(self, job_id, error_message):
+    def set_failed(self, job_id, error_message, lease=None):
         """Set job as failed"""
         return self.update_job(
             job_id,
+            lease=lease,
             status='failed',
             message='Build failed',
             error=error_message,
             completed_at=datetime.now().isoformat()
         )
     
-    def cleanup_old_jobs(self, days=7):
-        """Remove jobs older than specified days"""
-        jobs = self._load_jobs()
-        current_time = time.time()
-        cutoff_time = current_time - (days * 24 * 60 * 60)
+    def claim_webhooks(self, owner, lease_seconds, limit, job_ids=None):
+        """
+        Lease completion webhooks that are due for delivery to owner
+        
+        A webhook is due once its job completed or failed and it is waiting,
+        its retry time has come, or another owner's lease on it expired.
         
-        jobs_to_keep = {}
-        for job_id, job in jobs.items():
-            job_time = datetime.fromisoformat(job['created_at']).timestamp()
-            if job_time > cutoff_time:
-                jobs_to_keep[job_id] = job
+        Args:
+            owner: Lease owner id
+            lease_seconds: How long the delivery attempt may take before
+                           another process may take it over
+            limit: Most deliveries to claim
+            job_ids: Only consider these jobs (default: all)
         
-        self._save_jobs(jobs_to_keep)
-        return len(jobs) - len(jobs_to_keep)
+        Returns:
+            The claimed jobs
+        """
+        with self._locked():
+            jobs = self._load_jobs()
+            now = datetime.now()
+            claimed = []
+            candidates = [jobs[job_id] for job_id in job_ids if job_id in jobs] \
+                if job_ids is not None else jobs.values()
+            for job in candidates:
+                if len(claimed) >= limit:
+                    break
+                webhook = job.get('webhook')
+                if not webhook or job['status'] not in WEBHOOK_STATUSES:
+                    continue
+                if webhook['status'] == 'retrying':
+                    due = datetime.fromisoformat(webhook['next_attempt_at']) <= now
+                elif webhook['status'] == 'delivering':
+                    due = datetime.fromisoformat(webhook['lease_until']) <= now
+                else:
+                    due = webhook['status'] == 'waiting'
+                if not due:
+                    continue
+                webhook.update(status='delivering', owner=owner,
+                               lease_until=datetime.fromtimestamp(now.timestamp() + lease_seconds).isoformat())
+                claimed.append(dict(job))
+            if claimed:
+                self._save_jobs(jobs)
+            return claimed
+    
+    def set_webhook_state(self, job_id, owner, **state):
+        """Record a delivery attempt's outcome, if owner still holds the lease"""
+        with self._locked():
+            jobs = self._load_jobs()
+            webhook = (jobs.get(job_id) or {}).get('webhook')
+            if not webhook or webhook.get('owner') != owner:
+                return None
+            webhook.update(state)
+            if webhook['status'] != 'delivering':
+                webhook.update(owner=None, lease_until=None)
+            self._save_jobs(jobs)
+            return webhook
+    
+    def cleanup_old_jobs(self, days=7):
+        """Remove jobs older than specified days (their files are left to the storage reaper)"""
+        with self._locked():
+            jobs = self._load_jobs()
+            current_time = time.time()
+            cutoff_time = current_time - (days * 24 * 60 * 60)
+            
+            jobs_to_keep = {}
+            for job_id, job in jobs.items():
+                job_time = datetime.fromisoformat(job['created_at']).timestamp()
+                if job_time > cutoff_time:
+                    jobs_to_keep[job_id] = job
+            
+            self._save_jobs(jobs_to_keep)
+            return len(jobs) - len(jobs_to_keep)
@@ -0,0 +1,41 @@
+"""
+Lazily built per-process singletons
+Importing backend.app must not touch disk or start threads: gunicorn
+--preload imports it once in the master and forks workers from it, and
+threads, locks and open files do not survive a fork. A ProcessLocal stands
+in for a module-level object and builds it on first use in each process.
+"""
+import os
+import threading
+
+
+class ProcessLocal:
+    """
+    Proxy to factory(), called on first use in each process.
+    Attribute access is forwarded; call the proxy to get the object itself.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._instance = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # A lock held by another thread during fork would never be released
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        """The object for this process, built if needed"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._instance = self._factory()
+                    self._pid = pid
+        return self._instance
+
+    def __getattr__(self, name):
+        return getattr(self(), name)
@@ -0,0 +1,211 @@
+"""
+On-demand profiling
+An admin can profile a single request or a single build with cProfile; the
+profile is stored under an ID (req-<hex> or job-<job_id>) and downloaded
+later as a pstats file or a text report. A continuous low-rate stack sampler
+can also run in every API and worker process, each periodically writing its
+aggregated stacks in the folded format flame graph tools read
+("frame;frame;frame count"); the admin endpoint merges them.
+
+Profiles live under PROFILE_DIR (default <JOB_DB_DIR>/profiles), so build
+nodes that share the job database also share profiles.
+
+Configuration:
+    ADMIN_TOKEN            enables the admin endpoints and profiling flags
+    PROFILE_DIR            where profiles are stored
+    PROFILE_KEEP           profiles kept before the oldest are deleted (default 200)
+    PROFILE_SAMPLING_HZ    continuous stack sampling rate per process (default 0 = off)
+"""
+import os
+import re
+import io
+import sys
+import json
+import time
+import uuid
+import pstats
+import socket
+import cProfile
+import threading
+from datetime import datetime
+
+PROFILE_ID_PATTERN = re.compile(r'^(req|job)-[A-Za-z0-9-]{1,64}$')
+
+# Continuous samplers write their stacks this often
+SAMPLE_FLUSH_INTERVAL = 60
+# Deepest stack kept per sample
+MAX_STACK_DEPTH = 64
+
+
+def default_profile_dir():
+    return os.environ.get('PROFILE_DIR') or os.path.join(os.environ.get('JOB_DB_DIR', 'db'), 'profiles')
+
+
+class ProfileStore:
+    """pstats files plus a small JSON description per profile"""
+
+    def __init__(self, root=None, keep=None):
+        self.root = root or default_profile_dir()
+        self.keep = keep if keep is not None else int(os.environ.get('PROFILE_KEEP', '200'))
+        self.stacks_dir = os.path.join(self.root, 'stacks')
+        os.makedirs(self.stacks_dir, exist_ok=True)
+
+    def new_request_id(self) -> str:
+        return f'req-{uuid.uuid4().hex[:12]}'
+
+    def path_for(self, profile_id) -> str:
+        if not PROFILE_ID_PATTERN.match(profile_id or ''):
+            raise ValueError(f'Invalid profile id: {profile_id}')
+        return os.path.join(self.root, f'{profile_id}.prof')
+
+    def save(self, profile_id, profiler, **meta):
+        """Write a finished cProfile.Profile and its description"""
+        path = self.path_for(profile_id)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        profiler.dump_stats(tmp_path)
+        os.replace(tmp_path, path)
+        meta.update(profile_id=profile_id, created_at=datetime.now().isoformat(),
+                    host=socket.gethostname(), pid=os.getpid())
+        with open(f'{path[:-len(".prof")]}.json', 'w') as f:
+            json.dump(meta, f, indent=2)
+        self._prune()
+        return path
+
+    def list(self):
+        """Descriptions of stored profiles, newest first"""
+        profiles = []
+        for name in os.listdir(self.root):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.root, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return sorted(profiles, key=lambda meta: meta.get('created_at', ''), reverse=True)
+
+    def render_text(self, profile_id, sort='cumulative', limit=60) -> str:
+        """Human-readable report of a stored profile"""
+        out = io.StringIO()
+        stats = pstats.Stats(self.path_for(profile_id), stream=out)
+        stats.strip_dirs().sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def _prune(self):
+        for meta in self.list()[self.keep:]:
+            for suffix in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(self.root, meta['profile_id'] + suffix))
+                except OSError:
+                    pass
+
+    def merged_stacks(self) -> str:
+        """Folded stacks of every process's continuous sampler, summed"""
+        totals = {}
+        for name in os.listdir(self.stacks_dir):
+            if not name.endswith('.folded'):
+                continue
+            try:
+                with open(os.path.join(self.stacks_dir, name)) as f:
+                    for line in f:
+                        stack, _, count = line.rstrip('\n').rpartition(' ')
+                        if stack and count.isdigit():
+                            totals[stack] = totals.get(stack, 0) + int(count)
+            except OSError:
+                continue
+        return ''.join(f'{stack} {count}\n' for stack, count in
+                       sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def profile_call(store, profile_id, func, *args, **meta):
+    """
+    Run func(*args) under cProfile and store the profile
+
+    Profiling is skipped (func still runs) if another profiler is already
+    active in this thread.
+    """
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        print(f"Profiling {profile_id} skipped: {e}")
+        return func(*args)
+    started = time.monotonic()
+    try:
+        return func(*args)
+    finally:
+        profiler.disable()
+        try:
+            store.save(profile_id, profiler, duration_seconds=round(time.monotonic() - started, 3), **meta)
+        except Exception as e:
+            print(f"Could not save profile {profile_id}: {e}")
+
+
+class StackSampler:
+    """
+    Low-rate sampler of every thread's Python stack in this process.
+    Counts are kept in memory and written to <stacks_dir>/<host>-<pid>.folded
+    every SAMPLE_FLUSH_INTERVAL seconds (the file holds the process's totals).
+    """
+
+    def __init__(self, store, hz):
+        self.store = store
+        self.interval = 1.0 / hz
+        self.counts = {}
+        self.path = os.path.join(store.stacks_dir, f'{socket.gethostname()}-{os.getpid()}.folded')
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop sampling and write the final totals"""
+        self._stop.set()
+        # A sample in progress would change counts while they are written
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            frames = []
+            while frame is not None and len(frames) < MAX_STACK_DEPTH:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            # Thread pools name threads <pool>_<n>; group by pool
+            thread_name = re.sub(r'[-_]\d+$', '', names.get(ident, 'thread'))
+            stack = ';'.join([thread_name] + frames[::-1])
+            self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def flush(self):
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(f'{stack} {count}\n' for stack, count in self.counts.items())
+        os.replace(tmp_path, self.path)
+
+    def _run(self):
+        next_flush = time.monotonic() + SAMPLE_FLUSH_INTERVAL
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+                if time.monotonic() >= next_flush:
+                    next_flush = time.monotonic() + SAMPLE_FLUSH_INTERVAL
+                    self.flush()
+            except Exception as e:
+                print(f"Stack sampler error: {e}")
+
+
+def start_stack_sampler(store):
+    """Start continuous sampling when PROFILE_SAMPLING_HZ is set; returns the sampler or None"""
+    hz = float(os.environ.get('PROFILE_SAMPLING_HZ', '0') or 0)
+    if hz <= 0:
+        return None
+    return StackSampler(store, hz).start()
@@ -0,0 +1,254 @@
+"""
+Per-API-key Rate Limiting and Build Quotas
+Token buckets for request rate, plus concurrent and daily build quotas.
+State lives in a SQLite file next to the API key records, so every API
+process (and node sharing db/) enforces the same limits; each check is one
+short write transaction.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+ACTIVE_STATUSES = ('pending', 'processing')
+# Seconds an admitted build may go without a job record before it stops counting
+UNKNOWN_JOB_GRACE = 300
+
+
+def _env_number(name, default):
+    return float(os.environ.get(name, default))
+
+
+class RateLimiter:
+    def __init__(self, db_path='db/rate_limits.sqlite3', reconcile_interval: int = 30,
+                 legacy_state_path='db/api_key_usage.json'):
+        self.db_path = os.path.abspath(db_path)
+        self.reconcile_interval = reconcile_interval
+
+        # Defaults for every key; a key record may override them with a 'limits' dict
+        self.default_limits = {
+            'requests_per_minute': _env_number('RATE_LIMIT_PER_MINUTE', '60'),
+            'burst': _env_number('RATE_LIMIT_BURST', '20'),
+            'max_concurrent_builds': _env_number('BUILD_CONCURRENCY_QUOTA', '3'),
+            'daily_builds': _env_number('BUILD_DAILY_QUOTA', '50')
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS request_buckets ('
+                ' key_id TEXT PRIMARY KEY,'
+                ' tokens REAL NOT NULL,'
+                ' refilled_at REAL NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS daily_builds ('
+                ' key_id TEXT NOT NULL,'
+                ' day TEXT NOT NULL,'
+                ' builds INTEGER NOT NULL DEFAULT 0,'
+                ' PRIMARY KEY (key_id, day))')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS builds_in_flight ('
+                ' job_id TEXT PRIMARY KEY,'
+                ' key_id TEXT NOT NULL,'
+                ' day TEXT NOT NULL,'
+                ' acquired_at REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_builds_in_flight_key'
+                         ' ON builds_in_flight (key_id)')
+            self._import_legacy_state(conn, legacy_state_path)
+
+        self._thread = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def _import_legacy_state(self, conn, path):
+        """Carry over today's counts and in-flight builds from the old per-process JSON state"""
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, 'r') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            state = {}
+        today = self._today()
+        conn.execute('BEGIN IMMEDIATE')
+        for key_id, key_state in state.items():
+            if key_state.get('day') == today:
+                conn.execute('INSERT OR IGNORE INTO daily_builds (key_id, day, builds) VALUES (?, ?, ?)',
+                             (key_id, today, key_state.get('builds_today', 0)))
+            conn.executemany('INSERT OR IGNORE INTO builds_in_flight VALUES (?, ?, ?, ?)',
+                             ((job_id, key_id, today, time.time())
+                              for job_id in key_state.get('in_flight') or []))
+        conn.execute('COMMIT')
+        # Imports are idempotent, so another process getting here first is fine
+        try:
+            os.replace(path, f'{path}.imported')
+        except FileNotFoundError:
+            pass
+
+    def limits_for(self, key_record: Dict) -> Dict:
+        """Effective limits for a key (0 disables a limit)"""
+        limits = dict(self.default_limits)
+        limits.update(key_record.get('limits') or {})
+        return limits
+
+    def _today(self) -> str:
+        return datetime.now(timezone.utc).date().isoformat()
+
+    def _seconds_until_tomorrow(self) -> int:
+        now = datetime.now(timezone.utc)
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), timezone.utc)
+        return max(1, int((tomorrow - now).total_seconds()))
+
+    def check_request(self, key_record: Dict) -> Optional[Dict]:
+        """
+        Take one token from the key's request bucket
+
+        Returns:
+            None if allowed, otherwise a dict with 'error', 'message' and 'retry_after'
+        """
+        limits = self.limits_for(key_record)
+        rate = limits['requests_per_minute'] / 60.0
+        if rate <= 0:
+            return None
+        capacity = max(1.0, limits['burst'])
+        key_id = key_record['key_id']
+        now = time.time()
+
+        with closing(self._connect()) as conn:
+            conn.execute('INSERT OR IGNORE INTO request_buckets (key_id, tokens, refilled_at)'
+                         ' VALUES (?, ?, ?)', (key_id, capacity, now))
+            # Refill and take a token in one statement, only if one is available
+            refilled = 'min(?, tokens + max(0, ? - refilled_at) * ?)'
+            taken = conn.execute(
+                f'UPDATE request_buckets SET tokens = {refilled} - 1, refilled_at = ?'
+                f' WHERE key_id = ? AND {refilled} >= 1',
+                (capacity, now, rate, now, key_id, capacity, now, rate)).rowcount
+            if taken:
+                return None
+            tokens, refilled_at = conn.execute(
+                'SELECT tokens, refilled_at FROM request_buckets WHERE key_id = ?', (key_id,)).fetchone()
+
+        tokens = min(capacity, tokens + max(0.0, now - refilled_at) * rate)
+        return {
+            'error': 'Rate limit exceeded',
+            'message': f"Too many requests. Limit is {limits['requests_per_minute']:g} per minute.",
+            'retry_after': max(1, int((1 - tokens) / rate + 0.999))
+        }
+
+    def acquire_build(self, key_record: Dict, job_id, force=False) -> Optional[Dict]:
+        """
+        Admit a build against the key's concurrent and daily quotas
+
+        Args:
+            key_record: The submitting API key
+            job_id: The build's job
+            force: Count the build even if it is over quota
+
+        Returns:
+            None if admitted (the build is counted), otherwise a dict with
+            'error', 'message' and 'retry_after'
+        """
+        limits = self.limits_for(key_record)
+        key_id = key_record['key_id']
+        today = self._today()
+
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('INSERT OR IGNORE INTO daily_builds (key_id, day, builds) VALUES (?, ?, 0)',
+                         (key_id, today))
+            daily_limit = limits['daily_builds'] if limits['daily_builds'] and not force else None
+            counted = conn.execute(
+                'UPDATE daily_builds SET builds = builds + 1'
+                ' WHERE key_id = ? AND day = ? AND (? IS NULL OR builds < ?)',
+                (key_id, today, daily_limit, daily_limit)).rowcount
+            if not counted:
+                conn.execute('ROLLBACK')
+                return {
+                    'error': 'Daily build quota exceeded',
+                    'message': f"This API key may start {limits['daily_builds']:g} builds per day.",
+                    'retry_after': self._seconds_until_tomorrow()
+                }
+
+            in_flight = conn.execute('SELECT COUNT(*) FROM builds_in_flight WHERE key_id = ?',
+                                     (key_id,)).fetchone()[0]
+            if limits['max_concurrent_builds'] and not force and \
+                    in_flight >= limits['max_concurrent_builds']:
+                conn.execute('ROLLBACK')
+                return {
+                    'error': 'Concurrent build quota exceeded',
+                    'message': f"This API key may have {limits['max_concurrent_builds']:g} builds "
+                               f"in progress. Wait for one to finish.",
+                    'retry_after': 30
+                }
+
+            conn.execute('INSERT OR REPLACE INTO builds_in_flight VALUES (?, ?, ?, ?)',
+                         (job_id, key_id, today, time.time()))
+            conn.execute('COMMIT')
+            return None
+
+    def release_build(self, key_id, job_id, refund=False):
+        """
+        Stop counting a build against the concurrent quota; with refund, also
+        give back its daily quota (for a job that didn't start a build)
+        """
+        with closing(self._connect()) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT day FROM builds_in_flight WHERE job_id = ? AND key_id = ?',
+                               (job_id, key_id)).fetchone()
+            if row:
+                conn.execute('DELETE FROM builds_in_flight WHERE job_id = ?', (job_id,))
+                if refund:
+                    conn.execute('UPDATE daily_builds SET builds = max(0, builds - 1)'
+                                 ' WHERE key_id = ? AND day = ?', (key_id, row[0]))
+            conn.execute('COMMIT')
+
+    def on_job_finished(self, job: Dict):
+        """JobManager listener: finished builds free a concurrency slot"""
+        if job.get('key_id'):
+            self.release_build(job['key_id'], job['job_id'])
+
+    def reconcile(self, job_manager):
+        """Drop in-flight builds that finished elsewhere (e.g. on a build worker node)"""
+        with closing(self._connect()) as conn:
+            in_flight = conn.execute('SELECT job_id, acquired_at FROM builds_in_flight').fetchall()
+            if not in_flight:
+                return
+            jobs = job_manager.all_jobs()
+            # A build is admitted just before its job is created; only drop
+            # unknown jobs once they are clearly never going to appear
+            stale_before = time.time() - UNKNOWN_JOB_GRACE
+            finished = []
+            for job_id, acquired_at in in_flight:
+                job = jobs.get(job_id)
+                if (job['status'] not in ACTIVE_STATUSES) if job else acquired_at < stale_before:
+                    finished.append((job_id,))
+            conn.executemany('DELETE FROM builds_in_flight WHERE job_id = ?', finished)
+            # Daily counters older than yesterday are never read again
+            yesterday = (datetime.now(timezone.utc).date() - timedelta(days=1)).isoformat()
+            conn.execute('DELETE FROM daily_builds WHERE day < ?', (yesterday,))
+
+    def _reconcile_loop(self, job_manager):
+        while True:
+            time.sleep(self.reconcile_interval)
+            try:
+                self.reconcile(job_manager)
+            except Exception as e:
+                print(f"Rate limiter reconcile error: {e}")
+
+    def start(self, job_manager):
+        """Hook into job completion and start periodic reconciliation"""
+        if self._thread:
+            return
+        job_manager.add_listener(self.on_job_finished)
+        self.reconcile(job_manager)
+        self._thread = threading.Thread(target=self._reconcile_loop, args=(job_manager,),
+                                        name='rate-limiter-reconcile', daemon=True)
+        self._thread.start()
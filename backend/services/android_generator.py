@@ -5,6 +5,8 @@ import requests
 from PIL import Image
 from io import BytesIO
 
+from common.tracing import tracer
+
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'android_templates')
 
 def generate_android_project(project_dir, url, app_name, package_name, theme_color, 
@@ -89,7 +91,9 @@ def process_custom_icon(icon_path, project_dir):
         resized_img.save(icon_path_dest, 'PNG')
 
 def download_and_convert_favicon(favicon_url, project_dir, app_name):
-    response = requests.get(favicon_url, timeout=10)
+    with tracer.span('http.fetch', purpose='favicon', url=favicon_url) as span:
+        response = requests.get(favicon_url, timeout=10)
+        span.set_attribute('http.status_code', response.status_code)
     response.raise_for_status()
     
     img = Image.open(BytesIO(response.content))
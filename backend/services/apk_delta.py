@@ -0,0 +1,412 @@
+"""
+APK delta updates
+Tenants rebuild the same app with a new URL or icon, which changes a handful
+of zip entries. A patch lists every entry of the new APK and, for each one,
+either copies the identical entry from the old APK, applies a copy/insert
+binary delta to the old entry, or carries the new bytes. Since builds are
+written in the canonical zip layout (apk_builder.zipalign), the client
+rebuilds a byte-identical APK and checks it against the target hash.
+
+A small change to a deflated entry rewrites most of its compressed bytes, so
+deltas are taken between the entries' uncompressed contents and the client
+deflates the result again. That only works when re-deflating reproduces the
+stored bytes exactly, which is checked when the patch is made (with the
+level recorded); other entries fall back to a delta of the stored bytes.
+
+Patch format:
+    b'W2AP' + version byte, then a zlib stream of
+    u32 header length (little-endian) + JSON header + payload
+Header: {"from": sha256, "to": sha256, "entries": [...]}, each entry has
+    name, method, crc, size and one of
+    "copy": name of the identical entry in the old APK
+    "delta": ops, [offset, length] to copy from the old entry or
+             [-1, payload_offset, length] to insert; against the stored bytes,
+             or with "basis": "content" against the uncompressed content,
+             deflated with "level" afterwards if the entry is deflated
+    "data": [payload_offset, length] of the entry's stored bytes
+Payload ranges are in entry order, so both ends stream the payload.
+Version 1 patches (stored-bytes deltas only) are still applied.
+
+Patches are generated on background threads, never in a download request:
+see PatchCache.
+
+Apply a patch (from the project root):
+    python -m backend.services.apk_delta old.apk update.apkpatch new.apk
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import zlib
+import struct
+import hashlib
+import zipfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from apk_builder.zipalign import COPY_CHUNK, DEFLATE_LEVEL, CanonicalZipWriter, read_raw
+
+PATCH_MAGIC = b'W2AP\x02'
+# Magics apply_patch accepts
+PATCH_MAGICS = (b'W2AP\x01', PATCH_MAGIC)
+PATCH_EXTENSION = '.apkpatch'
+PATCH_MIMETYPE = 'application/octet-stream'
+
+# Granularity of matches between old and new entry bytes
+BLOCK_SIZE = 32
+# Send an entry whole when a delta would save less than this fraction
+MIN_DELTA_SAVING = 0.1
+# Deflate levels tried when checking that an entry can be re-deflated
+# byte for byte; the canonical writer uses DEFLATE_LEVEL
+DEFLATE_LEVELS = (DEFLATE_LEVEL, 9, 1)
+
+
+def app_identity(job):
+    """Builds of the 'same app': same API key and app name"""
+    return (job.get('key_id'), job['app_name'].strip().lower())
+
+
+def _match_length(old, old_offset, new, new_offset):
+    """Length of the common run starting at the two offsets"""
+    length = 0
+    limit = min(len(old) - old_offset, len(new) - new_offset)
+    step = 4096
+    while length + step <= limit and \
+            old[old_offset + length:old_offset + length + step] == new[new_offset + length:new_offset + length + step]:
+        length += step
+    while length < limit and old[old_offset + length] == new[new_offset + length]:
+        length += 1
+    return length
+
+
+def diff_bytes(old, new, block=BLOCK_SIZE):
+    """
+    Copy/insert delta turning old into new
+
+    Returns:
+        list of (old_offset, length) copies and bytes inserts, in order
+    """
+    index = {}
+    for offset in range(0, len(old) - block + 1, block):
+        index.setdefault(old[offset:offset + block], offset)
+
+    ops = []
+    literal_start = 0
+    i = 0
+    while i + block <= len(new):
+        old_offset = index.get(new[i:i + block])
+        if old_offset is None:
+            i += 1
+            continue
+        # Grow the match backwards into the pending literal, then forwards
+        start = i
+        while start > literal_start and old_offset > 0 and new[start - 1] == old[old_offset - 1]:
+            start -= 1
+            old_offset -= 1
+        length = _match_length(old, old_offset, new, start)
+        if start > literal_start:
+            ops.append(bytes(new[literal_start:start]))
+        ops.append((old_offset, length))
+        i = literal_start = start + length
+    if literal_start < len(new):
+        ops.append(bytes(new[literal_start:]))
+    return ops
+
+
+def inflate(stored, method):
+    """Uncompressed content of an entry from its stored bytes"""
+    return zlib.decompress(stored, -15) if method == zipfile.ZIP_DEFLATED else stored
+
+
+def deflate_level(content, stored):
+    """
+    Deflate level that turns content back into exactly these stored bytes
+
+    Returns:
+        the level, or None if none of DEFLATE_LEVELS does
+    """
+    for level in DEFLATE_LEVELS:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        position = 0
+        matched = True
+        for offset in range(0, len(content), COPY_CHUNK):
+            out = compressor.compress(content[offset:offset + COPY_CHUNK])
+            # Give up on this level at the first chunk that differs
+            if stored[position:position + len(out)] != out:
+                matched = False
+                break
+            position += len(out)
+        if matched and stored[position:] == compressor.flush():
+            return level
+    return None
+
+
+def _deflate(content, level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(content) + compressor.flush()
+
+
+def _delta(old_data, new_data):
+    """diff_bytes ops if they save at least MIN_DELTA_SAVING of new_data, else None"""
+    ops = diff_bytes(old_data, new_data)
+    inserted = sum(len(op) for op in ops if isinstance(op, bytes))
+    return ops if inserted <= len(new_data) * (1 - MIN_DELTA_SAVING) else None
+
+
+def create_patch(old_path, new_path, from_hash, to_hash, patch_path):
+    """
+    Write a patch that turns the APK at old_path into the one at new_path
+
+    Only one entry's bytes are in memory at a time; the payload is spooled
+    to a temp file.
+
+    Returns:
+        dict with 'copied', 'delta' and 'data' entry counts and 'size'
+    """
+    entries = []
+    stats = {'copied': 0, 'delta': 0, 'data': 0}
+
+    with tempfile.TemporaryFile() as payload:
+        def add_payload(data):
+            offset = payload.tell()
+            payload.write(data)
+            return [offset, len(data)]
+
+        with zipfile.ZipFile(old_path) as old_zip, open(old_path, 'rb') as old_file, \
+                zipfile.ZipFile(new_path) as new_zip, open(new_path, 'rb') as new_file:
+            old_entries = {info.filename: info for info in old_zip.infolist()}
+            for info in new_zip.infolist():
+                entry = {'name': info.filename, 'method': info.compress_type,
+                         'crc': info.CRC, 'size': info.file_size}
+                old_info = old_entries.get(info.filename)
+                if old_info and (old_info.CRC, old_info.file_size, old_info.compress_type) == \
+                        (info.CRC, info.file_size, info.compress_type):
+                    entry['copy'] = info.filename
+                    stats['copied'] += 1
+                    entries.append(entry)
+                    continue
+
+                new_stored = read_raw(new_file, info)
+                ops = None
+                if old_info:
+                    old_stored = read_raw(old_file, old_info)
+                    new_content = inflate(new_stored, info.compress_type)
+                    level = deflate_level(new_content, new_stored) \
+                        if info.compress_type == zipfile.ZIP_DEFLATED else None
+                    if info.compress_type != zipfile.ZIP_DEFLATED or level is not None:
+                        ops = _delta(inflate(old_stored, old_info.compress_type), new_content)
+                        if ops:
+                            entry['basis'] = 'content'
+                            if level is not None:
+                                entry['level'] = level
+                    else:
+                        ops = _delta(old_stored, new_stored)
+                if ops:
+                    entry['delta'] = [[-1] + add_payload(op) if isinstance(op, bytes) else list(op)
+                                      for op in ops]
+                    stats['delta'] += 1
+                else:
+                    entry['data'] = add_payload(new_stored)
+                    stats['data'] += 1
+                entries.append(entry)
+
+        header = json.dumps({'from': from_hash, 'to': to_hash, 'entries': entries},
+                            separators=(',', ':')).encode('utf-8')
+        payload.seek(0)
+        tmp_path = f'{patch_path}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                compressor = zlib.compressobj(9)
+                f.write(PATCH_MAGIC)
+                f.write(compressor.compress(struct.pack('<I', len(header)) + header))
+                for chunk in iter(lambda: payload.read(COPY_CHUNK), b''):
+                    f.write(compressor.compress(chunk))
+                f.write(compressor.flush())
+            os.replace(tmp_path, patch_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    stats['size'] = os.path.getsize(patch_path)
+    return stats
+
+
+class _PatchReader:
+    """Sequential reads from a patch's zlib stream"""
+
+    def __init__(self, f):
+        self.f = f
+        self.decompressor = zlib.decompressobj()
+        self.buffer = bytearray()
+        self.position = 0
+
+    def read(self, length):
+        while len(self.buffer) < length:
+            chunk = self.f.read(COPY_CHUNK)
+            if not chunk:
+                raise ValueError('Truncated APK patch')
+            self.buffer.extend(self.decompressor.decompress(chunk))
+        data = bytes(self.buffer[:length])
+        del self.buffer[:length]
+        self.position += length
+        return data
+
+    def read_at(self, offset, length):
+        """Payload bytes at offset, which must not be behind earlier reads"""
+        if offset < self.position:
+            raise ValueError('APK patch payload out of order')
+        self.read(offset - self.position)
+        return self.read(length)
+
+
+def apply_patch(old_path, patch_path, out_path):
+    """
+    Rebuild the new APK from the old one and a patch
+
+    Returns:
+        SHA-256 of the result (raises ValueError if it isn't the patch target)
+    """
+    with open(patch_path, 'rb') as f, zipfile.ZipFile(old_path) as old_zip, \
+            open(old_path, 'rb') as old_file, open(out_path, 'wb') as out:
+        if f.read(len(PATCH_MAGIC)) not in PATCH_MAGICS:
+            raise ValueError('Not an APK patch')
+        reader = _PatchReader(f)
+        header_len = struct.unpack('<I', reader.read(4))[0]
+        header = json.loads(reader.read(header_len))
+        # Payload offsets count from the end of the header
+        reader.position = 0
+
+        old_entries = {info.filename: info for info in old_zip.infolist()}
+        writer = CanonicalZipWriter(out)
+        for entry in header['entries']:
+            if 'copy' in entry:
+                data = read_raw(old_file, old_entries[entry['copy']])
+            elif 'delta' in entry:
+                old_info = old_entries[entry['name']]
+                old_data = read_raw(old_file, old_info)
+                if entry.get('basis') == 'content':
+                    old_data = inflate(old_data, old_info.compress_type)
+                data = b''.join(reader.read_at(op[1], op[2]) if op[0] == -1
+                                else old_data[op[0]:op[0] + op[1]] for op in entry['delta'])
+                if entry.get('basis') == 'content' and entry['method'] == zipfile.ZIP_DEFLATED:
+                    data = _deflate(data, entry['level'])
+            else:
+                data = reader.read_at(*entry['data'])
+            writer.write_entry(entry['name'], entry['method'], entry['crc'], entry['size'],
+                               [data], len(data))
+        writer.close()
+
+    digest = hashlib.sha256()
+    with open(out_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    if digest.hexdigest() != header['to']:
+        raise ValueError('Patched APK does not match the target hash')
+    return header['to']
+
+
+class PatchCache:
+    """
+    Patches between two APK hashes, kept in the artifact store
+
+    Diffing is CPU-bound, so patches are made on a small background pool and
+    never in a request: when a build completes, the patch from the app's
+    previous build is queued, and a request for any other missing patch
+    queues it and gets None (the caller answers 202 with Retry-After).
+    """
+
+    def __init__(self, artifact_store, job_manager=None, workers=None):
+        self.artifact_store = artifact_store
+        self.job_manager = job_manager
+        self.workers = workers or int(os.environ.get('PATCH_WORKERS', '1'))
+        # Seconds a client is told to wait for a patch being generated
+        self.retry_after = int(os.environ.get('PATCH_RETRY_AFTER', '5'))
+        # Seconds before a patch that failed to generate is tried again
+        self.failure_ttl = int(os.environ.get('PATCH_FAILURE_TTL', '300'))
+        self._lock = threading.Lock()
+        self._queued = set()
+        self._failed = {}
+        self._executor = None
+        self._started = False
+
+    def patch_name(self, from_hash, to_hash) -> str:
+        return f'{from_hash}-{to_hash}{PATCH_EXTENSION}'
+
+    def start(self):
+        """Precompute the patch from the previous build whenever a build completes"""
+        if self.job_manager and not self._started:
+            self._started = True
+            self.job_manager.add_listener(self.on_job_finished)
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='patch')
+        return self._executor.submit(fn, *args)
+
+    def get(self, old_path, new_path, from_hash, to_hash):
+        """Path of the patch from_hash -> to_hash, or None if it's queued (see failed)"""
+        path = self.artifact_store.path_for(self.patch_name(from_hash, to_hash))
+        if os.path.exists(path):
+            return path
+        self.request(old_path, new_path, from_hash, to_hash)
+        return None
+
+    def failed(self, from_hash, to_hash) -> bool:
+        """True if generating this patch failed within failure_ttl"""
+        failed_at = self._failed.get(self.patch_name(from_hash, to_hash))
+        return failed_at is not None and time.monotonic() - failed_at < self.failure_ttl
+
+    def request(self, old_path, new_path, from_hash, to_hash):
+        """Queue the patch unless it exists, is queued or failed recently; returns the Future or None"""
+        name = self.patch_name(from_hash, to_hash)
+        path = self.artifact_store.path_for(name)
+        with self._lock:
+            if name in self._queued or os.path.exists(path) or self.failed(from_hash, to_hash):
+                return None
+            self._queued.add(name)
+        return self._submit(self._generate, name, path, old_path, new_path, from_hash, to_hash)
+
+    def _generate(self, name, path, old_path, new_path, from_hash, to_hash):
+        try:
+            started = time.monotonic()
+            stats = create_patch(old_path, new_path, from_hash, to_hash, path)
+            print(f"Created patch {name} in {time.monotonic() - started:.1f}s: {stats['size']} bytes "
+                  f"({stats['copied']} copied, {stats['delta']} delta, {stats['data']} full entries)")
+        except Exception as e:
+            print(f'Patch {name} failed: {e}')
+            self._failed[name] = time.monotonic()
+        finally:
+            with self._lock:
+                self._queued.discard(name)
+
+    def on_job_finished(self, job):
+        """Job listener: queue the patch from the app's previous build"""
+        if job['status'] == 'completed' and job.get('apk_sha256'):
+            self._submit(self._precompute, job)
+
+    def previous_build(self, job):
+        """The newest earlier build of the same app with a different APK, or None"""
+        for build in self.job_manager.app_builds(job.get('key_id'), job['app_name']):
+            if build['apk_sha256'] != job['apk_sha256'] and build['created_at'] < job['created_at']:
+                return build
+        return None
+
+    def _precompute(self, job):
+        try:
+            previous = self.previous_build(job)
+            base_path = previous and self.artifact_store.apk_path(previous['apk_sha256'])
+            new_path = self.artifact_store.apk_path(job['apk_sha256'], job.get('apk_path'))
+            if base_path and new_path:
+                self.request(base_path, new_path, previous['apk_sha256'], job['apk_sha256'])
+        except Exception as e:
+            print(f"Patch precompute for job {job['job_id']} failed: {e}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        sys.exit('usage: python -m backend.services.apk_delta OLD_APK PATCH OUT_APK')
+    print(apply_patch(*sys.argv[1:]))
@@ -0,0 +1,65 @@
+import os
+import hashlib
+from flask import Response, request, send_file
+from werkzeug.wsgi import ClosingIterator
+
+APK_MIMETYPE = 'application/vnd.android.package-archive'
+
+# Optional offload to a fronting proxy so gunicorn threads don't stream bytes:
+#   DOWNLOAD_OFFLOAD=nginx    -> X-Accel-Redirect: <DOWNLOAD_ACCEL_PREFIX><file>
+#   DOWNLOAD_OFFLOAD=sendfile -> X-Sendfile: <absolute path> (Apache/lighttpd)
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '').strip().lower()
+DOWNLOAD_ACCEL_PREFIX = os.environ.get('DOWNLOAD_ACCEL_PREFIX', '/protected-downloads/')
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def safe_download_name(app_name, extension='apk'):
+    """Build an attachment filename from a user supplied app name"""
+    safe_name = "".join(c for c in app_name if c.isalnum() or c in (' ', '-', '_')).strip()
+    safe_name = safe_name.replace(' ', '_') or 'app'
+    return f'{safe_name}.{extension}'
+
+def send_artifact(path, download_name, etag, mimetype=APK_MIMETYPE, offload_path=None):
+    """
+    Send a finished build artifact with a strong content ETag.
+    Handles HEAD, If-None-Match (304) and Range (206) requests. When an
+    offload mode is configured the proxy streams the body instead of us;
+    offload_path is the file's path under the proxy's internal location
+    (default: its file name).
+    """
+    if DOWNLOAD_OFFLOAD in ('nginx', 'sendfile'):
+        response = Response(mimetype=mimetype)
+        if DOWNLOAD_OFFLOAD == 'nginx':
+            response.headers['X-Accel-Redirect'] = DOWNLOAD_ACCEL_PREFIX + (offload_path or os.path.basename(path))
+        else:
+            response.headers['X-Sendfile'] = os.path.abspath(path)
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        response.headers['Accept-Ranges'] = 'bytes'
+        response.set_etag(etag)
+        # The proxy serves the body and Range; we only answer validators
+        return response.make_conditional(request)
+
+    return send_file(
+        path,
+        as_attachment=True,
+        download_name=download_name,
+        mimetype=mimetype,
+        etag=etag,
+        conditional=True
+    )
+
+
+def call_after_send(response, callback):
+    """
+    Run callback once a file response has been sent (or abandoned).
+    Response.call_on_close doesn't fire for send_file() responses, whose
+    body is passed straight through to the server, so the body is wrapped.
+    """
+    response.response = ClosingIterator(response.response, callback)
+    return response
@@ -3,12 +3,16 @@ import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin
 
+from common.tracing import tracer
+
 def fetch_url_metadata(url):
     try:
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         }
-        response = requests.get(url, headers=headers, timeout=10)
+        with tracer.span('http.fetch', purpose='metadata', url=url) as span:
+            response = requests.get(url, headers=headers, timeout=10)
+            span.set_attribute('http.status_code', response.status_code)
         response.raise_for_status()
         
         soup = BeautifulSoup(response.text, 'html.parser')
@@ -0,0 +1,241 @@
+"""
+Static frontend pipeline
+Copies frontend/ assets to content-hashed names (style.3f2a9c1b7d4e.css)
+with gzip and brotli variants next to them, and rewrites the HTML to
+reference the hashed names. Hashed assets never change, so they are served
+with an immutable one-year Cache-Control; HTML is revalidated on every load.
+The precompressed variant matching the client's Accept-Encoding is sent as
+is, so serving costs no compression work.
+
+Runs at image build time (Dockerfile) or, when the output is missing or
+stale, on the first static request:
+    python -m backend.static_assets [--source frontend] [--output frontend/dist]
+
+brotli is optional; without it only gzip variants are produced.
+"""
+import os
+import re
+import sys
+import gzip
+import json
+import shutil
+import hashlib
+import argparse
+import mimetypes
+import threading
+from pathlib import Path
+
+from flask import request, send_file, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+SOURCE_DIR = Path(__file__).resolve().parent.parent / 'frontend'
+MANIFEST_NAME = 'manifest.json'
+
+# Assets that get content-hashed names; HTML keeps its name and is rewritten
+HASHED_EXTENSIONS = ('.css', '.js', '.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+                     '.woff', '.woff2', '.json', '.md')
+# Worth precompressing (already-compressed formats are not)
+COMPRESSIBLE_EXTENSIONS = ('.html', '.css', '.js', '.svg', '.json', '.md', '.txt', '.ico')
+# Smaller files gain nothing from compression
+MIN_COMPRESS_BYTES = 256
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+# (encoding, file suffix) in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# href="..." / src="..." attributes pointing at local files
+ASSET_REFERENCE = re.compile(r'''((?:href|src)\s*=\s*["'])([^"'#?]+)(["'])''', re.IGNORECASE)
+
+
+def hashed_name(relative_path, data):
+    """style.css -> style.<12 hex digits of its SHA-256>.css"""
+    stem, ext = os.path.splitext(relative_path)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _write(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def _write_variants(path, data):
+    """Write path plus .gz/.br variants when they are smaller"""
+    _write(path, data)
+    if path.suffix.lower() not in COMPRESSIBLE_EXTENSIONS or len(data) < MIN_COMPRESS_BYTES:
+        return
+    # mtime=0 keeps the gzip bytes identical between builds
+    compressed = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed['.br'] = brotli.compress(data, quality=11)
+    for suffix, body in compressed.items():
+        if len(body) < len(data):
+            _write(path.with_name(path.name + suffix), body)
+
+
+def _is_output(path, output_dir):
+    """path is inside the build output or one of its staging siblings (dist.*)"""
+    return any(parent.parent == output_dir.parent and
+               (parent.name == output_dir.name or parent.name.startswith(output_dir.name + '.'))
+               for parent in path.parents)
+
+
+def _source_files(source_dir, output_dir):
+    """Files under source_dir, leaving out the build output if it lives there"""
+    return sorted(p for p in source_dir.rglob('*')
+                  if p.is_file() and not _is_output(p, output_dir))
+
+
+def source_digest(source_dir, output_dir):
+    """Hash of every source file's path and content"""
+    digest = hashlib.sha256()
+    for path in _source_files(source_dir, output_dir):
+        digest.update(path.relative_to(source_dir).as_posix().encode())
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+def build_assets(source_dir=SOURCE_DIR, output_dir=None):
+    """
+    Build the fingerprinted, precompressed copy of source_dir
+
+    Returns:
+        The manifest: {'source_digest', 'brotli', 'assets': {logical path: hashed path}}
+    """
+    source_dir = Path(source_dir)
+    output_dir = Path(output_dir) if output_dir else source_dir / 'dist'
+    files = _source_files(source_dir, output_dir)
+
+    # Per-process staging: several gunicorn workers may build at once
+    staging = output_dir.with_name(f'{output_dir.name}.{os.getpid()}.tmp')
+    shutil.rmtree(staging, ignore_errors=True)
+
+    assets = {}
+    for path in files:
+        relative = path.relative_to(source_dir).as_posix()
+        if path.suffix.lower() in HASHED_EXTENSIONS:
+            data = path.read_bytes()
+            assets[relative] = hashed_name(relative, data)
+            _write_variants(staging / assets[relative], data)
+
+    for path in files:
+        relative = path.relative_to(source_dir).as_posix()
+        if relative in assets:
+            continue
+        data = path.read_bytes()
+        if path.suffix.lower() in ('.html', '.htm'):
+            base = os.path.dirname(relative)
+
+            def rewrite(match):
+                reference = os.path.normpath(os.path.join(base, match.group(2))).replace(os.sep, '/')
+                if reference not in assets:
+                    return match.group(0)
+                return match.group(1) + os.path.relpath(assets[reference], base or '.').replace(os.sep, '/') + match.group(3)
+
+            data = ASSET_REFERENCE.sub(rewrite, data.decode('utf-8')).encode('utf-8')
+        _write_variants(staging / relative, data)
+
+    manifest = {
+        'source_digest': source_digest(source_dir, output_dir),
+        'brotli': brotli is not None,
+        'assets': assets,
+    }
+    _write(staging / MANIFEST_NAME, json.dumps(manifest, indent=2).encode())
+
+    # Swap in the new build; a request racing the swap falls back to the source
+    old = output_dir.with_name(f'{output_dir.name}.{os.getpid()}.old')
+    try:
+        if output_dir.exists():
+            os.replace(output_dir, old)
+        os.replace(staging, output_dir)
+    except OSError:
+        # Another process swapped in its (identical) build first
+        pass
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+    return manifest
+
+
+class StaticAssets:
+    """Serves the built frontend, building it first if it is missing or stale"""
+
+    def __init__(self, source_dir=SOURCE_DIR, output_dir=None):
+        self.source_dir = Path(source_dir).resolve()
+        self.output_dir = Path(output_dir or os.environ.get('STATIC_BUILD_DIR') or self.source_dir / 'dist')
+        self._lock = threading.Lock()
+        self.manifest = None
+        self.hashed = set()
+
+    def ensure_built(self):
+        """Load the manifest, rebuilding the output if the sources changed"""
+        if self.manifest is not None:
+            return self.manifest
+        with self._lock:
+            if self.manifest is None:
+                manifest_path = self.output_dir / MANIFEST_NAME
+                digest = source_digest(self.source_dir, self.output_dir)
+                try:
+                    manifest = json.loads(manifest_path.read_text())
+                except (OSError, ValueError):
+                    manifest = None
+                if not manifest or manifest.get('source_digest') != digest:
+                    print(f"Building static assets into {self.output_dir}")
+                    manifest = build_assets(self.source_dir, self.output_dir)
+                self.hashed = set(manifest['assets'].values())
+                self.manifest = manifest
+        return self.manifest
+
+    def send(self, path):
+        """
+        Response for a frontend path: the precompressed variant the client
+        accepts, immutable caching for hashed names, revalidation otherwise
+        """
+        self.ensure_built()
+        target = (self.output_dir / path).resolve()
+        if not target.is_relative_to(self.output_dir.resolve()) or not target.is_file():
+            # Unknown or un-hashed legacy name: serve the source as before
+            response = send_from_directory(self.source_dir, path)
+            response.headers['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+            return response
+
+        mimetype = mimetypes.guess_type(target.name)[0] or 'application/octet-stream'
+        encoding = None
+        body_path = target
+        for name, suffix in ENCODINGS:
+            variant = target.with_name(target.name + suffix)
+            if request.accept_encodings[name] and variant.exists():
+                encoding, body_path = name, variant
+                break
+
+        response = send_file(body_path, mimetype=mimetype, conditional=True)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if path in self.hashed \
+            else REVALIDATE_CACHE_CONTROL
+        return response
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed frontend assets')
+    parser.add_argument('--source', default=str(SOURCE_DIR))
+    parser.add_argument('--output', default=os.environ.get('STATIC_BUILD_DIR'),
+                        help='Output directory (default: <source>/dist or $STATIC_BUILD_DIR)')
+    args = parser.parse_args(argv)
+    manifest = build_assets(args.source, args.output)
+    for logical, hashed in sorted(manifest['assets'].items()):
+        print(f'{logical} -> {hashed}')
+    if not manifest['brotli']:
+        print('brotli is not installed; only gzip variants were written')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
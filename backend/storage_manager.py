@@ -0,0 +1,338 @@
+"""
+Storage Manager
+Keeps the generated/ directory under a byte budget by evicting build
+artifacts (LRU or TTL) and orphaned uploads, and marks evicted jobs expired.
+
+Blob store references are reconciled with the job store on every sweep: a
+job holds a reference ('job:<job_id>') on its uploaded icon while it is
+pending or processing and on its APK while it is completed; synchronous
+requests hold theirs ('request:<id>') while the response is sent. Blobs
+nobody references are deleted after the orphan grace period.
+"""
+import os
+import time
+import threading
+from typing import Dict, List, Optional
+
+from backend.services.apk_delta import PATCH_EXTENSION, app_identity
+
+ARTIFACT_EXTENSIONS = ('.apk', '.zip', PATCH_EXTENSION)
+ACTIVE_STATUSES = ('pending', 'processing')
+
+
+class StorageManager:
+    def __init__(self, generated_dir, job_manager,
+                 max_bytes: Optional[int] = None,
+                 ttl_seconds: Optional[int] = None,
+                 icon_grace_seconds: int = 3600,
+                 orphan_grace_seconds: int = 600,
+                 sweep_interval: Optional[int] = None,
+                 icon_dir: Optional[str] = None,
+                 blob_store=None):
+        self.generated_dir = generated_dir
+        self.icon_dir = icon_dir or os.path.join(generated_dir, 'temp_icons')
+        self.job_manager = job_manager
+        self.blob_store = blob_store
+
+        # Budget/TTL from environment, 0 disables the respective policy
+        self.max_bytes = max_bytes if max_bytes is not None else \
+            int(os.environ.get('STORAGE_MAX_MB', '1024')) * 1024 * 1024
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else \
+            int(float(os.environ.get('STORAGE_TTL_HOURS', '168')) * 3600)
+        self.icon_grace_seconds = icon_grace_seconds
+        # A freshly published APK isn't referenced until its job completes
+        self.orphan_grace_seconds = orphan_grace_seconds
+        self.sweep_interval = sweep_interval if sweep_interval is not None else \
+            int(os.environ.get('STORAGE_SWEEP_INTERVAL', '300'))
+
+        self._sweep_lock = threading.Lock()
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def touch(self, path):
+        """Record an access for LRU ordering (bumps atime, keeps mtime)"""
+        try:
+            st = os.stat(path)
+            os.utime(path, (time.time(), st.st_mtime))
+        except OSError:
+            pass
+
+    def _list_artifacts(self) -> List[Dict]:
+        """Top-level loose files in generated/: delta patches and pre-blob-store APKs and zips"""
+        artifacts = []
+        try:
+            entries = list(os.scandir(self.generated_dir))
+        except FileNotFoundError:
+            return artifacts
+
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith(ARTIFACT_EXTENSIONS):
+                continue
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            job_id, ext = os.path.splitext(entry.name)
+            artifacts.append({
+                'path': entry.path,
+                'job_id': job_id,
+                'hash': job_id if ext == '.apk' else None,
+                'ext': ext,
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'last_access': max(st.st_atime, st.st_mtime)
+            })
+        return artifacts
+
+    def _list_blobs(self, jobs_by_hash) -> List[Dict]:
+        """
+        APK blobs in the same shape as _list_artifacts; other blobs (icons,
+        zips) are reported with evictable False and only count toward the budget
+        """
+        blobs = []
+        for blob in self.blob_store.list():
+            path = self.blob_store.path(blob['sha256'])
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            blobs.append({
+                'path': path,
+                'job_id': None,
+                'hash': blob['sha256'],
+                'blob': True,
+                'evictable': blob['sha256'] in jobs_by_hash,
+                'ext': '.apk',
+                'size': st.st_size,
+                'mtime': st.st_mtime,
+                'last_access': max(st.st_atime, st.st_mtime)
+            })
+        return blobs
+
+    def reconcile_refs(self, jobs) -> Dict:
+        """
+        Make job references in the blob store match the job records
+
+        References of pending and processing jobs are left alone (their APK is
+        referenced while it is published, before the job completes), as are
+        references younger than the orphan grace period whose job doesn't
+        exist yet. References held by synchronous requests ('request:<id>')
+        are dropped once they are older than the icon grace period.
+        """
+        stats = {'added': 0, 'released': 0}
+        wanted = set()
+        for job_id, job in jobs.items():
+            owner = f'job:{job_id}'
+            if job['status'] == 'completed' and job.get('apk_sha256'):
+                wanted.add((job['apk_sha256'], owner))
+            icon_sha256 = (job.get('inputs') or {}).get('icon_sha256')
+            if icon_sha256 and job['status'] in ACTIVE_STATUSES:
+                wanted.add((icon_sha256, owner))
+
+        cutoff = time.time() - self.orphan_grace_seconds
+        held = set()
+        for sha256, owner, created_at in list(self.blob_store.refs('job:')):
+            held.add((sha256, owner))
+            job = jobs.get(owner[len('job:'):])
+            if (sha256, owner) in wanted or (job and job['status'] in ACTIVE_STATUSES):
+                continue
+            if job is None and created_at > cutoff:
+                continue
+            stats['released'] += self.blob_store.release(sha256, owner)
+        for sha256, owner in wanted - held:
+            stats['added'] += self.blob_store.add_ref(sha256, owner)
+
+        # Synchronous requests release theirs once the response is sent;
+        # these were left by a process that died mid-request
+        stale = time.time() - self.icon_grace_seconds
+        for sha256, owner, created_at in list(self.blob_store.refs('request:')):
+            if created_at < stale:
+                stats['released'] += self.blob_store.release(sha256, owner)
+        return stats
+
+    def _latest_artifacts(self, jobs) -> set:
+        """
+        Hashes of the newest two APKs of every app, evicted for the budget
+        only after everything else, so the next build can usually be served
+        as a patch from the previous one
+        """
+        by_app = {}
+        for job in sorted(jobs.values(), key=lambda job: job.get('completed_at') or ''):
+            if job.get('apk_sha256') and job['status'] in ('completed', 'expired'):
+                hashes = by_app.setdefault(app_identity(job), [])
+                if job['apk_sha256'] in hashes:
+                    hashes.remove(job['apk_sha256'])
+                hashes.append(job['apk_sha256'])
+        return {apk_hash for hashes in by_app.values() for apk_hash in hashes[-2:]}
+
+    def _remove(self, path) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def _expire_job(self, job_id, reason):
+        self.job_manager.update_job(
+            job_id,
+            status='expired',
+            apk_path=None,
+            message=f'APK expired ({reason}). Please build again.'
+        )
+
+    def sweep_icons(self) -> int:
+        """Remove uploaded icons no active job still needs"""
+        removed = 0
+        try:
+            entries = list(os.scandir(self.icon_dir))
+        except FileNotFoundError:
+            return removed
+
+        jobs = self.job_manager.all_jobs()
+        cutoff = time.time() - self.icon_grace_seconds
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            job = jobs.get(entry.name.split('_', 1)[0])
+            if job and job['status'] in ACTIVE_STATUSES:
+                continue
+            try:
+                if entry.stat().st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            removed += self._remove(entry.path)
+        return removed
+
+    def sweep(self) -> Dict:
+        """
+        Run one eviction pass
+
+        Returns:
+            Dict with counts of evicted artifacts, expired jobs and freed bytes
+        """
+        with self._sweep_lock:
+            now = time.time()
+            jobs = self.job_manager.all_jobs()
+            stats = {'evicted': 0, 'expired_jobs': 0, 'freed_bytes': 0}
+            expired = set()
+
+            # APKs are named by content hash and may be shared by several jobs
+            jobs_by_path, jobs_by_hash = {}, {}
+            for job_id, job in jobs.items():
+                if job.get('apk_path'):
+                    jobs_by_path.setdefault(os.path.abspath(job['apk_path']), []).append(job_id)
+                if job.get('apk_sha256') and job['status'] == 'completed':
+                    jobs_by_hash.setdefault(job['apk_sha256'], []).append(job_id)
+
+            blobs = []
+            if self.blob_store:
+                self.reconcile_refs(jobs)
+                collected = self.blob_store.collect_garbage(self.orphan_grace_seconds)
+                stats['evicted'] += collected['deleted']
+                stats['freed_bytes'] += collected['freed_bytes']
+                blobs = self._list_blobs(jobs_by_hash)
+
+            def evict(artifact, reason):
+                if artifact.get('blob'):
+                    job_ids = [job_id for job_id in jobs_by_hash.get(artifact['hash'], [])
+                               if not jobs[job_id].get('apk_path')]
+                    # Only references this snapshot knows of: a job that completed
+                    # with the same APK since, or a download in progress, keeps it
+                    freed = self.blob_store.delete(
+                        artifact['hash'],
+                        owners={f'job:{job_id}' for job_id in jobs_by_hash[artifact['hash']]})
+                    if freed is None:
+                        return False
+                    stats['freed_bytes'] += freed
+                else:
+                    stats['freed_bytes'] += self._remove(artifact['path'])
+                    job_ids = jobs_by_path.get(os.path.abspath(artifact['path']), [])
+                stats['evicted'] += 1
+                for job_id in job_ids:
+                    if jobs[job_id]['status'] == 'completed' and job_id not in expired:
+                        self._expire_job(job_id, reason)
+                        expired.add(job_id)
+                        stats['expired_jobs'] += 1
+                return True
+
+            kept = [blob for blob in blobs if not blob['evictable']]
+            for artifact in self._list_artifacts() + [blob for blob in blobs if blob['evictable']]:
+                if artifact['ext'] == '.apk' and not artifact.get('blob'):
+                    job = jobs.get(artifact['job_id'])
+                    # APK still being written (legacy job-named artifacts)
+                    if job and job['status'] in ACTIVE_STATUSES:
+                        continue
+                    if os.path.abspath(artifact['path']) not in jobs_by_path:
+                        # Just published, its job is about to complete
+                        if now - artifact['mtime'] < self.orphan_grace_seconds:
+                            continue
+                        evict(artifact, 'orphaned')
+                        continue
+                if self.ttl_seconds and now - artifact['last_access'] > self.ttl_seconds:
+                    evict(artifact, 'ttl')
+                    continue
+                kept.append(artifact)
+
+            if self.max_bytes:
+                total = sum(a['size'] for a in kept)
+                latest = self._latest_artifacts(jobs)
+                # Least recently used first; every app's latest builds last
+                for artifact in sorted(kept, key=lambda a: (a['hash'] in latest, a['last_access'])):
+                    if total <= self.max_bytes:
+                        break
+                    if artifact.get('evictable') is False:
+                        continue
+                    if evict(artifact, 'storage budget'):
+                        total -= artifact['size']
+
+            # Completed jobs whose file vanished can never be downloaded
+            for job_id, job in jobs.items():
+                if job_id in expired or job['status'] != 'completed':
+                    continue
+                if job.get('apk_path'):
+                    missing = not os.path.exists(job['apk_path'])
+                elif self.blob_store and job.get('apk_sha256'):
+                    missing = not self.blob_store.exists(job['apk_sha256'])
+                else:
+                    continue
+                if missing:
+                    self._expire_job(job_id, 'missing')
+                    stats['expired_jobs'] += 1
+
+            stats['freed_bytes'] += self.sweep_icons()
+            return stats
+
+    def _lower_priority(self):
+        """Best effort: run the reaper thread at the lowest CPU priority"""
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
+
+    def _reaper_loop(self):
+        self._lower_priority()
+        while not self._stop.wait(self.sweep_interval):
+            try:
+                stats = self.sweep()
+                if stats['evicted'] or stats['freed_bytes']:
+                    print(f"Storage reaper: evicted {stats['evicted']} artifacts, "
+                          f"freed {stats['freed_bytes']} bytes")
+            except Exception as e:
+                print(f"Storage reaper error: {e}")
+
+    def start_reaper(self):
+        """Start the background reaper thread (idempotent)"""
+        if self._reaper and self._reaper.is_alive():
+            return self._reaper
+        if self.sweep_interval <= 0:
+            return None
+        self._stop.clear()
+        self._reaper = threading.Thread(target=self._reaper_loop,
+                                        name='storage-reaper', daemon=True)
+        self._reaper.start()
+        return self._reaper
+
+    def stop_reaper(self):
+        self._stop.set()
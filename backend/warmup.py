@@ -0,0 +1,205 @@
+"""
+Startup warm-up
+Right after a deploy nothing is warm, so the first builds pay for parsing
+config, decompiling templates, starting apktool daemons, reading the
+keystore and loading Pillow's codecs. Warmup does all of that once in a
+background thread when a process starts and records per-component status
+for /readyz, so a load balancer only routes build traffic to warmed
+instances. Build-only components are skipped on API-only nodes
+(BUILD_WORKERS=0).
+
+Failed components are retried with exponential backoff. Components that
+builds can do without (the apktool daemons, the template cache and the
+imaging preload only save time) report 'degraded' when they fail, which
+still counts as ready, so one slow or flaky warm-up never keeps an
+instance out of rotation for good.
+
+Configuration:
+    WARMUP              set to 0 to skip warming (every component reports 'skipped')
+    WARMUP_RETRIES      retry rounds for failed components (default: 5)
+    WARMUP_RETRY_DELAY  seconds before the first retry, doubled per round (default: 5)
+"""
+import os
+import json
+import time
+import shutil
+import subprocess
+import threading
+from datetime import datetime
+
+CONFIG_PATH = 'apk_builder/config.json'
+
+# Components only needed where builds run
+BUILD_COMPONENTS = ('apktool_daemon', 'templates', 'signing', 'imaging')
+
+# Components builds fall back from (per-build apktool runs and decodes, lazy imports)
+FALLBACK_COMPONENTS = ('apktool_daemon', 'templates', 'imaging')
+
+# Statuses that count as warm
+WARM_STATUSES = ('ready', 'skipped', 'degraded')
+
+# Longest wait between retry rounds
+MAX_RETRY_DELAY = 300
+
+
+class Skipped(Exception):
+    """A component that doesn't apply to this process"""
+
+
+class Warmup:
+    def __init__(self, job_manager, build_workers, static_assets=None, enabled=None,
+                 retries=None, retry_delay=None):
+        self.job_manager = job_manager
+        self.build_workers = build_workers
+        self.static_assets = static_assets
+        self.enabled = enabled if enabled is not None else \
+            os.environ.get('WARMUP', '1').lower() not in ('0', 'false', 'no')
+        self.retries = retries if retries is not None else int(os.environ.get('WARMUP_RETRIES', '5'))
+        self.retry_delay = retry_delay if retry_delay is not None else \
+            float(os.environ.get('WARMUP_RETRY_DELAY', '5'))
+        self.steps = [
+            ('config', self._warm_config),
+            ('job_store', self._warm_job_store),
+            ('static_assets', self._warm_static_assets),
+            ('apktool_daemon', self._warm_apktool_daemon),
+            ('templates', self._warm_templates),
+            ('signing', self._warm_signing),
+            ('imaging', self._warm_imaging),
+        ]
+        self.components = {name: {'status': 'pending'} for name, _ in self.steps}
+        self.started_at = None
+        self.finished_at = None
+        self._config = None
+        self._thread = None
+
+    def start(self):
+        """Warm up in a background thread"""
+        self._thread = threading.Thread(target=self.run, name='warmup', daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        self.started_at = datetime.now().isoformat()
+        for name, step in self.steps:
+            component = self.components[name]
+            if not self.enabled:
+                component.update(status='skipped', detail='WARMUP=0')
+                continue
+            if name in BUILD_COMPONENTS and self.build_workers <= 0:
+                component.update(status='skipped', detail='no build workers in this process')
+                continue
+            component['status'] = 'warming'
+            self._attempt(name, step)
+        print("Warm-up finished: " + self._summary())
+
+        delay = self.retry_delay
+        for _ in range(self.retries):
+            failed = [(name, step) for name, step in self.steps
+                      if self.components[name]['status'] in ('failed', 'degraded')]
+            if not failed:
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+            for name, step in failed:
+                self._attempt(name, step)
+            print("Warm-up retried: " + self._summary())
+        self.finished_at = datetime.now().isoformat()
+
+    def _attempt(self, name, step):
+        """Run one step; a failure leaves the component failed (or degraded) for a retry"""
+        component = self.components[name]
+        component['attempts'] = component.get('attempts', 0) + 1
+        started = time.monotonic()
+        try:
+            detail = step()
+            component.update(status='ready', detail=detail)
+            component.pop('error', None)
+        except Skipped as e:
+            component.update(status='skipped', detail=str(e))
+            component.pop('error', None)
+        except Exception as e:
+            status = 'degraded' if name in FALLBACK_COMPONENTS else 'failed'
+            component.update(status=status, error=str(e))
+            print(f"Warm-up of {name} failed (attempt {component['attempts']}): {e}")
+        component['seconds'] = round(time.monotonic() - started, 3)
+
+    def _summary(self):
+        return ', '.join(f"{name}={c['status']}" for name, c in self.components.items())
+
+    @property
+    def ready(self) -> bool:
+        # Ready once every component has settled warm; retries of degraded ones continue
+        return all(c['status'] in WARM_STATUSES for c in self.components.values())
+
+    def report(self):
+        """Readiness and per-component warm status"""
+        return {
+            'ready': self.ready,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'components': {name: dict(c) for name, c in self.components.items()},
+        }
+
+    def _warm_config(self):
+        with open(CONFIG_PATH, 'r') as f:
+            self._config = json.load(f)
+        versions = self._config.get('base_versions') or {}
+        missing = [name for name, base in versions.items() if not base.get('apk_path')]
+        if not versions or missing:
+            raise ValueError(f'base versions without apk_path: {missing}' if missing else 'no base versions')
+        return f'{len(versions)} base version(s)'
+
+    def _warm_job_store(self):
+        jobs = self.job_manager.all_jobs()
+        return f'{len(jobs)} job(s)'
+
+    def _warm_static_assets(self):
+        if self.static_assets is None:
+            raise Skipped('no frontend in this process')
+        manifest = self.static_assets.ensure_built()
+        return f"{len(manifest['assets'])} fingerprinted asset(s), brotli={'yes' if manifest['brotli'] else 'no'}"
+
+    def _warm_apktool_daemon(self):
+        from apk_builder.tool_daemon import get_daemon_pool
+        pool = get_daemon_pool()
+        if pool is None:
+            raise Skipped('APKTOOL_DAEMON not enabled')
+        return f'{pool.warm()} daemon(s) running'
+
+    def _warm_templates(self):
+        from apk_builder.template_cache import get_template_cache
+        cache = get_template_cache()
+        if cache is None:
+            raise Skipped('APK_TEMPLATE_CACHE disabled')
+        versions = self._config['base_versions']
+        missing = [name for name, base in versions.items() if not os.path.exists(base['apk_path'])]
+        if missing:
+            raise FileNotFoundError(f"template APK missing for {', '.join(missing)}")
+        built = [name for name, base in versions.items() if cache.warm(name, base['apk_path'])]
+        return f"{len(versions)} template(s) cached, intermediates built for {len(built)}"
+
+    def _warm_signing(self):
+        keystore = self._config['keystore']
+        path = os.getenv('KEYSTORE_PATH', keystore['path'])
+        # Reading it once puts it in the page cache for the first jarsigner run
+        with open(path, 'rb') as f:
+            size = len(f.read())
+        keytool = shutil.which('keytool')
+        if not keytool:
+            return f'keystore readable ({size} bytes), keytool not found so credentials unchecked'
+        result = subprocess.run(
+            [keytool, '-list', '-keystore', path,
+             '-storepass', os.getenv('KEYSTORE_PASS', keystore['store_pass']),
+             '-alias', os.getenv('KEYSTORE_ALIAS', keystore['alias'])],
+            capture_output=True, text=True, timeout=120)
+        if result.returncode != 0:
+            raise ValueError(f'keystore check failed: {(result.stdout + result.stderr).strip()[:200]}')
+        return 'keystore and signing key verified'
+
+    def _warm_imaging(self):
+        # Icon resizing loads Pillow's codecs and the builder on first use
+        from PIL import Image
+        import apk_builder.builder  # noqa: F401
+        Image.init()
+        Image.new('RGBA', (192, 192)).resize((48, 48), Image.Resampling.LANCZOS)
+        return f'{len(Image.OPEN)} image formats'
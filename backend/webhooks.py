@@ -0,0 +1,413 @@
+"""
+Completion Webhooks
+A build submitted with a callback_url gets a signed POST when it completes
+or fails, so API clients don't have to poll /api/v1/download/<job_id>.
+
+Delivery state lives on the job record ('webhook'), so it survives restarts
+and is shared by every process using the job store. A JobManager listener
+wakes the dispatcher as soon as a job finishes in this process; a periodic
+scan picks up jobs finished elsewhere (build worker nodes), retries that
+are due and deliveries whose owner died mid-attempt. Deliveries run in a
+bounded thread pool, and each is leased in the job store first so two
+processes never send the same attempt.
+
+Signing: every payload is signed with HMAC-SHA256 using a per-API-key secret
+(returned as webhook_secret by /api/v1/build-apk):
+    X-Webhook-Timestamp: <unix seconds>
+    X-Webhook-Signature: sha256=<hex HMAC of "<timestamp>.<body>">
+The per-key secrets are derived from WEBHOOK_SECRET, or from a random secret
+stored in <JOB_DB_DIR>/webhook_secret when it isn't set.
+
+Callback hosts are resolved and checked when the build is submitted and
+again before every attempt; the attempt connects to the checked address
+(HTTPS still verifies the certificate against the URL's hostname).
+
+Retries: network errors, timeouts, 408, 429 and 5xx responses are retried
+with exponential backoff (WEBHOOK_BACKOFF_SECONDS doubling, capped at an
+hour, honouring Retry-After) up to WEBHOOK_MAX_ATTEMPTS; other responses fail
+the delivery for good.
+
+Configuration:
+    WEBHOOK_SECRET           master signing secret (shared by all nodes)
+    WEBHOOK_WORKERS          concurrent deliveries per process (default 4)
+    WEBHOOK_MAX_ATTEMPTS     attempts before giving up (default 8)
+    WEBHOOK_TIMEOUT          seconds per attempt (default 10)
+    WEBHOOK_BACKOFF_SECONDS  delay before the first retry (default 10)
+    WEBHOOK_POLL_INTERVAL    seconds between scans of the job store (default 15)
+    WEBHOOK_ALLOW_PRIVATE    set to 1 to allow callbacks to private/loopback
+                             addresses (local testing)
+
+Local receiver for testing:
+    python -m backend.webhooks receive --port 8099 --secret whsec_...
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import socket
+import hashlib
+import secrets
+import argparse
+import ipaddress
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlparse
+
+from backend.build_queue import process_owner_id
+from common.tracing import tracer
+
+# Longest wait between attempts
+MAX_BACKOFF_SECONDS = 3600
+# Receivers must reject signatures older than this
+SIGNATURE_TOLERANCE_SECONDS = 300
+MAX_CALLBACK_URL_LENGTH = 2048
+# Response statuses worth retrying (besides 5xx)
+RETRYABLE_STATUSES = (408, 429)
+
+
+def _env_flag(name):
+    return os.environ.get(name, '0').lower() in ('1', 'true', 'yes')
+
+
+def load_master_secret(db_dir):
+    """WEBHOOK_SECRET, or a random secret created once in db_dir"""
+    secret = os.environ.get('WEBHOOK_SECRET')
+    if secret:
+        return secret.encode()
+    path = os.path.join(db_dir, 'webhook_secret')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secrets.token_hex(32).encode())
+    with open(path, 'rb') as f:
+        return f.read().strip()
+
+
+def key_secret(master_secret, key_id) -> str:
+    """Signing secret for one API key's webhooks"""
+    digest = hmac.new(master_secret, f'webhook:{key_id}'.encode(), hashlib.sha256).hexdigest()
+    return f'whsec_{digest}'
+
+
+def sign(secret, timestamp, body) -> str:
+    """X-Webhook-Signature value for body sent at timestamp"""
+    message = f'{timestamp}.'.encode() + body
+    return 'sha256=' + hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_signature(secret, timestamp, body, signature, tolerance=SIGNATURE_TOLERANCE_SECONDS) -> bool:
+    """Receiver-side check of a delivery's signature and age"""
+    try:
+        if abs(time.time() - int(timestamp)) > tolerance:
+            return False
+    except (TypeError, ValueError):
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), signature or '')
+
+
+def resolve_callback_host(host, allow_private=False):
+    """
+    The address to send a callback to
+
+    Returns:
+        One of host's addresses, or None if it doesn't resolve or (unless
+        allow_private) any of its addresses isn't public
+    """
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)]
+    except (socket.gaierror, UnicodeError):
+        return None
+    if not addresses:
+        return None
+    if not allow_private and not all(ipaddress.ip_address(address.split('%')[0]).is_global
+                                     for address in addresses):
+        return None
+    return addresses[0]
+
+
+def _is_public_host(host):
+    return resolve_callback_host(host) is not None
+
+
+def _pinned_url(parsed, address):
+    """The URL with its host replaced by address, so the request goes where the check went"""
+    host = '[%s]' % address.replace('%', '%25') if ':' in address else address
+    userinfo = parsed.netloc.rpartition('@')[0]
+    netloc = (f'{userinfo}@' if userinfo else '') + host + (f':{parsed.port}' if parsed.port else '')
+    return parsed._replace(netloc=netloc).geturl()
+
+
+def _pinned_session(hostname):
+    """requests session whose HTTPS connections send SNI for, and verify the certificate of, hostname"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    class PinnedHostAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            kwargs.update(server_hostname=hostname, assert_hostname=hostname)
+            super().init_poolmanager(*args, **kwargs)
+
+    session = requests.Session()
+    session.mount('https://', PinnedHostAdapter())
+    return session
+
+
+def validate_callback_url(url):
+    """
+    Check a client-supplied callback URL
+
+    Returns:
+        An error message, or None if the URL is acceptable
+    """
+    if len(url) > MAX_CALLBACK_URL_LENGTH:
+        return f'callback_url must be at most {MAX_CALLBACK_URL_LENGTH} characters'
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return 'callback_url must be an absolute http(s) URL'
+    if not _env_flag('WEBHOOK_ALLOW_PRIVATE') and not _is_public_host(parsed.hostname):
+        return 'callback_url must resolve to a public address'
+    return None
+
+
+def build_payload(job):
+    """Body POSTed for a finished job"""
+    webhook = job['webhook']
+    payload = {
+        'event': f"job.{job['status']}",
+        'job_id': job['job_id'],
+        'status': job['status'],
+        'app_name': job['app_name'],
+        'url': job['url'],
+        'error': job.get('error'),
+        'completed_at': job.get('completed_at'),
+        'status_url': webhook.get('status_url'),
+        'attempt': webhook.get('attempts', 0) + 1,
+    }
+    if job['status'] == 'completed':
+        payload.update(download_url=webhook.get('download_url'), apk_sha256=job.get('apk_sha256'))
+    return payload
+
+
+def retry_delay(attempt, base, retry_after=None):
+    """Seconds before the next attempt after `attempt` failed ones"""
+    delay = min(base * 2 ** (attempt - 1), MAX_BACKOFF_SECONDS)
+    # Jitter spreads out retries to a receiver that was down for everyone
+    delay *= random.uniform(0.8, 1.2)
+    if retry_after:
+        delay = max(delay, min(retry_after, MAX_BACKOFF_SECONDS))
+    return delay
+
+
+class WebhookDispatcher:
+    def __init__(self, job_manager, master_secret=None, workers=None, max_attempts=None,
+                 timeout=None, backoff_seconds=None, poll_interval=None):
+        self.job_manager = job_manager
+        self.master_secret = master_secret or load_master_secret(job_manager.db_dir)
+        self.workers = workers if workers is not None else int(os.environ.get('WEBHOOK_WORKERS', '4'))
+        self.max_attempts = max_attempts if max_attempts is not None else \
+            int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+        self.timeout = timeout if timeout is not None else float(os.environ.get('WEBHOOK_TIMEOUT', '10'))
+        self.backoff_seconds = backoff_seconds if backoff_seconds is not None else \
+            float(os.environ.get('WEBHOOK_BACKOFF_SECONDS', '10'))
+        self.poll_interval = poll_interval if poll_interval is not None else \
+            float(os.environ.get('WEBHOOK_POLL_INTERVAL', '15'))
+        # An attempt that outlives its lease is assumed dead and taken over
+        self.lease_seconds = self.timeout * 2 + 30
+
+        self.owner = process_owner_id()
+        self._executor = None
+        self._in_flight = 0
+        self._finished = set()
+        self._wakeup = threading.Condition()
+        self._thread = None
+
+    def secret_for(self, key_id) -> str:
+        return key_secret(self.master_secret, key_id)
+
+    def on_job_finished(self, job):
+        """JobManager listener: deliver right away instead of at the next scan"""
+        if job.get('webhook') and job['status'] in ('completed', 'failed'):
+            with self._wakeup:
+                self._finished.add(job['job_id'])
+                self._wakeup.notify_all()
+
+    def start(self):
+        """Hook into job completion and start the dispatch loop"""
+        if self._thread:
+            return
+        self.job_manager.add_listener(self.on_job_finished)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='webhook')
+        self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        next_scan = 0
+        while True:
+            with self._wakeup:
+                while not self._finished and time.monotonic() < next_scan:
+                    self._wakeup.wait(max(0.0, next_scan - time.monotonic()))
+                while self._in_flight >= self.workers:
+                    self._wakeup.wait()
+                finished, self._finished = self._finished, set()
+                free = self.workers - self._in_flight
+            try:
+                if finished:
+                    jobs = self.job_manager.claim_webhooks(self.owner, self.lease_seconds, free,
+                                                           job_ids=sorted(finished))
+                else:
+                    jobs = self.job_manager.claim_webhooks(self.owner, self.lease_seconds, free)
+                    next_scan = time.monotonic() + self.poll_interval
+            except Exception as e:
+                print(f"Webhook dispatcher: claim failed: {e}")
+                jobs = []
+                next_scan = time.monotonic() + self.poll_interval
+            if finished and len(jobs) == free:
+                # Pool is full; whatever wasn't claimed is found by the next scan
+                next_scan = 0
+            for job in jobs:
+                with self._wakeup:
+                    self._in_flight += 1
+                self._executor.submit(self._deliver_and_release, job)
+
+    def _deliver_and_release(self, job):
+        try:
+            self.deliver(job)
+        except Exception as e:
+            print(f"Webhook dispatcher: delivery error for job {job['job_id']}: {e}")
+        finally:
+            with self._wakeup:
+                self._in_flight -= 1
+                self._wakeup.notify_all()
+
+    def deliver(self, job):
+        """Make one delivery attempt for a claimed job and record the outcome"""
+        import requests
+
+        webhook = job['webhook']
+        attempt = webhook.get('attempts', 0) + 1
+        body = json.dumps(build_payload(job), sort_keys=True).encode()
+        timestamp = str(int(time.time()))
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'Web2AppConverter-Webhook/1.0',
+            'X-Webhook-Id': job['job_id'],
+            'X-Webhook-Event': f"job.{job['status']}",
+            'X-Webhook-Attempt': str(attempt),
+            'X-Webhook-Timestamp': timestamp,
+            'X-Webhook-Signature': sign(self.secret_for(job.get('key_id')), timestamp, body),
+        }
+        if job.get('traceparent'):
+            headers['traceparent'] = job['traceparent']
+
+        status_code, retry_after, error, retryable = None, None, None, True
+        with tracer.span('webhook.deliver', parent=job.get('traceparent'),
+                         job_id=job['job_id'], attempt=attempt) as span:
+            parsed = urlparse(webhook['url'])
+            # Checked again at send time: DNS may have changed since submission.
+            # The request then connects to the address that was checked, so a
+            # second lookup can't swap in a private one (DNS rebinding).
+            address = resolve_callback_host(parsed.hostname, _env_flag('WEBHOOK_ALLOW_PRIVATE'))
+            if address is None:
+                error = 'callback_url no longer resolves to a public address'
+                retryable = False
+            else:
+                headers['Host'] = parsed.netloc.rpartition('@')[2]
+                try:
+                    with _pinned_session(parsed.hostname) as session:
+                        response = session.post(_pinned_url(parsed, address), data=body, headers=headers,
+                                                timeout=self.timeout, allow_redirects=False)
+                    status_code = response.status_code
+                    span.set_attribute('status_code', status_code)
+                    if response.headers.get('Retry-After', '').isdigit():
+                        retry_after = int(response.headers['Retry-After'])
+                    if not 200 <= status_code < 300:
+                        error = f'HTTP {status_code}'
+                        retryable = status_code >= 500 or status_code in RETRYABLE_STATUSES
+                except requests.RequestException as e:
+                    error = f'{type(e).__name__}: {e}'
+
+        now = datetime.now()
+        state = dict(attempts=attempt, last_attempt_at=now.isoformat(),
+                     last_status_code=status_code, last_error=error)
+        if error is None:
+            state.update(status='delivered', delivered_at=now.isoformat(), next_attempt_at=None)
+        elif retryable and attempt < self.max_attempts:
+            delay = retry_delay(attempt, self.backoff_seconds, retry_after)
+            state.update(status='retrying',
+                         next_attempt_at=datetime.fromtimestamp(now.timestamp() + delay).isoformat())
+        else:
+            state.update(status='failed', next_attempt_at=None)
+            print(f"Webhook for job {job['job_id']} failed after {attempt} attempt(s): {error}")
+        self.job_manager.set_webhook_state(job['job_id'], self.owner, **state)
+        return state
+
+
+def public_state(webhook):
+    """Delivery state safe to show to the job's owner"""
+    if not webhook:
+        return None
+    return {key: webhook.get(key) for key in
+            ('url', 'status', 'attempts', 'last_attempt_at', 'last_status_code',
+             'last_error', 'next_attempt_at', 'delivered_at')}
+
+
+def run_receiver(port, secret=None, fail_first=0):
+    """Local HTTP receiver that prints deliveries and checks their signatures"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    failures = {'left': fail_first}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if secret:
+                verified = verify_signature(secret, self.headers.get('X-Webhook-Timestamp'), body,
+                                            self.headers.get('X-Webhook-Signature'))
+            else:
+                verified = None
+            with lock:
+                fail = failures['left'] > 0
+                failures['left'] -= fail
+            status = 503 if fail else (401 if verified is False else 200)
+            print(f"{datetime.now().isoformat()} {self.headers.get('X-Webhook-Event')} "
+                  f"job={self.headers.get('X-Webhook-Id')} attempt={self.headers.get('X-Webhook-Attempt')} "
+                  f"signature={'unchecked' if verified is None else 'ok' if verified else 'BAD'} -> {status}")
+            print(body.decode(errors='replace'))
+            sys.stdout.flush()
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    print(f"{datetime.now().isoformat()} webhook receiver listening on 127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Webhook utilities')
+    commands = parser.add_subparsers(dest='command', required=True)
+    receive = commands.add_parser('receive', help='Run a local receiver that prints deliveries')
+    receive.add_argument('--port', type=int, default=8099)
+    receive.add_argument('--secret', help='webhook_secret from the build response, to verify signatures')
+    receive.add_argument('--fail-first', type=int, default=0,
+                         help='Answer this many deliveries with 503 to exercise retries')
+    args = parser.parse_args(argv)
+    if args.command == 'receive':
+        run_receiver(args.port, args.secret, args.fail_first)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+Standalone build worker
+Pulls jobs from the shared build queue, reports progress through JobManager
+and publishes signed APKs to the shared artifact store.
+
+Usage (from the project root):
+    python -m backend.worker --queue sqlite:///shared/db/build_queue.sqlite3 \
+        --db-dir /shared/db --artifact-store /shared/generated --workers 2
+"""
+import os
+import time
+import argparse
+from datetime import datetime
+
+from backend.job_manager import JobManager
+from backend.build_queue import BuildQueue, create_job_queue
+from backend.artifact_store import create_artifact_store
+from common.tracing import tracer
+from backend.profiling import ProfileStore, profile_call, start_stack_sampler
+from backend.warmup import Warmup
+from backend.webhooks import WebhookDispatcher
+from backend.services.apk_delta import PatchCache
+
+
+def run_build_job(job, job_manager, artifact_store, profile_store=None):
+    """
+    Run one leased build job: build, publish the APK, record the result
+
+    Runs synchronously on the calling build queue thread. Every job update
+    is made under the job's lease, so a build whose lease was lost (and
+    whose job was requeued and claimed again) can't overwrite the new run.
+
+    Jobs submitted with profiling requested run under cProfile; the profile
+    is saved to profile_store as job-<job_id>
+    """
+    # Continue the trace of the request that submitted the job (this runs on a
+    # queue thread, possibly in another process)
+    traceparent = job.get('traceparent')
+    if tracer.enabled and job.get('started_at'):
+        tracer.record('queue.wait',
+                      datetime.fromisoformat(job['created_at']).timestamp(),
+                      datetime.fromisoformat(job['started_at']).timestamp(),
+                      parent=traceparent, job_id=job['job_id'])
+    with tracer.span('build_job', parent=traceparent, job_id=job['job_id'],
+                     attempt=job.get('attempts', 1)):
+        if profile_store and (job.get('inputs') or {}).get('profile'):
+            profile_call(profile_store, f"job-{job['job_id']}", _run_build_job,
+                         job, job_manager, artifact_store, kind='build', job_id=job['job_id'])
+        else:
+            _run_build_job(job, job_manager, artifact_store)
+
+
+def _run_build_job(job, job_manager, artifact_store):
+    from apk_builder.builder import APKBuilder
+
+    job_id = job['job_id']
+    inputs = job['inputs']
+    lease = job_manager.lease_of(job)
+    blobs = artifact_store.blobs
+    # Uploaded icons are blobs; jobs queued before the blob store have a path
+    icon_path = blobs.path(inputs['icon_sha256']) if inputs.get('icon_sha256') else inputs.get('icon_path')
+    builder = None
+    finished = False
+
+    try:
+        # Update status to processing
+        job_manager.set_processing(job_id, 'Starting APK build...', lease=lease)
+
+        # Build APK
+        builder = APKBuilder(base_version=inputs['base_version'])
+
+        job_manager.set_progress(job_id, 20, 'Decompiling base APK...', lease=lease)
+
+        apk_path = builder.build(
+            app_name=inputs['app_name'],
+            url=inputs['url'],
+            icon_path=icon_path,
+            app_names=inputs.get('app_names')
+        )
+
+        job_manager.set_progress(job_id, 90, 'Finalizing APK...', lease=lease)
+
+        # Publish APK to the blob store under its content hash: builds are
+        # reproducible, so identical inputs on any node share one blob
+        with tracer.span('publish'):
+            apk_sha256 = blobs.put_file(apk_path, owner=f'job:{job_id}')
+
+        # Update job as completed (content hash doubles as the download ETag)
+        finished = job_manager.set_completed(job_id, apk_sha256,
+                                             stage_timings=builder.stage_timings,
+                                             workspace=builder.workspace,
+                                             lease=lease) is not None
+        if finished:
+            print(f"Build {job_id} finished in {builder.workspace} workspace: {builder.stage_timings}")
+        else:
+            print(f"Build {job_id} lost its lease; discarding this result")
+
+        # Cleanup (icons of jobs queued before the blob store)
+        if finished and not inputs.get('icon_sha256') and icon_path and os.path.exists(icon_path):
+            try:
+                os.remove(icon_path)
+            except OSError:
+                pass
+
+    except Exception as e:
+        # Update job as failed
+        finished = job_manager.set_failed(job_id, str(e), lease=lease) is not None
+        print(f"Background APK Build Error for job {job_id}: {str(e)}")
+        import traceback
+        traceback.print_exc()
+
+    finally:
+        # Always free the work dir (it may be holding RAM)
+        if builder is not None:
+            builder.cleanup()
+        # The job is finished either way, so it no longer needs its icon
+        # (unless it was requeued, and the run that now holds it still does)
+        if finished and inputs.get('icon_sha256'):
+            blobs.release(inputs['icon_sha256'], f'job:{job_id}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='APK build worker')
+    parser.add_argument('--queue', default=os.environ.get('BUILD_QUEUE', 'local'),
+                        help='Queue backend: local or sqlite:///path (default: $BUILD_QUEUE)')
+    parser.add_argument('--db-dir', default=os.environ.get('JOB_DB_DIR', 'db'),
+                        help='Directory holding build_jobs.json (default: $JOB_DB_DIR or db)')
+    parser.add_argument('--artifact-store', default=os.environ.get('ARTIFACT_STORE', 'generated'),
+                        help='Artifact store directory (default: $ARTIFACT_STORE or generated)')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('BUILD_WORKERS', '1')),
+                        help='Concurrent builds in this process')
+    args = parser.parse_args(argv)
+
+    job_manager = JobManager(args.db_dir)
+    artifact_store = create_artifact_store(args.artifact_store)
+    queue = create_job_queue(args.queue, job_manager)
+    profile_store = ProfileStore(os.environ.get('PROFILE_DIR') or os.path.join(args.db_dir, 'profiles'))
+    start_stack_sampler(profile_store)
+    # Decompile templates, start apktool daemons etc. before the first job arrives
+    Warmup(job_manager, max(1, args.workers)).start()
+    # Completion webhooks for the jobs built here
+    WebhookDispatcher(job_manager).start()
+    # Patches from each app's previous build, ready before clients ask
+    PatchCache(artifact_store, job_manager).start()
+
+    build_queue = BuildQueue(
+        queue,
+        lambda job: run_build_job(job, job_manager, artifact_store, profile_store),
+        workers=max(1, args.workers)
+    )
+    build_queue.start()
+    print(f"Build worker {build_queue.owner} started: {build_queue.workers} worker(s), queue={args.queue}")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        build_queue.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark fixtures
+A throwaway project root (sandbox) with a synthetic base template, builder
+config, Android project template and a local HTTP site, so the benchmarks
+exercise the real code paths without an Android toolchain or the network.
+"""
+import io
+import os
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+import threading
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STUB_BIN = Path(__file__).resolve().parent / 'bin'
+
+# I/O profiles: size of the synthetic decompiled template
+IO_PROFILES = {
+    # A few hundred small files, for quick runs
+    'small': {'smali_files': 200, 'res_files': 100, 'file_bytes': 2048},
+    # Roughly the real base_1 template: ~8,000 files, ~90 MB decompiled
+    'full': {'smali_files': 6000, 'res_files': 2000, 'file_bytes': 11000},
+}
+
+MAIN_ACTIVITY = """.class public Lcom/web2app/bench/MainActivity;
+.super Landroid/app/Activity;
+
+.method protected onCreate(Landroid/os/Bundle;)V
+    .locals 2
+    const-string v0, "https://example.com"
+    return-void
+.end method
+"""
+
+
+def png_bytes(size=512, color=(32, 120, 200, 255)):
+    buffer = io.BytesIO()
+    Image.new('RGBA', (size, size), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _template_entries(profile):
+    """(path, bytes) pairs of the synthetic decompiled template"""
+    filler = (b'# filler\n' * (profile['file_bytes'] // 9 + 1))[:profile['file_bytes']]
+    yield 'AndroidManifest.xml', b'<manifest package="com.web2app.bench"/>\n'
+    yield 'apktool.yml', b'version: bench\n'
+    yield 'res/values/strings.xml', (b'<?xml version="1.0" encoding="utf-8"?>\n<resources>\n'
+                                     b'    <string name="app_name">Template</string>\n</resources>\n')
+    icon = png_bytes(192)
+    for density in ('mdpi', 'hdpi', 'xhdpi', 'xxhdpi', 'xxxhdpi'):
+        yield f'res/mipmap-{density}/ic_launcher.png', icon
+    for i in range(profile['res_files']):
+        yield f'res/layout/layout_{i}.xml', filler
+    folders = ('smali', 'smali_classes2', 'smali_classes3', 'smali_classes4')
+    for i in range(profile['smali_files']):
+        yield f'{folders[i % len(folders)]}/com/bench/Class{i}.smali', filler
+    yield 'smali_classes4/com/web2app/bench/MainActivity.smali', MAIN_ACTIVITY.encode()
+
+
+class Sandbox:
+    """Project root for one benchmark run; the process chdirs into it"""
+
+    def __init__(self, io_profile='small'):
+        self.root = Path(tempfile.mkdtemp(prefix='w2a_bench_'))
+        self.profile = IO_PROFILES[io_profile]
+        self._previous_cwd = None
+
+    def create(self):
+        (self.root / 'apk_builder').mkdir()
+        (self.root / 'android_templates_apks').mkdir()
+        (self.root / 'db').mkdir()
+
+        apk_path = self.root / 'android_templates_apks' / 'base_1.apk'
+        with zipfile.ZipFile(apk_path, 'w', zipfile.ZIP_STORED) as archive:
+            for path, data in _template_entries(self.profile):
+                archive.writestr(path, data)
+
+        with open(REPO_ROOT / 'apk_builder' / 'config.json') as f:
+            config = json.load(f)
+        config['base_versions'] = {'base_1': dict(config['base_versions']['base_1'],
+                                                  apk_path='android_templates_apks/base_1.apk')}
+        with open(self.root / 'apk_builder' / 'config.json', 'w') as f:
+            json.dump(config, f, indent=2)
+
+        self.android_template = self.root / 'android_templates'
+        java_dir = self.android_template / 'app' / 'src' / 'main' / 'java' / 'com' / 'web2app' / 'template'
+        java_dir.mkdir(parents=True)
+        (java_dir / 'MainActivity.kt').write_text(
+            'package {{PACKAGE_NAME}}\n// {{APP_NAME}} -> {{URL}}\n' * 50)
+        (self.android_template / 'app' / 'build.gradle').write_text(
+            'applicationId "{{PACKAGE_NAME}}"\n// offline={{ENABLE_OFFLINE}}\n' * 50)
+        res_dir = self.android_template / 'app' / 'src' / 'main' / 'res' / 'values'
+        res_dir.mkdir(parents=True)
+        (res_dir / 'strings.xml').write_text(
+            '<resources><string name="app_name">{{APP_NAME}}</string>'
+            '<color name="theme">{{THEME_COLOR}}</color></resources>\n')
+
+        # Only read by warm-up; the stand-in jarsigner doesn't sign for real
+        (self.root / 'android_templates_apks' / 'keystore.jks').write_bytes(b'benchmark keystore')
+
+        self.icon_path = self.root / 'icon.png'
+        self.icon_path.write_bytes(png_bytes(512))
+        return self
+
+    def enter(self):
+        """chdir into the sandbox and put the stub tools first on PATH"""
+        self._previous_cwd = os.getcwd()
+        os.chdir(self.root)
+        os.environ['PATH'] = f"{STUB_BIN}{os.pathsep}{os.environ.get('PATH', '')}"
+        os.environ.setdefault('APK_TEMPLATE_CACHE_DIR', str(self.root / 'apk_builder' / 'cache'))
+        os.environ.setdefault('GENERATED_DIR', str(self.root / 'generated'))
+        os.environ.setdefault('JOB_DB_DIR', str(self.root / 'db'))
+
+    def close(self):
+        if self._previous_cwd:
+            os.chdir(self._previous_cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+class FixtureSite:
+    """Local website with a title, og:title and favicon, and optional latency"""
+
+    def __init__(self, latency=0.0):
+        latency_seconds = latency
+        favicon = png_bytes(64)
+        page = (b'<html><head><title>Bench Site</title>'
+                b'<meta property="og:title" content="Bench Site App">'
+                b'<link rel="icon" href="/favicon.png"></head><body>hello</body></html>')
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(latency_seconds)
+                body, content_type = (favicon, 'image/png') if self.path.startswith('/favicon') \
+                    else (page, 'text/html; charset=utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
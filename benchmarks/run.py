@@ -0,0 +1,371 @@
+"""
+End-to-end benchmarks
+Drives APKBuilder.build, generate_android_project + create_zip,
+fetch_url_metadata and the Flask build API under concurrent load, times
+cold starts of the API process (import + first response) and the cost of
+tracing a build, using the stand-in apktool/jarsigner in benchmarks/bin and
+a local HTTP fixture site.
+Reports p50/p95/p99 latency and jobs per minute per suite and compares them
+with a stored JSON baseline.
+
+Usage (from the project root):
+    python -m benchmarks.run                          # compare with benchmarks/baseline.json
+    python -m benchmarks.run --update-baseline        # record a new baseline
+    python -m benchmarks.run --suites builder --io-profile full --latency-profile realistic
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+import argparse
+import platform
+import contextlib
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from benchmarks.fixtures import IO_PROFILES, FixtureSite, Sandbox  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / 'baseline.json'
+SUITES = ('builder', 'project', 'metadata', 'api', 'startup', 'tracing')
+
+# Seconds the stand-in tools sleep, on top of their real file I/O
+LATENCY_PROFILES = {
+    'none': {},
+    # Roughly a warm CI machine running the real toolchain
+    'realistic': {
+        'BENCH_APKTOOL_DECODE_LATENCY': '4.0',
+        'BENCH_APKTOOL_SMALI_LATENCY': '1.5',
+        'BENCH_APKTOOL_AAPT_LATENCY': '3.0',
+        'BENCH_JARSIGNER_LATENCY': '1.0',
+    },
+}
+
+# Ignore p95 changes smaller than this, they are scheduler noise
+MIN_REGRESSION_MS = 5.0
+
+# Tracing every build may add at most this much to its median time
+MAX_TRACING_OVERHEAD_PCT = 1.0
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(1, round(pct / 100.0 * len(ordered) + 0.4999))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def summarize(latencies, wall_seconds):
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'jobs_per_min': round(len(latencies) / wall_seconds * 60, 1) if wall_seconds else None,
+    }
+
+
+def run_concurrently(task, iterations, concurrency):
+    """Run task(i) iterations times on a thread pool; returns (latencies, wall seconds)"""
+    def timed(i):
+        started = time.perf_counter()
+        task(i)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, range(iterations)))
+    return latencies, time.perf_counter() - started
+
+
+def bench_builder(sandbox, site, args):
+    from apk_builder.builder import APKBuilder
+
+    def build(i):
+        builder = APKBuilder(base_version='base_1')
+        try:
+            builder.build(app_name=f'Bench App {i}', url=f'https://bench{i}.example.com',
+                          icon_path=str(sandbox.icon_path))
+        finally:
+            builder.cleanup()
+
+    # First build fills the template cache; measure steady state
+    build(-1)
+    return run_concurrently(build, args.iterations, args.concurrency)
+
+
+def bench_project(sandbox, site, args):
+    from backend.services import android_generator
+    from backend.services.zipper import create_zip
+
+    android_generator.TEMPLATE_DIR = str(sandbox.android_template)
+    work = sandbox.root / 'projects'
+    work.mkdir(exist_ok=True)
+
+    def generate(i):
+        project_dir = work / f'project_{i}'
+        zip_path = work / f'project_{i}.zip'
+        try:
+            android_generator.generate_android_project(
+                str(project_dir), f'https://bench{i}.example.com', f'Bench App {i}',
+                f'com.web2app.bench{i}', '#2196F3', True, None,
+                {'title': f'Bench App {i}'}, custom_icon_path=str(sandbox.icon_path))
+            create_zip(str(project_dir), str(zip_path))
+        finally:
+            shutil.rmtree(project_dir, ignore_errors=True)
+            if zip_path.exists():
+                zip_path.unlink()
+
+    return run_concurrently(generate, args.iterations, args.concurrency)
+
+
+def bench_metadata(sandbox, site, args):
+    from backend.services.url_metadata import fetch_url_metadata
+
+    def fetch(i):
+        metadata = fetch_url_metadata(site.url)
+        if metadata['title'] != 'Bench Site App':
+            raise RuntimeError(f'Unexpected metadata: {metadata}')
+
+    # Cheap per call, so run more of them
+    return run_concurrently(fetch, args.iterations * 10, args.concurrency)
+
+
+def bench_api(sandbox, site, args):
+    # Unthrottled, one in-process worker per client, no reaper
+    os.environ.update({
+        'BUILD_WORKERS': str(args.concurrency),
+        'RATE_LIMIT_PER_MINUTE': '0',
+        'BUILD_CONCURRENCY_QUOTA': '0',
+        'BUILD_DAILY_QUOTA': '0',
+        'MAX_QUEUE_WAIT_SECONDS': '0',
+        'STORAGE_SWEEP_INTERVAL': '0',
+    })
+    from backend.app import app, api_key_manager
+
+    api_key = api_key_manager.generate_api_key('benchmark')['api_key']
+    headers = {'X-API-Key': api_key}
+    client = app.test_client()
+    icon = sandbox.icon_path.read_bytes()
+
+    def build_and_download(i):
+        response = client.post('/api/v1/build-apk', headers=headers, data={
+            'url': f'https://bench{i}.example.com',
+            'appName': f'Bench App {i}',
+            'appIcon': (io.BytesIO(icon), 'icon.png'),
+        }, content_type='multipart/form-data')
+        if response.status_code != 202:
+            raise RuntimeError(f'Build rejected: {response.status_code} {response.get_json()}')
+        job_id = response.get_json()['job_id']
+        while True:
+            status = client.get(f'/api/v1/status/{job_id}').get_json()['job']['status']
+            if status in ('completed', 'failed'):
+                break
+            time.sleep(0.02)
+        if status != 'completed' or client.get(f'/api/v1/download/{job_id}').status_code != 200:
+            raise RuntimeError(f'Job {job_id} did not produce an APK')
+
+    return run_concurrently(build_and_download, args.iterations, args.concurrency)
+
+
+# A fresh interpreter importing the app and answering its first request
+STARTUP_SCRIPT = '''
+from backend.app import app
+response = app.test_client().get('/')
+assert response.status_code == 200, response.status_code
+'''
+
+
+def bench_startup(sandbox, site, args):
+    env = dict(os.environ, PYTHONPATH=str(REPO_ROOT), STORAGE_SWEEP_INTERVAL='0', BUILD_WORKERS='0')
+
+    def start(i):
+        subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # One at a time: concurrent interpreters would mostly measure CPU contention
+    return run_concurrently(start, args.iterations, 1)
+
+
+def bench_tracing(sandbox, site, args):
+    """
+    Builds with tracing disabled and enabled (every span exported to JSONL),
+    interleaved so drift affects both alike. The latencies reported are the
+    traced builds'. Build times vary by several percent from run to run, far
+    more than tracing costs, so overhead_pct is estimated from the spans a
+    build records times the measured cost of recording and exporting one;
+    measured_overhead_pct is the (noisy) difference of the two medians.
+    """
+    from apk_builder.builder import APKBuilder
+    from common.tracing import JSONLExporter, tracer
+
+    def build(i):
+        builder = APKBuilder(base_version='base_1')
+        try:
+            builder.build(app_name=f'Bench App {i}', url=f'https://bench{i}.example.com',
+                          icon_path=str(sandbox.icon_path))
+        finally:
+            builder.cleanup()
+
+    def span_seconds(exporter, count=5000):
+        tracer.exporter = exporter
+        started = time.perf_counter()
+        for i in range(count):
+            with tracer.span('bench.span', iteration=i):
+                pass
+        if exporter:
+            tracer.flush()
+        return (time.perf_counter() - started) / count
+
+    build(-1)
+    trace_file = sandbox.root / 'db' / 'bench_traces.jsonl'
+    exporter = JSONLExporter(str(trace_file))
+    original = tracer.exporter
+    latencies = {False: [], True: []}
+    try:
+        # ABBA order: neither mode always runs first
+        for i in range(args.iterations * 2):
+            traced = i % 4 in (1, 2)
+            tracer.exporter = exporter if traced else None
+            started = time.perf_counter()
+            build(i)
+            if traced:
+                # Export cost counts, and nothing is left for the untraced mode
+                tracer.flush()
+            latencies[traced].append(time.perf_counter() - started)
+        with open(trace_file) as f:
+            spans_per_build = sum(1 for _ in f) / len(latencies[True])
+        span_cost = span_seconds(exporter) - span_seconds(None)
+    finally:
+        tracer.exporter = original
+
+    disabled, enabled = percentile(latencies[False], 50), percentile(latencies[True], 50)
+    return latencies[True], sum(latencies[True]), {
+        'untraced_p50_ms': round(disabled * 1000, 2),
+        'spans_per_build': round(spans_per_build, 1),
+        'span_cost_us': round(span_cost * 1e6, 2),
+        'overhead_pct': round(spans_per_build * span_cost / disabled * 100, 3),
+        'measured_overhead_pct': round((enabled - disabled) / disabled * 100, 2),
+    }
+
+
+BENCHMARKS = {
+    'builder': bench_builder,
+    'project': bench_project,
+    'metadata': bench_metadata,
+    'api': bench_api,
+    'startup': bench_startup,
+    'tracing': bench_tracing,
+}
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of p95 latency or throughput beyond the tolerance"""
+    regressions = []
+    for suite, current in results['suites'].items():
+        base = baseline.get('suites', {}).get(suite)
+        if not base:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance) and \
+                current['p95_ms'] - base['p95_ms'] > MIN_REGRESSION_MS:
+            regressions.append(f"{suite}: p95 {base['p95_ms']} ms -> {current['p95_ms']} ms")
+        if base.get('jobs_per_min') and current['jobs_per_min'] < base['jobs_per_min'] * (1 - tolerance):
+            regressions.append(f"{suite}: {base['jobs_per_min']} -> {current['jobs_per_min']} jobs/min")
+    tracing = results['suites'].get('tracing')
+    if tracing and tracing['overhead_pct'] > MAX_TRACING_OVERHEAD_PCT:
+        regressions.append(f"tracing: {tracing['overhead_pct']}% overhead per build "
+                           f"(limit {MAX_TRACING_OVERHEAD_PCT}%)")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Web2App end-to-end benchmarks')
+    parser.add_argument('--suites', default=','.join(SUITES),
+                        help=f'Comma-separated suites to run ({", ".join(SUITES)})')
+    parser.add_argument('--iterations', type=int, default=10, help='Jobs per suite')
+    parser.add_argument('--concurrency', type=int, default=2, help='Concurrent clients')
+    parser.add_argument('--io-profile', choices=sorted(IO_PROFILES), default='small',
+                        help='Size of the synthetic template')
+    parser.add_argument('--latency-profile', choices=sorted(LATENCY_PROFILES), default='none',
+                        help='Extra latency of the stand-in apktool/jarsigner')
+    parser.add_argument('--site-latency', type=float, default=0.0,
+                        help='Seconds the fixture website takes per request')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Baseline JSON file')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='Write these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Allowed fractional slowdown before reporting a regression')
+    parser.add_argument('--output', help='Also write the results JSON here')
+    parser.add_argument('--verbose', action='store_true', help="Show the builder's own output")
+    args = parser.parse_args(argv)
+
+    suites = [suite.strip() for suite in args.suites.split(',') if suite.strip()]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f'unknown suites: {", ".join(sorted(unknown))}')
+
+    os.environ.update(LATENCY_PROFILES[args.latency_profile])
+    results = {
+        'config': {
+            'iterations': args.iterations,
+            'concurrency': args.concurrency,
+            'io_profile': args.io_profile,
+            'latency_profile': args.latency_profile,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'suites': {}
+    }
+
+    sandbox = Sandbox(args.io_profile).create()
+    sandbox.enter()
+    try:
+        with FixtureSite(args.site_latency) as site:
+            for suite in suites:
+                quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+                with quiet:
+                    latencies, wall, *extra = BENCHMARKS[suite](sandbox, site, args)
+                results['suites'][suite] = summarize(latencies, wall)
+                stats = results['suites'][suite]
+                # Suite-specific numbers, e.g. tracing's overhead_pct
+                for extra_stats in extra:
+                    stats.update(extra_stats)
+                print(f"{suite:<10} n={stats['count']:<4} p50={stats['p50_ms']:>9.1f} ms  "
+                      f"p95={stats['p95_ms']:>9.1f} ms  p99={stats['p99_ms']:>9.1f} ms  "
+                      f"{stats['jobs_per_min']:>8.1f} jobs/min" +
+                      ''.join(f"  {key}={value}" for extra_stats in extra for key, value in extra_stats.items()))
+    finally:
+        sandbox.close()
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + '\n')
+
+    baseline_path = Path(args.baseline)
+    if args.update_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2) + '\n')
+        print(f'Baseline written to {baseline_path}')
+        return 0
+
+    if not baseline_path.exists():
+        print(f'No baseline at {baseline_path}; run with --update-baseline to record one')
+        return 0
+    baseline = json.loads(baseline_path.read_text())
+    if baseline.get('config', {}).get('io_profile') != args.io_profile or \
+            baseline.get('config', {}).get('latency_profile') != args.latency_profile:
+        print('Baseline was recorded with different profiles; comparison may be misleading')
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f'REGRESSION {regression}')
+    if not regressions:
+        print(f'No regressions against {baseline_path} (tolerance {args.tolerance:.0%})')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,426 @@
+"""
+Request-scoped tracing
+Spans for Flask requests, job store operations, build stages, subprocess
+calls and outbound HTTP fetches, so a slow build can be split into queueing,
+decompiling, icon work, file I/O and signing.
+
+The current span lives in a contextvar. It does not follow work onto another
+thread on its own: the build API stores the request's W3C traceparent in the
+job record, and the worker that claims the job (a thread here or another
+process) continues the trace from it.
+
+Configuration:
+    TRACE_EXPORTER       none (default), jsonl or otlp
+    TRACE_FILE           JSONL output for the jsonl exporter (default db/traces.jsonl)
+    TRACE_OTLP_ENDPOINT  OTLP/HTTP JSON traces endpoint
+                         (default http://localhost:4318/v1/traces)
+    TRACE_SAMPLE_RATE    fraction of traces recorded, decided at the root span (default 1.0)
+
+A stand-in collector that accepts OTLP/HTTP JSON and writes JSONL:
+    python -m common.tracing collect --port 4318 --output traces.jsonl
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import argparse
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+SERVICE_NAME = 'web2app'
+
+# Exporters send in batches from a background thread
+FLUSH_INTERVAL = 2.0
+MAX_BATCH = 512
+# Spans beyond this many waiting to be exported are dropped
+MAX_BUFFERED = 10000
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class SpanContext:
+    """Identity of a span that children and other processes can continue"""
+    __slots__ = ('trace_id', 'span_id', 'sampled')
+
+    def __init__(self, trace_id, span_id, sampled):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, value):
+        """Parse a W3C traceparent header, or None if it is malformed"""
+        parts = (value or '').strip().split('-')
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            int(parts[1], 16), int(parts[2], 16)
+            sampled = bool(int(parts[3], 16) & 1)
+        except ValueError:
+            return None
+        return cls(parts[1], parts[2], sampled)
+
+
+class Span:
+    __slots__ = ('name', 'context', 'parent_id', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, name, context, parent_id, attributes, start=None):
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.start = time.time() if start is None else start
+        self.end = None
+        self.attributes = attributes
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'duration_ms': round((self.end - self.start) * 1000, 3),
+            'attributes': self.attributes,
+            'error': self.error,
+            'service': SERVICE_NAME,
+            'pid': os.getpid(),
+        }
+
+
+class _NoopSpan:
+    """Stands in for spans of unsampled traces and disabled tracing"""
+    __slots__ = ()
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JSONLExporter:
+    """Appends one JSON span per line (O_APPEND keeps lines from processes whole)"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span, separators=(',', ':')) + '\n' for span in spans)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OTLPExporter:
+    """Posts spans as OTLP/HTTP JSON (ExportTraceServiceRequest)"""
+
+    def __init__(self, endpoint, timeout=5):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    def export(self, spans):
+        import requests
+
+        otlp_spans = [{
+            'traceId': span['trace_id'],
+            'spanId': span['span_id'],
+            'parentSpanId': span['parent_id'] or '',
+            'name': span['name'],
+            'kind': 1,
+            'startTimeUnixNano': str(int(span['start'] * 1e9)),
+            'endTimeUnixNano': str(int((span['start'] + span['duration_ms'] / 1000) * 1e9)),
+            'attributes': [{'key': key, 'value': _otlp_value(value)}
+                           for key, value in span['attributes'].items()],
+            'status': {'code': 2, 'message': span['error']} if span['error'] else {'code': 1},
+        } for span in spans]
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}},
+                {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}},
+            ]},
+            'scopeSpans': [{'scope': {'name': 'common.tracing'}, 'spans': otlp_spans}],
+        }]}
+        requests.post(self.endpoint, json=body, timeout=self.timeout).raise_for_status()
+
+
+class Tracer:
+    def __init__(self, exporter=None, sample_rate=1.0):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self._buffer = deque()
+        self._dropped = 0
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def current_context(self):
+        """SpanContext of the active span, or None"""
+        return _current.get()
+
+    def current_traceparent(self):
+        context = _current.get()
+        return context.traceparent if context else None
+
+    def _new_context(self, parent):
+        if parent is None:
+            sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+            trace_id = f'{random.getrandbits(128):032x}'
+        else:
+            sampled, trace_id = parent.sampled, parent.trace_id
+        return SpanContext(trace_id, f'{random.getrandbits(64):016x}', sampled)
+
+    def start_span(self, name, parent=None, attributes=None, start=None):
+        """
+        Start a span without activating it; end it with end_span()
+
+        Args:
+            parent: SpanContext or traceparent string; defaults to the active span
+
+        Returns:
+            (Span or None if unsampled, its SpanContext)
+        """
+        if isinstance(parent, str):
+            parent = SpanContext.from_traceparent(parent)
+        elif parent is None:
+            parent = _current.get()
+        context = self._new_context(parent)
+        if not context.sampled:
+            return None, context
+        return Span(name, context, parent.span_id if parent else None,
+                    dict(attributes or {}), start=start), context
+
+    def end_span(self, span, error=None, end=None):
+        if span is None:
+            return
+        span.end = time.time() if end is None else end
+        if error is not None:
+            span.error = f'{type(error).__name__}: {error}' if isinstance(error, BaseException) else str(error)
+        self._enqueue(span.to_dict())
+
+    @contextmanager
+    def span(self, name, parent=None, **attributes):
+        """Record the enclosed block as a span that is active inside it"""
+        if self.exporter is None:
+            yield NOOP_SPAN
+            return
+        span, context = self.start_span(name, parent, attributes)
+        token = _current.set(context)
+        try:
+            yield span or NOOP_SPAN
+        except BaseException as e:
+            self.end_span(span, error=e)
+            span = None
+            raise
+        finally:
+            _current.reset(token)
+            self.end_span(span)
+
+    @contextmanager
+    def child_span(self, name, **attributes):
+        """Like span(), but only inside an existing trace (for frequent low-level operations)"""
+        if self.exporter is None or _current.get() is None:
+            yield NOOP_SPAN
+            return
+        with self.span(name, **attributes) as span:
+            yield span
+
+    def record(self, name, start, end, parent=None, **attributes):
+        """Record a span for something that already happened (e.g. time in the queue)"""
+        if self.exporter is None:
+            return
+        span, _ = self.start_span(name, parent, attributes, start=start)
+        self.end_span(span, end=end)
+
+    def _enqueue(self, span_dict):
+        if len(self._buffer) >= MAX_BUFFERED:
+            self._dropped += 1
+            return
+        self._buffer.append(span_dict)
+        # Exporting is done off the request/build path; restart after fork
+        if self._thread_pid != os.getpid():
+            self._start_thread()
+        if len(self._buffer) >= MAX_BATCH:
+            self._wakeup.set()
+
+    def _start_thread(self):
+        with self._flush_lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(FLUSH_INTERVAL)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Export everything buffered so far"""
+        with self._flush_lock:
+            while self._buffer:
+                batch = []
+                while self._buffer and len(batch) < MAX_BATCH:
+                    batch.append(self._buffer.popleft())
+                try:
+                    self.exporter.export(batch)
+                except Exception as e:
+                    print(f"Trace export failed, dropped {len(batch)} span(s): {e}")
+            if self._dropped:
+                print(f"Trace buffer full, dropped {self._dropped} span(s)")
+                self._dropped = 0
+
+
+def create_tracer():
+    """Tracer configured from TRACE_* environment variables"""
+    kind = os.environ.get('TRACE_EXPORTER', 'none').strip().lower()
+    sample_rate = float(os.environ.get('TRACE_SAMPLE_RATE', '1.0'))
+    if kind == 'jsonl':
+        exporter = JSONLExporter(os.environ.get('TRACE_FILE', os.path.join('db', 'traces.jsonl')))
+    elif kind == 'otlp':
+        exporter = OTLPExporter(os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318/v1/traces'))
+    elif kind in ('', 'none', 'off'):
+        exporter = None
+    else:
+        raise ValueError(f'Unknown TRACE_EXPORTER: {kind}')
+    return Tracer(exporter, sample_rate=sample_rate)
+
+
+tracer = create_tracer()
+if tracer.enabled:
+    atexit.register(tracer.flush)
+
+
+def trace_flask_app(app):
+    """Open a span per request, continuing an incoming traceparent header"""
+    if not tracer.enabled:
+        return
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_span():
+        span, context = tracer.start_span(
+            f'{request.method} {request.url_rule.rule if request.url_rule else request.path}',
+            parent=request.headers.get('traceparent'),
+            attributes={'http.method': request.method, 'http.target': request.path})
+        g.trace_span = span
+        g.trace_token = _current.set(context)
+
+    @app.after_request
+    def _record_status(response):
+        span = g.get('trace_span')
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+            response.headers['traceparent'] = span.context.traceparent
+        return response
+
+    @app.teardown_request
+    def _end_request_span(error=None):
+        token = g.pop('trace_token', None)
+        if token is not None:
+            _current.reset(token)
+        tracer.end_span(g.pop('trace_span', None), error=error)
+
+
+def run_collector(port, output):
+    """Minimal OTLP/HTTP JSON receiver that writes spans in the JSONL exporter's format"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    exporter = JSONLExporter(output)
+
+    def attribute_value(value):
+        for kind in ('stringValue', 'boolValue', 'doubleValue'):
+            if kind in value:
+                return value[kind]
+        return int(value['intValue']) if 'intValue' in value else None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                spans = []
+                for resource_spans in body.get('resourceSpans', []):
+                    resource = {a['key']: attribute_value(a['value'])
+                                for a in resource_spans.get('resource', {}).get('attributes', [])}
+                    for scope_spans in resource_spans.get('scopeSpans', []):
+                        for span in scope_spans.get('spans', []):
+                            start = int(span['startTimeUnixNano']) / 1e9
+                            status = span.get('status', {})
+                            spans.append({
+                                'trace_id': span['traceId'],
+                                'span_id': span['spanId'],
+                                'parent_id': span.get('parentSpanId') or None,
+                                'name': span['name'],
+                                'start': start,
+                                'duration_ms': round(int(span['endTimeUnixNano']) / 1e6 - start * 1000, 3),
+                                'attributes': {a['key']: attribute_value(a['value'])
+                                               for a in span.get('attributes', [])},
+                                'error': status.get('message') if status.get('code') == 2 else None,
+                                'service': resource.get('service.name'),
+                                'pid': resource.get('process.pid'),
+                            })
+                exporter.export(spans)
+            except (ValueError, KeyError) as e:
+                self.send_error(400, str(e))
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', '2')
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    print(f"{datetime.now().isoformat()} trace collector listening on :{port}, writing {output}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tracing utilities')
+    commands = parser.add_subparsers(dest='command', required=True)
+    collect = commands.add_parser('collect', help='Run a stand-in OTLP/HTTP JSON collector')
+    collect.add_argument('--port', type=int, default=4318)
+    collect.add_argument('--output', default='traces.jsonl')
+    args = parser.parse_args(argv)
+    if args.command == 'collect':
+        run_collector(args.port, args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""
+gunicorn settings for backend.app:app
+The app is imported once in the master (preload_app) and workers are forked
+from it, so they share its imported code copy-on-write. That import is kept
+light; the modules only some routes need are imported in a background
+thread once each worker is up, so they never delay its first request.
+Managers and background threads are created per worker after the fork.
+
+    gunicorn -c gunicorn.conf.py backend.app:app
+"""
+import os
+import threading
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '2'))
+# APK builds on slow CPUs can take a long time (30 minutes)
+timeout = 1800
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1').lower() not in ('0', 'false', 'no')
+
+
+def post_worker_init(worker):
+    # Start build workers, the storage reaper and the other threads in this
+    # worker now rather than on its first request
+    from backend.app import background_services, preload_heavy_modules
+    background_services()
+    # Import what the heavier routes need while the worker already serves
+    threading.Thread(target=preload_heavy_modules, name='preload-modules', daemon=True).start()
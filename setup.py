@@ -24,7 +24,8 @@ def main():
         "flask-cors>=6.0.1", 
         "pillow>=11.3.0", 
         "requests>=2.32.5",
-        "gunicorn>=21.2.0"
+        "gunicorn>=21.2.0",
+        "brotli>=1.1.0"
     ]
     
     try:
@@ -0,0 +1,26 @@
+"""
+Shared fixtures: a throwaway project root with the stub apktool/jarsigner
+from benchmarks/, so tests run the real build and storage code paths.
+"""
+import os
+
+import pytest
+
+from benchmarks.fixtures import STUB_BIN, Sandbox
+
+
+@pytest.fixture
+def sandbox(monkeypatch):
+    """Sandbox project root as the working directory, with its own job db and generated/"""
+    import apk_builder.template_cache as template_cache
+
+    sb = Sandbox().create()
+    monkeypatch.chdir(sb.root)
+    monkeypatch.setenv('PATH', f"{STUB_BIN}{os.pathsep}{os.environ.get('PATH', '')}")
+    monkeypatch.setenv('APK_TEMPLATE_CACHE_DIR', str(sb.root / 'apk_builder' / 'cache'))
+    monkeypatch.setenv('GENERATED_DIR', str(sb.root / 'generated'))
+    monkeypatch.setenv('JOB_DB_DIR', str(sb.root / 'db'))
+    # The template cache is process-wide; give each sandbox its own
+    monkeypatch.setattr(template_cache, '_cache', None)
+    yield sb
+    sb.close()
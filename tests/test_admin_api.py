@@ -0,0 +1,19 @@
+def test_admin_sets_a_key_priority_weight(sandbox, monkeypatch):
+    # Imported once the sandbox environment is in place
+    import backend.app as app_module
+
+    monkeypatch.setattr(app_module, 'ADMIN_TOKEN', 'secret')
+    client = app_module.app.test_client()
+    key = app_module.api_key_manager.generate_api_key('tenant')
+    url = f"/api/v1/admin/keys/{key['key_id']}/priority"
+
+    assert client.put(url, json={'priority_weight': 3}).status_code == 403
+    admin = {'X-Admin-Token': 'secret'}
+    assert client.put(url, json={'priority_weight': 0}, headers=admin).status_code == 400
+    assert client.put(url, json={}, headers=admin).status_code == 400
+    assert client.put('/api/v1/admin/keys/nope/priority', json={'priority_weight': 2},
+                      headers=admin).status_code == 404
+
+    response = client.put(url, json={'priority_weight': 3}, headers=admin)
+    assert response.get_json()['priority_weight'] == 3.0
+    assert app_module.api_key_manager.validate_api_key(key['api_key'])['priority_weight'] == 3.0
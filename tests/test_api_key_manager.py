@@ -0,0 +1,25 @@
+import multiprocessing
+
+from backend.api_key_manager import APIKeyManager
+
+
+def _use_key(db_path, api_key, times):
+    manager = APIKeyManager(db_path)
+    for _ in range(times):
+        assert manager.validate_api_key(api_key)
+
+
+def test_usage_counts_survive_concurrent_processes(tmp_path):
+    db_path = str(tmp_path / 'api_keys.json')
+    api_key = APIKeyManager(db_path).generate_api_key('shared')['api_key']
+
+    # Like several gunicorn workers validating the same key at once
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_use_key, args=(db_path, api_key, 25)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0] * 4
+
+    assert APIKeyManager(db_path).list_api_keys()[0]['request_count'] == 100
@@ -0,0 +1,80 @@
+import json
+import random
+import struct
+import zipfile
+import hashlib
+
+from apk_builder.zipalign import align_apk
+from backend.artifact_store import create_artifact_store
+from backend.services.apk_delta import PATCH_MAGIC, PatchCache, _PatchReader, apply_patch, create_patch
+
+
+def _dex(seed, lines=20000):
+    rng = random.Random(seed)
+    return ''.join(f'method_{i} {rng.randrange(10 ** 6)}\n' for i in range(lines)).encode()
+
+
+def _apk(path, entries, compresslevel=None):
+    """A canonical APK (as builds are written) from {name: bytes}"""
+    raw = path.with_suffix('.zip')
+    with zipfile.ZipFile(raw, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+        for name, data in entries.items():
+            archive.writestr(name, data)
+    align_apk(raw, path)
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _header(patch_path):
+    with open(patch_path, 'rb') as f:
+        assert f.read(len(PATCH_MAGIC)) == PATCH_MAGIC
+        reader = _PatchReader(f)
+        return json.loads(reader.read(struct.unpack('<I', reader.read(4))[0]))
+
+
+def test_patch_round_trip_diffs_uncompressed_content(tmp_path):
+    dex = _dex(1)
+    changed = bytearray(dex)
+    changed[len(dex) // 2:len(dex) // 2 + 11] = b'new_method\n'
+    old_hash = _apk(tmp_path / 'old.apk', {'classes.dex': dex, 'res/icon.png': b'\x89PNG' * 100,
+                                           'assets/removed.txt': b'gone'})
+    new_hash = _apk(tmp_path / 'new.apk', {'classes.dex': bytes(changed), 'res/icon.png': b'\x89PNG' * 100,
+                                           'assets/added.txt': b'new'})
+
+    stats = create_patch(tmp_path / 'old.apk', tmp_path / 'new.apk', old_hash, new_hash,
+                         tmp_path / 'update.apkpatch')
+    entries = {entry['name']: entry for entry in _header(tmp_path / 'update.apkpatch')['entries']}
+    assert entries['classes.dex']['basis'] == 'content'
+    assert 'copy' in entries['res/icon.png']
+    assert 'data' in entries['assets/added.txt']
+    # A one-line edit deep inside a deflated entry costs a few hundred bytes, not a recompressed copy
+    assert stats['size'] < 2000
+
+    assert apply_patch(tmp_path / 'old.apk', tmp_path / 'update.apkpatch', tmp_path / 'out.apk') == new_hash
+    assert (tmp_path / 'out.apk').read_bytes() == (tmp_path / 'new.apk').read_bytes()
+
+
+def test_entries_that_cannot_be_redeflated_fall_back_to_stored_bytes(tmp_path):
+    # apktool's own deflate output is copied as is; level 4 isn't a level the patcher tries
+    old_hash = _apk(tmp_path / 'old.apk', {'classes.dex': _dex(1)}, compresslevel=4)
+    new_hash = _apk(tmp_path / 'new.apk', {'classes.dex': _dex(1, 20001)}, compresslevel=4)
+
+    create_patch(tmp_path / 'old.apk', tmp_path / 'new.apk', old_hash, new_hash, tmp_path / 'update.apkpatch')
+    entry = _header(tmp_path / 'update.apkpatch')['entries'][0]
+    assert entry.get('basis') != 'content'
+    assert apply_patch(tmp_path / 'old.apk', tmp_path / 'update.apkpatch', tmp_path / 'out.apk') == new_hash
+
+
+def test_patch_cache_generates_in_the_background(tmp_path):
+    old_hash = _apk(tmp_path / 'old.apk', {'classes.dex': _dex(1)})
+    new_hash = _apk(tmp_path / 'new.apk', {'classes.dex': _dex(2)})
+    cache = PatchCache(create_artifact_store(str(tmp_path / 'store')))
+
+    assert cache.get(tmp_path / 'old.apk', tmp_path / 'new.apk', old_hash, new_hash) is None
+    # Wait for the single patch worker to finish the queued patch
+    cache._executor.submit(lambda: None).result()
+    path = cache.get(tmp_path / 'old.apk', tmp_path / 'new.apk', old_hash, new_hash)
+    assert apply_patch(tmp_path / 'old.apk', path, tmp_path / 'out.apk') == new_hash
+
+    cache.request(tmp_path / 'new.apk', tmp_path / 'missing.apk', new_hash, old_hash).result()
+    assert cache.failed(new_hash, old_hash)
+    assert cache.get(tmp_path / 'new.apk', tmp_path / 'missing.apk', new_hash, old_hash) is None
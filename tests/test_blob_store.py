@@ -0,0 +1,57 @@
+import io
+import os
+import hashlib
+
+from backend.blob_store import BlobStore
+
+
+def test_identical_content_is_stored_once_and_refcounted(tmp_path):
+    store = BlobStore(tmp_path / 'blobs')
+    data = b'icon bytes' * 100
+    sha256 = store.put_bytes(data, owner='job:a')
+
+    assert sha256 == hashlib.sha256(data).hexdigest()
+    assert store.put_stream(io.BytesIO(data), owner='job:b') == sha256
+    # References are per owner, so storing again for the same owner is a no-op
+    assert store.put_bytes(data, owner='job:b') == sha256
+    assert store.refcount(sha256) == 2
+    assert len(store.list()) == 1 and store.total_bytes() == len(data)
+    with open(store.path(sha256), 'rb') as f:
+        assert f.read() == data
+
+    assert store.release(sha256, 'job:a')
+    assert not store.release(sha256, 'job:a')
+    assert store.refcount(sha256) == 1
+    assert store.release_owner('job:b') == 1
+    assert store.refcount(sha256) == 0
+
+
+def test_garbage_collection_respects_the_grace_period(tmp_path):
+    store = BlobStore(tmp_path / 'blobs')
+    kept = store.put_bytes(b'kept', owner='job:a')
+    dropped = store.put_bytes(b'dropped', owner='job:b')
+    store.release(dropped, 'job:b')
+
+    # Recently unreferenced blobs survive, in case they're being stored again right now
+    assert store.collect_garbage(grace_seconds=3600) == {'deleted': 0, 'freed_bytes': 0}
+    assert store.collect_garbage(grace_seconds=-1) == {'deleted': 1, 'freed_bytes': len(b'dropped')}
+    assert not store.exists(dropped) and not os.path.exists(store.path(dropped))
+    assert store.exists(kept)
+
+    # A blob referenced again before collection is kept
+    store.release(kept, 'job:a')
+    assert store.add_ref(kept, 'job:c')
+    assert store.collect_garbage(grace_seconds=-1)['deleted'] == 0
+    assert store.exists(kept)
+
+
+def test_delete_keeps_a_blob_referenced_by_an_unexpected_owner(tmp_path):
+    store = BlobStore(tmp_path / 'blobs')
+    sha256 = store.put_bytes(b'apk', owner='job:old')
+    # Referenced again after the caller decided to delete it
+    store.add_ref(sha256, 'job:new')
+
+    assert store.delete(sha256, owners={'job:old'}) is None
+    assert store.exists(sha256) and store.refcount(sha256) == 2
+    assert store.delete(sha256, owners={'job:old', 'job:new'}) == 3
+    assert not store.exists(sha256)
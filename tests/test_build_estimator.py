@@ -0,0 +1,43 @@
+from backend.build_estimator import BuildEstimator
+from backend.job_manager import JobManager
+
+
+def _estimator(tmp_path, backlog):
+    """Estimator over a store with `backlog` queued builds from key 'busy'"""
+    job_manager = JobManager(str(tmp_path))
+    for i in range(backlog):
+        job_manager.create_job(f'busy-{i}', 'App', f'https://example.com/{i}', inputs={}, key_id='busy')
+    estimator = BuildEstimator(job_manager, capacity=1)
+    estimator.default_duration = 60
+    estimator.max_queue_wait = 600
+    return job_manager, estimator
+
+
+def test_queue_wait_follows_fair_share_not_fifo(tmp_path):
+    job_manager, estimator = _estimator(tmp_path, backlog=20)
+    quiet = job_manager.create_job('quiet-0', 'App', 'https://example.com/q', inputs={}, key_id='quiet')
+
+    # First in its own queue: waits for one turn of the busy key, not its 20 builds
+    assert estimator.estimate_job(quiet)['estimated_wait_seconds'] == 60
+    assert estimator.estimate_job(job_manager.get_job('busy-19'))['estimated_wait_seconds'] == (19 + 1) * 60
+    assert estimator.estimate_new('busy')['estimated_wait_seconds'] == (20 + 1) * 60
+
+
+def test_admission_sheds_only_the_backlogged_key(tmp_path):
+    _, estimator = _estimator(tmp_path, backlog=20)
+
+    overloaded = estimator.check_admission('busy')
+    assert overloaded['retry_after'] > 0
+    assert estimator.check_admission('quiet') is None
+
+
+def test_queue_snapshot_is_reused_between_polls(tmp_path):
+    job_manager, estimator = _estimator(tmp_path, backlog=1)
+    estimator.snapshot_ttl = 60
+    job = job_manager.get_job('busy-0')
+    assert estimator.estimate_job(job)['estimated_wait_seconds'] == 0
+
+    job_manager.create_job('busy-1', 'App', 'https://example.com/x', inputs={}, key_id='busy')
+    # Not in the cached snapshot yet, so placed at the back of its key's queue
+    assert estimator.estimate_job(job_manager.get_job('busy-1'))['estimated_wait_seconds'] == 60
+    assert estimator.estimate_new('busy')['estimated_wait_seconds'] == 60
@@ -0,0 +1,81 @@
+from backend.build_queue import FairScheduler, JobStoreQueue, SQLiteJobQueue
+from backend.job_manager import JobManager
+
+
+def test_sqlite_queue_enqueues_pending_jobs_it_lost(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    queue = SQLiteJobQueue(str(tmp_path / 'build_queue.sqlite3'), job_manager)
+    queue.enqueue(job_manager.create_job('queued', 'App', 'https://example.com/1', inputs={'app_name': 'App'}))
+    # Crashed between create_job and enqueue
+    job_manager.create_job('lost', 'App', 'https://example.com/2', inputs={'app_name': 'App'})
+
+    assert queue.reconcile() == ['lost']
+    assert [entry['job_id'] for entry in queue.pending()] == ['queued', 'lost']
+    assert queue.reconcile() == []
+
+
+def test_completion_requires_the_current_lease(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    job_manager.create_job('a', 'App', 'https://example.com', inputs={'app_name': 'App'})
+    first = job_manager.claim_next_job('host:1:x')
+    # The lease expires and the same worker process claims the job again
+    job_manager.update_job('a', status='pending', lease_owner=None)
+    second = job_manager.claim_next_job('host:1:x')
+
+    assert job_manager.set_completed('a', 'f' * 64, lease=job_manager.lease_of(first)) is None
+    assert job_manager.get_job('a')['status'] == 'processing'
+    assert job_manager.set_completed('a', 'e' * 64, lease=job_manager.lease_of(second))['apk_sha256'] == 'e' * 64
+
+
+def test_completed_job_is_not_requeued_when_its_worker_died_before_done(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    finished = []
+    job_manager.add_listener(lambda job: finished.append(job['job_id']))
+    for queue in (SQLiteJobQueue(str(tmp_path / 'build_queue.sqlite3'), job_manager),
+                  JobStoreQueue(job_manager)):
+        job_id = f'job-{len(finished)}'
+        queue.enqueue(job_manager.create_job(job_id, 'App', 'https://example.com',
+                                             inputs={'app_name': 'App'}))
+        job = queue.claim('host:1:x')
+        assert job_manager.set_completed(job_id, 'f' * 64, lease=job_manager.lease_of(job))
+
+        # The worker exits before queue.done(); its lease then looks stale
+        assert queue.requeue_stale(0, 3, is_owner_dead=lambda owner: True) == ([], [])
+        assert job_manager.get_job(job_id)['status'] == 'completed'
+        assert queue.claim('host:2:y') is None
+    assert finished == ['job-0', 'job-1']
+
+
+def test_sqlite_queue_requeues_a_build_whose_worker_died(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    queue = SQLiteJobQueue(str(tmp_path / 'build_queue.sqlite3'), job_manager)
+    queue.enqueue(job_manager.create_job('a', 'App', 'https://example.com', inputs={'app_name': 'App'}))
+    first = queue.claim('host:1:x')
+
+    assert queue.requeue_stale(0, 3) == (['a'], [])
+    assert job_manager.get_job('a')['status'] == 'pending'
+    second = queue.claim('host:2:y')
+    assert job_manager.lease_of(second) == ('host:2:y', 2)
+    # The old worker's late result is rejected
+    assert job_manager.set_completed('a', 'f' * 64, lease=job_manager.lease_of(first)) is None
+
+    assert queue.requeue_stale(0, 2) == ([], ['a'])
+    assert job_manager.get_job('a')['status'] == 'failed'
+
+
+def test_fair_scheduler_interleaves_keys_by_weight():
+    scheduler = FairScheduler()
+    pending = [{'job_id': f'busy-{i}', 'key_id': 'busy', 'priority_weight': 1.0} for i in range(6)]
+    pending += [{'job_id': f'vip-{i}', 'key_id': 'vip', 'priority_weight': 2.0} for i in range(4)]
+    pending += [{'job_id': 'quiet-0', 'key_id': 'quiet', 'priority_weight': 1.0}]
+
+    order = []
+    while pending:
+        entry = scheduler.select(pending)
+        pending.remove(entry)
+        order.append(entry['job_id'])
+
+    # Each round: one busy build, two vip builds and the quiet key's build, instead of FIFO
+    assert order[:4] == ['busy-0', 'vip-0', 'vip-1', 'quiet-0']
+    assert sorted(order[4:7]) == ['busy-1', 'vip-2', 'vip-3']
+    assert order[7:] == ['busy-2', 'busy-3', 'busy-4', 'busy-5']
@@ -0,0 +1,85 @@
+import os
+
+from flask import Flask
+
+import backend.services.downloads as downloads
+from backend.services.downloads import call_after_send, file_sha256, send_artifact
+
+DATA = bytes(range(256)) * 40
+
+
+def _client(tmp_path, closed=None):
+    path = tmp_path / 'ab' / 'abcdef.apk'
+    path.parent.mkdir()
+    path.write_bytes(DATA)
+    etag = file_sha256(path)
+    app = Flask(__name__)
+
+    @app.route('/download')
+    def download():
+        response = send_artifact(str(path), 'My_App.apk', etag, offload_path='ab/abcdef.apk')
+        if closed is not None:
+            call_after_send(response, lambda: closed.append(True))
+        return response
+
+    return app.test_client(), path, etag
+
+
+def test_full_download_has_a_strong_content_etag(tmp_path):
+    closed = []
+    client, _, etag = _client(tmp_path, closed)
+    response = client.get('/download')
+    assert response.status_code == 200
+    assert response.data == DATA
+    assert response.headers['ETag'] == f'"{etag}"'
+    assert response.headers['Content-Type'] == downloads.APK_MIMETYPE
+    assert 'filename=My_App.apk' in response.headers['Content-Disposition']
+    response.close()
+    assert closed == [True]
+
+
+def test_range_requests_get_partial_content(tmp_path):
+    client, _, etag = _client(tmp_path)
+    response = client.get('/download', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == DATA[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(DATA)}'
+
+    # A range against an outdated version gets the whole current file
+    response = client.get('/download', headers={'Range': 'bytes=100-199', 'If-Range': '"old"'})
+    assert response.status_code == 200 and response.data == DATA
+
+    response = client.get('/download', headers={'Range': f'bytes={len(DATA)}-'})
+    assert response.status_code == 416
+
+
+def test_matching_etag_is_not_modified_and_head_has_no_body(tmp_path):
+    client, _, etag = _client(tmp_path)
+    response = client.get('/download', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.get('/download', headers={'If-None-Match': '"other"'}).status_code == 200
+
+    response = client.head('/download')
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['Content-Length'] == str(len(DATA))
+    assert response.headers['ETag'] == f'"{etag}"'
+
+
+def test_offload_headers_hand_the_body_to_the_proxy(tmp_path, monkeypatch):
+    client, path, etag = _client(tmp_path)
+
+    monkeypatch.setattr(downloads, 'DOWNLOAD_OFFLOAD', 'nginx')
+    monkeypatch.setattr(downloads, 'DOWNLOAD_ACCEL_PREFIX', '/protected/')
+    response = client.get('/download')
+    assert response.status_code == 200 and response.data == b''
+    assert response.headers['X-Accel-Redirect'] == '/protected/ab/abcdef.apk'
+    assert response.headers['ETag'] == f'"{etag}"'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert client.get('/download', headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+
+    monkeypatch.setattr(downloads, 'DOWNLOAD_OFFLOAD', 'sendfile')
+    response = client.get('/download')
+    assert response.headers['X-Sendfile'] == os.path.abspath(path)
+    assert 'X-Accel-Redirect' not in response.headers
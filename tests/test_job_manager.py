@@ -0,0 +1,96 @@
+import json
+import sqlite3
+from contextlib import closing
+
+from backend.job_index import JobIndex, store_version
+from backend.job_manager import JobManager
+
+
+def test_listeners_fire_once_on_the_first_finished_status(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    finished = []
+    job_manager.add_listener(lambda job: finished.append((job['job_id'], job['status'])))
+
+    job_manager.create_job('a', 'App', 'https://example.com', inputs={'app_name': 'App'})
+    job_manager.set_processing('a')
+    job_manager.set_completed('a', 'f' * 64)
+    assert finished == [('a', 'completed')]
+
+    # The storage reaper expiring the APK is not a second completion
+    job_manager.update_job('a', status='expired', message='APK expired')
+    assert finished == [('a', 'completed')]
+
+
+def test_followers_are_notified_with_their_leader(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    finished = []
+    job_manager.add_listener(lambda job: finished.append(job['job_id']))
+
+    job_manager.create_job('leader', 'App', 'https://example.com', inputs={}, fingerprint='fp')
+    follower = job_manager.create_job('follower', 'App', 'https://example.com', inputs={}, fingerprint='fp')
+    assert follower['leader_job_id'] == 'leader'
+    job_manager.set_failed('leader', 'boom')
+    assert sorted(finished) == ['follower', 'leader']
+
+
+def test_iter_jobs_filters_by_status(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    for job_id in ('a', 'b', 'c'):
+        job_manager.create_job(job_id, 'App', 'https://example.com', inputs={})
+    job_manager.set_failed('b', 'boom')
+
+    assert sorted(job['job_id'] for job in job_manager.iter_jobs(('pending',))) == ['a', 'c']
+    assert sorted(job_manager.all_jobs()) == ['a', 'b', 'c']
+
+
+def test_app_builds_match_key_and_app_name_case_insensitively(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    for job_id, key_id, app_name, apk_sha256 in (('a', 'k1', 'Café', 'a' * 64), ('b', 'k1', ' CAFÉ ', 'b' * 64),
+                                                 ('c', 'k2', 'Café', 'c' * 64), ('d', 'k1', 'Café', None)):
+        job_manager.create_job(job_id, app_name, 'https://example.com', inputs={}, key_id=key_id)
+        if apk_sha256:
+            job_manager.set_completed(job_id, apk_sha256)
+
+    assert [job['job_id'] for job in job_manager.app_builds('k1', 'café')] == ['b', 'a']
+    assert [job['job_id'] for job in job_manager.app_builds('k1', 'Café', apk_sha256='a' * 64)] == ['a']
+
+
+def test_index_is_rebuilt_when_the_job_store_changes_behind_it(tmp_path):
+    job_manager = JobManager(str(tmp_path))
+    job_manager.create_job('a', 'App', 'https://example.com', inputs={}, key_id='k1')
+    assert [job['job_id'] for job in job_manager.list_jobs('k1')[0]] == ['a']
+
+    # Written without updating the index (an older version, or a crash between the two writes)
+    with open(job_manager.jobs_file) as f:
+        jobs = json.load(f)
+    jobs['b'] = dict(jobs['a'], job_id='b', created_at='2999-01-01T00:00:00')
+    with open(job_manager.jobs_file, 'w') as f:
+        json.dump(jobs, f)
+    assert not job_manager.index.is_current(store_version(job_manager.jobs_file))
+
+    assert [job['job_id'] for job in job_manager.list_jobs('k1')[0]] == ['b', 'a']
+    assert job_manager.index.is_current(store_version(job_manager.jobs_file))
+
+
+def test_index_with_an_older_layout_is_replaced(tmp_path):
+    path = tmp_path / 'build_jobs.index.sqlite3'
+    with closing(sqlite3.connect(path)) as conn:
+        conn.execute('CREATE TABLE job_index (job_id TEXT PRIMARY KEY, key_id TEXT,'
+                     ' created_at TEXT NOT NULL, status TEXT NOT NULL, summary TEXT NOT NULL)')
+        conn.execute('CREATE TABLE job_index_meta (name TEXT PRIMARY KEY, value TEXT)')
+        conn.commit()
+    job_manager = JobManager(str(tmp_path))
+    job_manager.create_job('a', 'App', 'https://example.com', inputs={}, key_id='k1')
+    job_manager.set_completed('a', 'a' * 64)
+    assert [job['job_id'] for job in job_manager.app_builds('k1', 'app')] == ['a']
+
+
+def test_app_builds_read_the_app_index(tmp_path):
+    index = JobIndex(str(tmp_path / 'index.sqlite3'))
+    with closing(index._connect()) as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT summary FROM job_index'
+            ' WHERE key_id IS ? AND app_key = ? AND apk_sha256 IS NOT NULL'
+            ' ORDER BY created_at DESC, job_id DESC LIMIT 20', ('k1', 'app')))
+    assert 'idx_job_index_app' in plan
+    assert 'TEMP B-TREE' not in plan
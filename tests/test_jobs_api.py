@@ -0,0 +1,57 @@
+from backend.job_manager import JobManager
+from backend.lazy import ProcessLocal
+from backend.rate_limiter import RateLimiter
+
+
+def test_job_listing_pages_with_a_cursor(sandbox, monkeypatch):
+    # Imported once the sandbox environment is in place
+    import backend.app as app_module
+
+    # The process-wide job manager and rate limiter may belong to an earlier test's sandbox
+    job_manager = JobManager(str(sandbox.root / 'db'))
+    monkeypatch.setattr(app_module, 'job_manager', ProcessLocal(lambda: job_manager))
+    monkeypatch.setattr(app_module, 'rate_limiter', ProcessLocal(RateLimiter))
+
+    client = app_module.app.test_client()
+    key = app_module.api_key_manager.generate_api_key('tenant')
+    other = app_module.api_key_manager.generate_api_key('other')
+    # Two jobs share a created_at, so the job_id tie-break decides their order
+    for job_id, created_at in (('j1', '2024-01-01T00:00:01'), ('j2', '2024-01-01T00:00:02'),
+                               ('j3', '2024-01-01T00:00:02'), ('j4', '2024-01-01T00:00:03'),
+                               ('j5', '2024-01-01T00:00:04')):
+        job_manager.create_job(job_id, 'App', 'https://example.com', inputs={}, key_id=key['key_id'])
+        job_manager.update_job(job_id, created_at=created_at)
+        # Finished before the first request starts the build queue, which
+        # would fail pending jobs it has no queue entry for
+        if job_id == 'j4':
+            job_manager.set_failed(job_id, 'boom')
+        else:
+            job_manager.set_completed(job_id, 'f' * 64)
+    job_manager.create_job('x1', 'App', 'https://example.com', inputs={}, key_id=other['key_id'])
+    job_manager.set_failed('x1', 'boom')
+    headers = {'X-API-Key': key['api_key']}
+
+    seen, cursor = [], None
+    while True:
+        query = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+        body = client.get('/api/v1/jobs', query_string=query, headers=headers).get_json()
+        assert len(body['jobs']) <= 2
+        seen.extend(job['job_id'] for job in body['jobs'])
+        cursor = body['next_cursor']
+        if not cursor:
+            break
+    assert seen == ['j5', 'j4', 'j3', 'j2', 'j1']
+
+    body = client.get('/api/v1/jobs', query_string={'status': 'failed'}, headers=headers).get_json()
+    assert [job['job_id'] for job in body['jobs']] == ['j4']
+    assert body['jobs'][0]['status_url'].endswith('/api/v1/status/j4')
+    assert 'download_url' not in body['jobs'][0]
+    body = client.get('/api/v1/jobs', query_string={'created_before': '2024-01-01T00:00:02'},
+                      headers=headers).get_json()
+    assert [job['job_id'] for job in body['jobs']] == ['j1']
+
+    assert client.get('/api/v1/jobs', query_string={'cursor': 'not-a-cursor'},
+                      headers=headers).status_code == 400
+    assert client.get('/api/v1/jobs', query_string={'limit': 0}, headers=headers).status_code == 400
+    assert client.get('/api/v1/jobs', query_string={'status': 'bogus'}, headers=headers).status_code == 400
+    assert client.get('/api/v1/jobs').status_code == 401
@@ -0,0 +1,73 @@
+import pstats
+import threading
+import time
+
+import pytest
+
+from backend.profiling import ProfileStore, StackSampler, profile_call
+
+
+def _work(n):
+    return sum(i * i for i in range(n))
+
+
+def test_profile_call_stores_a_loadable_profile(tmp_path):
+    store = ProfileStore(str(tmp_path / 'profiles'), keep=2)
+
+    assert profile_call(store, 'req-abc123', _work, 10000, route='/api/v1/status') == _work(10000)
+    stats = pstats.Stats(store.path_for('req-abc123'))
+    assert any(function == '_work' for _, _, function in stats.stats)
+    assert '_work' in store.render_text('req-abc123')
+    meta, = store.list()
+    assert meta['profile_id'] == 'req-abc123' and meta['route'] == '/api/v1/status'
+    assert meta['duration_seconds'] >= 0
+
+    # Only the newest PROFILE_KEEP profiles are kept
+    for job_id in ('a', 'b'):
+        time.sleep(0.01)
+        profile_call(store, f'job-{job_id}', _work, 10)
+    assert [meta['profile_id'] for meta in store.list()] == ['job-b', 'job-a']
+    assert not (tmp_path / 'profiles' / 'req-abc123.prof').exists()
+
+    with pytest.raises(ValueError):
+        store.path_for('../../etc/passwd')
+
+
+def test_profile_call_saves_the_profile_when_the_call_fails(tmp_path):
+    store = ProfileStore(str(tmp_path))
+
+    def fail():
+        raise RuntimeError('build failed')
+
+    with pytest.raises(RuntimeError):
+        profile_call(store, 'job-failed', fail)
+    pstats.Stats(store.path_for('job-failed'))
+
+
+def test_stack_sampler_starts_and_stops_cleanly(tmp_path):
+    store = ProfileStore(str(tmp_path))
+    done = threading.Event()
+
+    def busy():
+        while not done.is_set():
+            _work(1000)
+
+    worker = threading.Thread(target=busy, name='build-worker_1')
+    worker.start()
+    sampler = StackSampler(store, hz=500).start()
+    try:
+        time.sleep(0.2)
+    finally:
+        sampler.stop()
+        done.set()
+        worker.join()
+    assert not sampler._thread.is_alive()
+
+    with open(sampler.path) as f:
+        lines = f.read().splitlines()
+    assert lines and all(line.rpartition(' ')[2].isdigit() for line in lines)
+    # Pool threads are grouped by name, and the sampler leaves itself out
+    busy_stacks = [line for line in lines if line.startswith('build-worker;')]
+    assert any('busy (test_profiling.py' in line for line in busy_stacks)
+    assert not any('stack-sampler' in line for line in lines)
+    assert store.merged_stacks().count('build-worker;') == len(busy_stacks)
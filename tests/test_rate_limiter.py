@@ -0,0 +1,36 @@
+from backend.rate_limiter import RateLimiter
+
+
+def _limiter(tmp_path, **limits):
+    limiter = RateLimiter(str(tmp_path / 'rate_limits.sqlite3'), legacy_state_path=None)
+    limiter.default_limits.update(limits)
+    return limiter
+
+
+def test_limits_are_shared_between_instances(tmp_path):
+    key = {'key_id': 'k'}
+    first = _limiter(tmp_path, requests_per_minute=1, burst=2)
+    second = _limiter(tmp_path, requests_per_minute=1, burst=2)
+
+    assert first.check_request(key) is None
+    assert second.check_request(key) is None
+    denied = first.check_request(key)
+    assert denied['error'] == 'Rate limit exceeded' and denied['retry_after'] >= 1
+
+
+def test_build_quotas_and_refund(tmp_path):
+    key = {'key_id': 'k'}
+    limiter = _limiter(tmp_path, max_concurrent_builds=1, daily_builds=2)
+    other_process = _limiter(tmp_path, max_concurrent_builds=1, daily_builds=2)
+
+    assert limiter.acquire_build(key, 'a') is None
+    assert other_process.acquire_build(key, 'b')['error'] == 'Concurrent build quota exceeded'
+
+    # A job that joined another build gives back its daily quota too
+    limiter.release_build('k', 'a', refund=True)
+    assert other_process.acquire_build(key, 'b') is None
+    limiter.release_build('k', 'b')
+    assert limiter.acquire_build(key, 'c') is None
+    limiter.release_build('k', 'c')
+    assert limiter.acquire_build(key, 'd')['error'] == 'Daily build quota exceeded'
+    assert limiter.acquire_build(key, 'd', force=True) is None
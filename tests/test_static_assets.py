@@ -0,0 +1,100 @@
+import gzip
+import json
+
+import pytest
+from flask import Flask
+from werkzeug.exceptions import NotFound
+
+from backend.static_assets import (IMMUTABLE_CACHE_CONTROL, MANIFEST_NAME, REVALIDATE_CACHE_CONTROL,
+                                   StaticAssets, brotli, hashed_name)
+
+CSS = b'body { margin: 0; padding: 0; }\n' * 40
+JS = b'console.log("ready");\n'
+
+
+def _client(tmp_path):
+    source = tmp_path / 'frontend'
+    source.mkdir()
+    (source / 'style.css').write_bytes(CSS)
+    (source / 'app.js').write_bytes(JS)
+    (source / 'index.html').write_text(
+        '<link rel="stylesheet" href="style.css"><script src="app.js"></script>')
+    # Next to the frontend, never servable
+    (tmp_path / 'secret.txt').write_text('secret')
+
+    assets = StaticAssets(source)
+    app = Flask(__name__)
+
+    @app.route('/')
+    def index():
+        return assets.send('index.html')
+
+    @app.route('/<path:path>')
+    def static_file(path):
+        return assets.send(path)
+
+    return app, app.test_client(), assets
+
+
+def test_html_references_fingerprinted_names(tmp_path):
+    _, client, assets = _client(tmp_path)
+    response = client.get('/')
+    css_name, js_name = hashed_name('style.css', CSS), hashed_name('app.js', JS)
+    assert f'href="{css_name}"' in response.text
+    assert f'src="{js_name}"' in response.text
+    assert response.headers['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+    manifest = json.loads((assets.output_dir / MANIFEST_NAME).read_text())
+    assert manifest['assets'] == {'style.css': css_name, 'app.js': js_name}
+
+
+def test_hashed_assets_are_immutable(tmp_path):
+    _, client, _ = _client(tmp_path)
+    response = client.get('/' + hashed_name('app.js', JS))
+    assert response.data == JS
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert 'javascript' in response.headers['Content-Type']
+
+    # The un-hashed name still works but must be revalidated
+    response = client.get('/app.js')
+    assert response.data == JS
+    assert response.headers['Cache-Control'] == REVALIDATE_CACHE_CONTROL
+
+
+def test_precompressed_variant_matches_accept_encoding(tmp_path):
+    _, client, _ = _client(tmp_path)
+    path = '/' + hashed_name('style.css', CSS)
+
+    response = client.get(path, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert response.headers['Content-Type'].startswith('text/css')
+    assert gzip.decompress(response.data) == CSS
+
+    response = client.get(path, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.data == CSS
+
+    response = client.get(path, headers={'Accept-Encoding': 'br, gzip'})
+    if brotli is not None:
+        assert response.headers['Content-Encoding'] == 'br'
+        assert brotli.decompress(response.data) == CSS
+    else:
+        assert response.headers['Content-Encoding'] == 'gzip'
+
+    # Too small to be worth compressing
+    response = client.get('/' + hashed_name('app.js', JS), headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+
+
+@pytest.mark.parametrize('path', ['../secret.txt', '../../secret.txt', 'dist/../../secret.txt',
+                                  '%2e%2e/%2e%2e/secret.txt'])
+def test_paths_outside_the_frontend_are_not_served(tmp_path, path):
+    app, client, assets = _client(tmp_path)
+    response = client.get('/' + path)
+    assert response.status_code == 404
+    assert b'secret' not in response.data
+
+    # Straight to send(), without the URL normalisation the client applies
+    with app.test_request_context('/'):
+        with pytest.raises(NotFound):
+            assets.send(path.replace('%2e', '.'))
@@ -0,0 +1,52 @@
+import os
+import time
+
+from backend.blob_store import BlobStore
+from backend.job_manager import JobManager
+from backend.storage_manager import StorageManager
+
+
+def _completed_build(job_manager, store, job_id, app_name, data):
+    job_manager.create_job(job_id, app_name, 'https://example.com', key_id='key')
+    sha256 = store.put_bytes(data, owner=f'job:{job_id}')
+    job_manager.set_completed(job_id, sha256)
+    return sha256
+
+
+def _storage(tmp_path, job_manager, store, max_bytes):
+    return StorageManager(str(tmp_path / 'generated'), job_manager, max_bytes=max_bytes, ttl_seconds=0,
+                          sweep_interval=0, blob_store=store)
+
+
+def test_latest_builds_of_an_app_still_count_against_the_budget(tmp_path):
+    job_manager = JobManager(str(tmp_path / 'db'))
+    store = BlobStore(tmp_path / 'blobs')
+    hashes = [_completed_build(job_manager, store, job_id, app_name, job_id.encode() * 1000)
+              for job_id, app_name in (('a', 'App'), ('b', 'App'), ('c', 'App'), ('d', 'Other'))]
+    # Most recently downloaded first: a, d, c, b
+    now = time.time()
+    for age, index in enumerate((0, 3, 2, 1)):
+        os.utime(store.path(hashes[index]), (now - age * 60, now - 3600))
+
+    # The superseded build goes first even though it was used most recently,
+    # then the least recently used of the latest builds
+    stats = _storage(tmp_path, job_manager, store, max_bytes=2500).sweep()
+    assert stats['expired_jobs'] == 2
+    assert [store.exists(sha256) for sha256 in hashes] == [False, False, True, True]
+    assert store.total_bytes() <= 2500
+
+
+def test_budget_eviction_keeps_a_blob_referenced_since_the_snapshot(tmp_path):
+    job_manager = JobManager(str(tmp_path / 'db'))
+    store = BlobStore(tmp_path / 'blobs')
+    _completed_build(job_manager, store, 'a', 'App', b'1' * 1000)
+    shared = _completed_build(job_manager, store, 'b', 'Other', b'2' * 1000)
+    _completed_build(job_manager, store, 'c', 'Other', b'3' * 1000)
+    _completed_build(job_manager, store, 'd', 'Other', b'4' * 1000)
+    # A new build of the same APK published it and hasn't completed yet
+    store.add_ref(shared, 'job:e')
+
+    _storage(tmp_path, job_manager, store, max_bytes=2500).sweep()
+    assert store.exists(shared) and store.refcount(shared) == 2
+    assert job_manager.get_job('b')['status'] == 'completed'
+    assert store.total_bytes() <= 2500
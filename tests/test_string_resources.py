@@ -0,0 +1,92 @@
+import hashlib
+import zipfile
+
+import pytest
+
+from apk_builder.string_resources import (escape_string_resource, index_app_name_files,
+                                          parse_app_names, set_app_names)
+
+
+def _strings(name):
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<resources>\n'
+            f'    <string name="other">x</string>\n    <string name="app_name">{name}</string>\n'
+            '</resources>\n')
+
+
+@pytest.fixture
+def decompiled(tmp_path):
+    (tmp_path / 'res' / 'values').mkdir(parents=True)
+    (tmp_path / 'res' / 'values' / 'strings.xml').write_text(_strings('Template'))
+    (tmp_path / 'res' / 'values-pt').mkdir()
+    (tmp_path / 'res' / 'values-pt' / 'strings.xml').write_text(_strings('Modelo'))
+    (tmp_path / 'res' / 'values-es').mkdir()
+    (tmp_path / 'res' / 'values-es' / 'strings.xml').write_text('<resources/>\n')
+    return tmp_path
+
+
+def test_parse_app_names_normalizes_locales():
+    assert parse_app_names('{"FR": "A", "pt_br": "B", "zh-rTW": "C"}') == \
+        {'fr': 'A', 'pt-rBR': 'B', 'zh-rTW': 'C'}
+    assert parse_app_names('') == {}
+    for raw in ('[1]', '{"french": "a"}', '{"fr": " "}', 'nope'):
+        with pytest.raises(ValueError):
+            parse_app_names(raw)
+
+
+def test_escape_string_resource():
+    assert escape_string_resource("Tom's <App> & \"co\"") == 'Tom\\\'s &lt;App&gt; &amp; \\"co\\"'
+    assert escape_string_resource('@home') == '\\@home'
+
+
+def test_indexed_files_are_rewritten_per_locale(decompiled):
+    files = index_app_name_files(decompiled)
+    assert files == ['res/values/strings.xml', 'res/values-pt/strings.xml']
+
+    changed = set_app_names(decompiled, files, 'My App', {'pt': 'Meu App'})
+    assert len(changed) == 2
+    assert '>My App<' in (decompiled / 'res/values/strings.xml').read_text()
+    assert '>Meu App<' in (decompiled / 'res/values-pt/strings.xml').read_text()
+    assert '<string name="other">x</string>' in (decompiled / 'res/values/strings.xml').read_text()
+
+
+def test_unchanged_files_are_left_alone(decompiled):
+    files = index_app_name_files(decompiled)
+    inode = (decompiled / 'res/values-pt/strings.xml').stat().st_ino
+    changed = set_app_names(decompiled, files, 'Template', {'pt': 'Modelo'})
+    assert changed == []
+    assert (decompiled / 'res/values-pt/strings.xml').stat().st_ino == inode
+
+
+def test_untranslated_locale_gets_a_new_file(decompiled):
+    files = index_app_name_files(decompiled)
+    changed = set_app_names(decompiled, files, 'My App', {'fr': 'Mon Appli', 'es': 'Mi App'})
+
+    assert decompiled / 'res/values-fr/strings.xml' in changed
+    assert '>Mon Appli<' in (decompiled / 'res/values-fr/strings.xml').read_text()
+    # An existing resource file without app_name is kept, the name goes next to it
+    assert (decompiled / 'res/values-es/strings.xml').read_text() == '<resources/>\n'
+    assert '>Mi App<' in (decompiled / 'res/values-es/app_name.xml').read_text()
+    assert index_app_name_files(decompiled) == [
+        'res/values/strings.xml', 'res/values-es/app_name.xml',
+        'res/values-fr/strings.xml', 'res/values-pt/strings.xml']
+
+
+def test_new_locale_changes_the_built_apk(sandbox):
+    from apk_builder.builder import APKBuilder
+
+    def build(app_names=None):
+        builder = APKBuilder()
+        try:
+            apk_path = builder.build('My App', 'https://example.com', app_names=app_names)
+            with open(apk_path, 'rb') as f:
+                digest = hashlib.sha256(f.read()).hexdigest()
+            with zipfile.ZipFile(apk_path) as apk:
+                return digest, apk.read('resources.arsc')
+        finally:
+            builder.cleanup()
+
+    plain, plain_table = build()
+    assert build()[0] == plain
+    localized, table = build({'fr': 'Mon Appli'})
+    assert localized != plain
+    assert b'Mon Appli' in table and b'Mon Appli' not in plain_table
@@ -0,0 +1,48 @@
+import os
+import hashlib
+
+from apk_builder.builder import APKBuilder
+from apk_builder.template_cache import BUILD_DIRNAME, get_template_cache
+from benchmarks.fixtures import png_bytes
+
+
+def _snapshot(root):
+    """{relative path: sha256} of a tree, without apktool's build/ intermediates"""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == str(root):
+            dirnames[:] = [name for name in dirnames if name != BUILD_DIRNAME]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, root)] = hashlib.sha256(f.read()).hexdigest()
+    return files
+
+
+def test_builds_do_not_change_the_cached_template(sandbox):
+    cache = get_template_cache()
+    apk_path = 'android_templates_apks/base_1.apk'
+    decompiled = cache.ensure_template('base_1', apk_path)
+    before = _snapshot(decompiled)
+
+    icon = sandbox.root / 'icon.png'
+    icon.write_bytes(png_bytes(256, (200, 40, 40, 255)))
+    builder = APKBuilder('base_1')
+    try:
+        builder.build('Changed', 'https://changed.example', str(icon), {'fr': 'Changé'})
+    finally:
+        builder.cleanup()
+    assert _snapshot(decompiled) == before
+
+    # Even a tool that rewrites the files a build touches in place leaves the cache alone
+    checkout = sandbox.root / 'checkout'
+    cache.checkout('base_1', apk_path, checkout)
+    for relative in ('AndroidManifest.xml', 'apktool.yml', 'res/values/strings.xml',
+                     'smali_classes4/com/web2app/bench/MainActivity.smali',
+                     'res/mipmap-hdpi/ic_launcher.png'):
+        with open(checkout / relative, 'r+b') as f:
+            f.write(b'rewritten in place')
+    assert _snapshot(decompiled) == before
+    # Files builds never edit are still shared with the cache
+    layout = 'res/layout/layout_0.xml'
+    assert os.stat(checkout / layout).st_ino == os.stat(decompiled / layout).st_ino
@@ -0,0 +1,41 @@
+import shutil
+import subprocess
+
+import pytest
+
+from apk_builder.tool_daemon import ApktoolDaemon
+
+STUB_APKTOOL = '''
+package brut.apktool;
+
+public class Main {
+    public static void main(String[] args) {
+        if (args[0].equals("fail")) {
+            System.err.println("decode failed");
+            System.exit(1);
+        }
+        System.out.println("ok " + args[0]);
+    }
+}
+'''
+
+
+@pytest.mark.skipif(not shutil.which('javac'), reason='needs a JDK')
+def test_failing_command_leaves_the_daemon_running(tmp_path):
+    source = tmp_path / 'src' / 'brut' / 'apktool' / 'Main.java'
+    source.parent.mkdir(parents=True)
+    source.write_text(STUB_APKTOOL)
+    subprocess.run(['javac', '-d', str(tmp_path / 'classes'), str(source)], check=True)
+
+    daemon = ApktoolDaemon(str(tmp_path / 'classes'))
+    try:
+        failed = daemon.run(['fail'])
+        assert failed.returncode == 1
+        assert 'decode failed' in failed.stderr
+        assert daemon.alive()
+
+        result = daemon.run(['d'])
+        assert (result.returncode, result.stdout) == (0, 'ok d\n')
+        assert daemon.requests == 2
+    finally:
+        daemon.stop()
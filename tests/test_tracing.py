@@ -0,0 +1,164 @@
+import json
+import socket
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+import common.tracing as tracing
+from common.tracing import JSONLExporter, OTLPExporter, SpanContext, Tracer, run_collector
+
+TRACE_ID = '4bf92f3577b34da6a3ce929d0e0e4736'
+PARENT_ID = '00f067aa0ba902b7'
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+def _tracer(sample_rate=1.0):
+    exporter = ListExporter()
+    return Tracer(exporter, sample_rate=sample_rate), exporter
+
+
+def test_traceparent_parsing():
+    context = SpanContext.from_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-01')
+    assert (context.trace_id, context.span_id, context.sampled) == (TRACE_ID, PARENT_ID, True)
+    assert context.traceparent == f'00-{TRACE_ID}-{PARENT_ID}-01'
+    assert not SpanContext.from_traceparent(f'00-{TRACE_ID}-{PARENT_ID}-00').sampled
+
+    for malformed in (None, '', 'garbage', f'00-{TRACE_ID}-{PARENT_ID}',
+                      f'00-{TRACE_ID[:-1]}-{PARENT_ID}-01', f'00-{"x" * 32}-{PARENT_ID}-01',
+                      f'00-{TRACE_ID}-{PARENT_ID}-zz'):
+        assert SpanContext.from_traceparent(malformed) is None
+
+
+def test_spans_nest_and_continue_an_incoming_trace():
+    tracer, exporter = _tracer()
+    with tracer.span('request', parent=f'00-{TRACE_ID}-{PARENT_ID}-01', route='/build') as root:
+        with tracer.span('build.decompile'):
+            assert tracer.current_traceparent().startswith(f'00-{TRACE_ID}-')
+            with tracer.child_span('job_store.lock_wait') as lock_span:
+                lock_span.set_attribute('waited', True)
+        root.set_attribute('status', 202)
+    assert tracer.current_context() is None
+    # Low-level spans outside a trace are not recorded
+    with tracer.child_span('job_store.lock_wait'):
+        pass
+    tracer.flush()
+
+    spans = {span['name']: span for span in exporter.spans}
+    assert set(spans) == {'request', 'build.decompile', 'job_store.lock_wait'}
+    assert {span['trace_id'] for span in spans.values()} == {TRACE_ID}
+    assert spans['request']['parent_id'] == PARENT_ID
+    assert spans['build.decompile']['parent_id'] == spans['request']['span_id']
+    assert spans['job_store.lock_wait']['parent_id'] == spans['build.decompile']['span_id']
+    assert spans['request']['attributes'] == {'route': '/build', 'status': 202}
+    assert spans['job_store.lock_wait']['attributes'] == {'waited': True}
+
+
+def test_errors_are_recorded_and_reraised():
+    tracer, exporter = _tracer()
+    with pytest.raises(ValueError):
+        with tracer.span('build'):
+            raise ValueError('bad icon')
+    tracer.flush()
+    assert exporter.spans[0]['error'] == 'ValueError: bad icon'
+
+
+def test_sampling_is_decided_at_the_root_and_propagated():
+    tracer, exporter = _tracer(sample_rate=0.0)
+    with tracer.span('request') as span:
+        assert span is tracing.NOOP_SPAN
+        traceparent = tracer.current_traceparent()
+        with tracer.span('build'):
+            pass
+    assert traceparent.endswith('-00')
+    # A sampled parent is honoured whatever the local rate
+    with tracer.span('worker', parent=f'00-{TRACE_ID}-{PARENT_ID}-01'):
+        pass
+
+    recording, recorded = _tracer(sample_rate=1.0)
+    # ...and so is an unsampled one
+    with recording.span('worker', parent=traceparent):
+        pass
+    tracer.flush()
+    recording.flush()
+    assert [span['name'] for span in exporter.spans] == ['worker']
+    assert recorded.spans == []
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(None)
+    with tracer.span('request') as span:
+        span.set_attribute('ignored', 1)
+        assert tracer.current_context() is None
+    tracer.record('queue_wait', 0, 1)
+    assert not tracer.enabled and not tracer._buffer
+
+
+def test_jsonl_exporter_appends_one_span_per_line(tmp_path):
+    tracer = Tracer(JSONLExporter(str(tmp_path / 'traces' / 'spans.jsonl')))
+    tracer.record('queue_wait', 100.0, 100.25, parent=f'00-{TRACE_ID}-{PARENT_ID}-01', job_id='a')
+    with tracer.span('build'):
+        pass
+    tracer.flush()
+
+    lines = (tmp_path / 'traces' / 'spans.jsonl').read_text().splitlines()
+    spans = [json.loads(line) for line in lines]
+    assert [span['name'] for span in spans] == ['queue_wait', 'build']
+    assert spans[0]['duration_ms'] == 250.0
+    assert spans[0]['attributes'] == {'job_id': 'a'}
+
+
+def test_otlp_exporter_round_trips_through_the_collector(tmp_path):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    output = tmp_path / 'collected.jsonl'
+    threading.Thread(target=run_collector, args=(port, str(output)), daemon=True).start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            break
+        except OSError:
+            time.sleep(0.02)
+
+    tracer, exporter = _tracer()
+    with tracer.span('build', base_version='base_1', attempt=2, ratio=0.5, warm=True):
+        with tracer.span('build.sign'):
+            pass
+    tracer.flush()
+    OTLPExporter(f'http://127.0.0.1:{port}/v1/traces').export(exporter.spans)
+
+    collected = [json.loads(line) for line in output.read_text().splitlines()]
+    assert len(collected) == 2
+    for sent, received in zip(exporter.spans, collected):
+        for key in ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'error', 'service', 'pid'):
+            assert received[key] == sent[key], key
+        assert received['duration_ms'] == pytest.approx(sent['duration_ms'], abs=0.01)
+
+
+def test_flask_requests_continue_and_return_the_traceparent(monkeypatch):
+    tracer, exporter = _tracer()
+    monkeypatch.setattr(tracing, 'tracer', tracer)
+    app = Flask(__name__)
+    tracing.trace_flask_app(app)
+
+    @app.route('/jobs/<job_id>')
+    def job(job_id):
+        return {'traceparent': tracer.current_traceparent()}
+
+    response = app.test_client().get('/jobs/a', headers={'traceparent': f'00-{TRACE_ID}-{PARENT_ID}-01'})
+    tracer.flush()
+    span, = exporter.spans
+    assert response.get_json()['traceparent'] == response.headers['traceparent']
+    assert response.headers['traceparent'] == f"00-{TRACE_ID}-{span['span_id']}-01"
+    assert span['name'] == 'GET /jobs/<job_id>'
+    assert span['parent_id'] == PARENT_ID
+    assert span['attributes']['http.status_code'] == 200
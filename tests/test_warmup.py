@@ -0,0 +1,42 @@
+from backend.warmup import Warmup
+
+
+def _warmup(steps, retries=3):
+    warmup = Warmup(None, 1, enabled=True, retries=retries, retry_delay=0)
+    warmup.steps = list(steps.items())
+    warmup.components = {name: {'status': 'pending'} for name in steps}
+    return warmup
+
+
+def _flaky(failures):
+    calls = []
+
+    def step():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise OSError('not yet')
+        return 'ok'
+    return step
+
+
+def test_failed_components_are_retried_until_ready():
+    warmup = _warmup({'config': _flaky(2), 'job_store': lambda: 'ok'})
+    assert not warmup.ready
+
+    warmup.run()
+    assert warmup.ready
+    assert warmup.components['config'] == {'status': 'ready', 'detail': 'ok', 'attempts': 3,
+                                           'seconds': warmup.components['config']['seconds']}
+
+
+def test_components_with_a_fallback_count_as_ready_when_they_fail():
+    warmup = _warmup({'templates': _flaky(10), 'signing': lambda: 'ok'}, retries=2)
+    warmup.run()
+    assert warmup.components['templates']['status'] == 'degraded'
+    assert warmup.components['templates']['attempts'] == 3
+    assert warmup.ready
+
+    warmup = _warmup({'signing': _flaky(10)}, retries=2)
+    warmup.run()
+    assert warmup.components['signing']['status'] == 'failed'
+    assert not warmup.ready
@@ -0,0 +1,216 @@
+import json
+import time
+import socket
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend.job_manager import JobManager
+from backend.webhooks import WebhookDispatcher, key_secret, sign, validate_callback_url, verify_signature
+
+
+def test_verify_signature_accepts_only_fresh_untampered_deliveries():
+    secret = key_secret(b'master', 'key-1')
+    body = b'{"event":"build.completed","job_id":"a"}'
+    now = int(time.time())
+    signature = sign(secret, now, body)
+
+    assert verify_signature(secret, str(now), body, signature)
+    assert not verify_signature(secret, now, body + b' ', signature)
+    assert not verify_signature(key_secret(b'master', 'key-2'), now, body, signature)
+    assert not verify_signature(secret, now + 1, body, signature)
+    # Replays outside the tolerance window fail even with a valid signature
+    stale = now - 301
+    assert not verify_signature(secret, stale, body, sign(secret, stale, body))
+    assert not verify_signature(secret, 'soon', body, signature)
+    assert not verify_signature(secret, now, body, None)
+
+
+class _Receiver:
+    """Local HTTP endpoint that records deliveries and answers with queued statuses"""
+
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.received = threading.Event()
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                receiver.requests.append((dict(self.headers), body))
+                status, headers = receiver.responses.pop(0) if receiver.responses else (200, {})
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                receiver.received.set()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.port = self.server.server_address[1]
+        self.url = f'http://127.0.0.1:{self.port}/hook'
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def receiver():
+    receiver = _Receiver()
+    yield receiver
+    receiver.close()
+
+
+def _finished_job(job_manager, job_id, url, status='completed'):
+    job_manager.create_job(job_id, 'App', 'https://example.com', inputs={}, key_id='k1',
+                           webhook={'url': url, 'status_url': f'https://api.test/status/{job_id}',
+                                    'download_url': f'https://api.test/download/{job_id}'})
+    if status == 'completed':
+        job_manager.set_completed(job_id, 'f' * 64)
+    else:
+        job_manager.set_failed(job_id, 'boom')
+
+
+def _dispatcher(tmp_path, **kwargs):
+    job_manager = JobManager(str(tmp_path))
+    return job_manager, WebhookDispatcher(job_manager, master_secret=b'master', workers=2,
+                                          poll_interval=3600, **kwargs)
+
+
+def test_delivery_is_signed_and_recorded(tmp_path, receiver, monkeypatch):
+    monkeypatch.setenv('WEBHOOK_ALLOW_PRIVATE', '1')
+    job_manager, dispatcher = _dispatcher(tmp_path)
+    _finished_job(job_manager, 'a', receiver.url)
+
+    [job] = job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10)
+    assert dispatcher.deliver(job)['status'] == 'delivered'
+
+    [(headers, body)] = receiver.requests
+    assert verify_signature(dispatcher.secret_for('k1'), headers['X-Webhook-Timestamp'], body,
+                            headers['X-Webhook-Signature'])
+    payload = json.loads(body)
+    assert (payload['event'], payload['job_id'], payload['attempt']) == ('job.completed', 'a', 1)
+    assert payload['download_url'] == 'https://api.test/download/a'
+    webhook = job_manager.get_job('a')['webhook']
+    assert (webhook['status'], webhook['last_status_code'], webhook['owner']) == ('delivered', 200, None)
+    assert job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10) == []
+
+
+def test_retryable_failures_back_off_until_attempts_run_out(tmp_path, receiver, monkeypatch):
+    monkeypatch.setenv('WEBHOOK_ALLOW_PRIVATE', '1')
+    job_manager, dispatcher = _dispatcher(tmp_path, max_attempts=2, backoff_seconds=1)
+    _finished_job(job_manager, 'a', receiver.url, status='failed')
+    receiver.responses = [(503, {'Retry-After': '120'}), (503, {})]
+
+    [job] = job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10)
+    state = dispatcher.deliver(job)
+    assert (state['status'], state['last_error']) == ('retrying', 'HTTP 503')
+    # Retry-After outweighs the one-second backoff
+    delay = (datetime.fromisoformat(state['next_attempt_at']) - datetime.now()).total_seconds()
+    assert 100 < delay <= 120
+    assert job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10) == []
+
+    webhook = job_manager.get_job('a')['webhook']
+    job_manager.update_job('a', webhook=dict(webhook, next_attempt_at=datetime.now().isoformat()))
+    [job] = job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10)
+    assert dispatcher.deliver(job)['status'] == 'failed'
+    assert [headers['X-Webhook-Attempt'] for headers, _ in receiver.requests] == ['1', '2']
+    assert job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10) == []
+
+
+def test_client_errors_are_not_retried(tmp_path, receiver, monkeypatch):
+    monkeypatch.setenv('WEBHOOK_ALLOW_PRIVATE', '1')
+    job_manager, dispatcher = _dispatcher(tmp_path)
+    _finished_job(job_manager, 'a', receiver.url)
+    receiver.responses = [(410, {})]
+
+    [job] = job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10)
+    state = dispatcher.deliver(job)
+    assert (state['status'], state['attempts'], state['last_status_code']) == ('failed', 1, 410)
+
+
+def test_claims_are_leased_to_one_owner(tmp_path, receiver, monkeypatch):
+    monkeypatch.setenv('WEBHOOK_ALLOW_PRIVATE', '1')
+    job_manager, dispatcher = _dispatcher(tmp_path)
+    _finished_job(job_manager, 'a', receiver.url)
+
+    assert len(job_manager.claim_webhooks('owner-1', 60, 10)) == 1
+    assert job_manager.claim_webhooks('owner-2', 60, 10) == []
+
+    # An expired lease (the owner died mid-attempt) is taken over, and the
+    # old owner's late result is then ignored
+    webhook = job_manager.get_job('a')['webhook']
+    job_manager.update_job('a', webhook=dict(webhook, lease_until=datetime.now().isoformat()))
+    [job] = job_manager.claim_webhooks(dispatcher.owner, 60, 10)
+    assert job_manager.set_webhook_state('a', 'owner-1', status='delivered') is None
+    assert dispatcher.deliver(job)['status'] == 'delivered'
+    assert len(receiver.requests) == 1
+
+
+def test_private_callbacks_are_rejected(tmp_path, receiver, monkeypatch):
+    monkeypatch.delenv('WEBHOOK_ALLOW_PRIVATE', raising=False)
+    assert validate_callback_url(receiver.url) == 'callback_url must resolve to a public address'
+    assert validate_callback_url('http://localhost/hook') == 'callback_url must resolve to a public address'
+    assert validate_callback_url('http://[::1]/hook') == 'callback_url must resolve to a public address'
+    assert validate_callback_url('file:///etc/passwd') == 'callback_url must be an absolute http(s) URL'
+    assert validate_callback_url('http://93.184.216.34/hook') is None
+
+    # Accepted while private callbacks were allowed, rejected at send time
+    job_manager, dispatcher = _dispatcher(tmp_path)
+    _finished_job(job_manager, 'a', receiver.url)
+    [job] = job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10)
+    state = dispatcher.deliver(job)
+    assert (state['status'], state['attempts']) == ('failed', 1)
+    assert 'public address' in state['last_error']
+    assert receiver.requests == []
+
+
+def test_delivery_connects_to_the_checked_address(tmp_path, receiver, monkeypatch):
+    # hooks.test first resolves to a public address, which the test routes to
+    # the local receiver; any later lookup (where a rebinding attacker would
+    # answer with a private address) fails
+    public_address = '93.184.216.34'
+    lookups = []
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host == public_address:
+            return real_getaddrinfo('127.0.0.1', port, *args, **kwargs)
+        if host != 'hooks.test':
+            return real_getaddrinfo(host, port, *args, **kwargs)
+        lookups.append(host)
+        if len(lookups) > 1:
+            raise socket.gaierror('rebound')
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (public_address, port or 0))]
+
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+    monkeypatch.delenv('WEBHOOK_ALLOW_PRIVATE', raising=False)
+    job_manager, dispatcher = _dispatcher(tmp_path)
+    _finished_job(job_manager, 'a', f'http://hooks.test:{receiver.port}/hook')
+
+    [job] = job_manager.claim_webhooks(dispatcher.owner, dispatcher.lease_seconds, 10)
+    assert dispatcher.deliver(job)['status'] == 'delivered'
+    assert lookups == ['hooks.test']
+    [(headers, _)] = receiver.requests
+    assert headers['Host'] == f'hooks.test:{receiver.port}'
+
+
+def test_dispatcher_delivers_when_a_job_finishes(tmp_path, receiver, monkeypatch):
+    monkeypatch.setenv('WEBHOOK_ALLOW_PRIVATE', '1')
+    job_manager, dispatcher = _dispatcher(tmp_path)
+    dispatcher.start()
+    _finished_job(job_manager, 'a', receiver.url)
+
+    assert receiver.received.wait(10)
+    deadline = time.monotonic() + 10
+    while job_manager.get_job('a')['webhook']['status'] != 'delivered' and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert job_manager.get_job('a')['webhook']['status'] == 'delivered'
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+from apk_builder.workspace import DISK, RAM, WorkspaceBudget
+
+
+def test_processes_sharing_a_tmpfs_share_one_budget(tmp_path):
+    root = tmp_path / 'shm'
+    root.mkdir()
+    # Two processes' budgets over the same mount: room for two builds in total
+    first, second = (WorkspaceBudget(str(root), budget_mb=2, reserve_mb=1) for _ in range(2))
+
+    a, kind_a = first.allocate()
+    b, kind_b = second.allocate()
+    c, kind_c = first.allocate()
+    assert (kind_a, kind_b, kind_c) == (RAM, RAM, DISK)
+    assert second.stats()['reserved_bytes'] == 2 * 1024 * 1024
+
+    first.release(kind_a, a)
+    d, kind_d = second.allocate()
+    assert kind_d == RAM and d.parent == root
+    for work_dir in (a, b, c, d):
+        work_dir.rmdir()
+
+
+def test_reservations_of_dead_processes_are_dropped(tmp_path):
+    budget = WorkspaceBudget(str(tmp_path), budget_mb=1, reserve_mb=1)
+    work_dir, kind = budget.allocate()
+    assert kind == RAM
+
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                          capture_output=True, text=True, check=True)
+    with budget._connect() as conn:
+        conn.execute('UPDATE reservations SET pid = ?', (int(dead.stdout),))
+    assert budget.allocate()[1] == RAM
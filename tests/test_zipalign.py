@@ -0,0 +1,82 @@
+import os
+import struct
+import zipfile
+
+from apk_builder.builder import APKBuilder
+from apk_builder.zipalign import (ALIGNMENT_EXTRA_ID, LOCAL_HEADER, PAGE_ALIGNMENT, _raw_data_offset,
+                                  align_apk)
+
+
+def _entries():
+    return {
+        'classes.dex': b'dex\n' * 1000,
+        'AndroidManifest.xml': b'<manifest/>' * 50,
+        'resources.arsc': b'\x02\x00' * 333,
+        'res/drawable/icon.png': b'\x89PNG' + b'x' * 101,
+        'lib/arm64-v8a/libapp.so': b'\x7fELF' + b'y' * 5003,
+        'lib/armeabi-v7a/libapp.so': b'\x7fELF' + b'z' * 77,
+    }
+
+
+def _source_apk(path, date_time=(2024, 5, 1, 12, 0, 0), order=reversed, compresslevel=None):
+    entries = _entries()
+    # Everything deflated, in an unsorted order, as apktool/jarsigner might leave it
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, compresslevel=compresslevel) as archive:
+        for name in order(list(entries)):
+            archive.writestr(zipfile.ZipInfo(name, date_time), entries[name], zipfile.ZIP_DEFLATED)
+    return entries
+
+
+def test_stored_entries_are_aligned(tmp_path):
+    entries = _source_apk(tmp_path / 'in.apk')
+    align_apk(tmp_path / 'in.apk', tmp_path / 'out.apk')
+
+    with zipfile.ZipFile(tmp_path / 'out.apk') as archive, open(tmp_path / 'out.apk', 'rb') as f:
+        assert archive.testzip() is None
+        infos = archive.infolist()
+        assert [info.filename for info in infos] == sorted(entries)
+        for info in infos:
+            assert archive.read(info) == entries[info.filename]
+            offset = _raw_data_offset(f, info)
+            if info.filename.endswith(('.arsc', '.png', '.so')):
+                assert info.compress_type == zipfile.ZIP_STORED
+                alignment = PAGE_ALIGNMENT if info.filename.endswith('.so') else 4
+                assert offset % alignment == 0, info.filename
+                # Padding uses Android zipalign's extra field, which records the alignment
+                f.seek(info.header_offset + LOCAL_HEADER.size + len(info.filename))
+                extra_id, _, recorded = struct.unpack('<HHH', f.read(6))
+                assert (extra_id, recorded) == (ALIGNMENT_EXTRA_ID, alignment)
+            else:
+                assert info.compress_type == zipfile.ZIP_DEFLATED
+
+
+def test_alignment_is_reproducible(tmp_path):
+    # Same entries with different timestamps, order and compression level
+    _source_apk(tmp_path / 'first.apk')
+    _source_apk(tmp_path / 'second.apk', date_time=(2025, 11, 30, 23, 59, 58), order=sorted,
+                compresslevel=9)
+    os.utime(tmp_path / 'second.apk', (1, 1))
+    align_apk(tmp_path / 'first.apk', tmp_path / 'a.apk')
+    align_apk(tmp_path / 'second.apk', tmp_path / 'b.apk')
+    assert (tmp_path / 'a.apk').read_bytes() == (tmp_path / 'b.apk').read_bytes()
+
+    # Aligning an aligned APK changes nothing
+    align_apk(tmp_path / 'a.apk', tmp_path / 'c.apk')
+    assert (tmp_path / 'c.apk').read_bytes() == (tmp_path / 'a.apk').read_bytes()
+
+
+def test_signed_and_aligned_builds_are_reproducible(sandbox):
+    # Two builds of the same inputs: apktool output differing only in timestamps
+    outputs = []
+    for date_time in ((2024, 5, 1, 12, 0, 0), (2025, 1, 2, 3, 4, 6)):
+        builder = APKBuilder('base_1')
+        try:
+            builder.output_apk = builder.work_dir / 'modified.apk'
+            _source_apk(builder.output_apk, date_time)
+            os.utime(builder.output_apk, (date_time[0], date_time[0]))
+            builder.sign()
+            builder.align()
+            outputs.append(builder.output_apk.read_bytes())
+        finally:
+            builder.cleanup()
+    assert outputs[0] == outputs[1]